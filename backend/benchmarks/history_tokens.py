@@ -0,0 +1,51 @@
+"""
+会話履歴ポリシーのベンチマーク
+
+セッションの往復数を増やしながら、プロンプトに含める履歴のトークン数と読み込むメッセージ数を計測する。
+ポリシーなし（全履歴）では線形に増え、ポリシーありでは上限で一定になることを確認する。
+
+使い方（backendディレクトリで実行）:
+    python -m benchmarks.history_tokens --turns 200 --max-turns 10 --max-tokens 3000
+"""
+import argparse
+import asyncio
+import json
+from db.chat.inmemory import InMemoryChatRepo
+from db.chat.models import ChatMessage
+from utils.history_policy import HistoryPolicy
+
+USER_MESSAGE = "GCASのAzure環境でユーザーを追加する手順と、権限を付与する際の注意点を教えてください。"
+ASSISTANT_MESSAGE = "ユーザーの追加はGCASポータルから申請し、承認後にEntra IDへ反映されます。" * 8
+
+async def run(turns: int, max_turns: int, max_tokens: int, step: int) -> None:
+    repo = InMemoryChatRepo()
+    policy = HistoryPolicy(repo, max_turns=max_turns, max_tokens=max_tokens)
+    for turn in range(1, turns + 1):
+        await repo.save_chat_message("bench", "session", ChatMessage(no=0, role="user", content=USER_MESSAGE))
+        await repo.save_chat_message("bench", "session", ChatMessage(no=0, role="assistant", content=ASSISTANT_MESSAGE))
+        # ChatManagerと同じく毎ターン履歴を組み立て、履歴から外れたメッセージを要約（up_to_no）に反映する
+        loaded, summary = await policy.load("bench", "session")
+        history, pending = policy.build(loaded, summary)
+        await policy.update_summary("bench", "session", pending)
+        if turn % step != 0:
+            continue
+        messages = await repo.get_chat_messages("bench", "session")
+        print(json.dumps({
+            "turns": turn,
+            "full_history_tokens": sum(policy.count_tokens(m.content) for m in messages),
+            "policy_history_tokens": sum(policy.count_tokens(m.content) for m in history),
+            "policy_history_messages": len(history),
+            "policy_loaded_messages": len(loaded)
+        }))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure prompt history tokens as a session grows")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--max-turns", type=int, default=10)
+    parser.add_argument("--max-tokens", type=int, default=3000)
+    parser.add_argument("--step", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.turns, args.max_turns, args.max_tokens, args.step))
+
+if __name__ == "__main__":
+    main()
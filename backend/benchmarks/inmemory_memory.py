@@ -0,0 +1,103 @@
+"""
+InMemoryChatRepoのメモリ使用量ベンチマーク
+
+同じメッセージを、従来の構造（セッションごとのChatMessageのリストを入れ子のdictで保持）と
+InMemoryChatRepo（セッションごとに列で保持する追記型の領域）に投入し、
+tracemallocで計測したメモリ使用量と投入・読み込み・末尾削除の時間を比較する。
+
+使い方（backendディレクトリで実行）:
+    python -m benchmarks.inmemory_memory --messages 1000000 --sessions 10000
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import time
+import tracemalloc
+from typing import Dict, List
+from db.chat.inmemory import InMemoryChatRepo
+from db.chat.models import ChatMessage
+
+USER_MESSAGE = "GCASのAzure環境でユーザーを追加する手順を教えてください。"
+ASSISTANT_MESSAGE = "ユーザーの追加はGCASポータルから申請し、承認後にEntra IDへ反映されます。"
+
+def _content(i: int) -> str:
+    # メッセージごとに別の文字列オブジェクトになるよう番号を付ける
+    return f"{USER_MESSAGE if i % 2 == 0 else ASSISTANT_MESSAGE} ({i})"
+
+def _measure(build):
+    """buildが作る構造のメモリ使用量（MB）と所要時間（秒）を返す"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    store = build()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return store, {"memory_mb": current / 1024 / 1024, "peak_mb": peak / 1024 / 1024, "build_sec": elapsed}
+
+def _build_legacy(messages: int, sessions: int) -> Dict[str, Dict[str, List[ChatMessage]]]:
+    """従来のInMemoryChatRepoと同じ構造（user_id -> session_id -> List[ChatMessage]）を作る"""
+    store: Dict[str, Dict[str, List[ChatMessage]]] = {}
+    for i in range(messages):
+        session = i % sessions
+        user_sessions = store.setdefault(f"user-{session % 100}", {})
+        session_messages = user_sessions.setdefault(f"session-{session}", [])
+        session_messages.append(ChatMessage(no=len(session_messages) + 1, role="user" if i % 2 == 0 else "assistant", content=_content(i)))
+    return store
+
+def _build_compact(messages: int, sessions: int) -> InMemoryChatRepo:
+    """InMemoryChatRepoに1往復ずつ投入する"""
+    repo = InMemoryChatRepo()
+
+    async def fill():
+        for i in range(0, messages, 2):
+            session = (i // 2) % sessions
+            await repo.save_chat_messages(f"user-{session % 100}", f"session-{session}", [
+                ChatMessage(no=0, role="user", content=_content(i)),
+                ChatMessage(no=0, role="assistant", content=_content(i + 1))
+            ])
+
+    asyncio.run(fill())
+    return repo
+
+def _time_compact_operations(repo: InMemoryChatRepo, sessions: int) -> Dict[str, float]:
+    """読み込みと末尾削除（編集時の操作）の1セッションあたりの時間（ミリ秒）を返す"""
+    async def run():
+        start = time.perf_counter()
+        for session in range(sessions):
+            await repo.get_chat_messages(f"user-{session % 100}", f"session-{session}")
+        read_ms = (time.perf_counter() - start) * 1000 / sessions
+        start = time.perf_counter()
+        for session in range(sessions):
+            await repo.delete_messages_from_no(f"user-{session % 100}", f"session-{session}", 50)
+        delete_ms = (time.perf_counter() - start) * 1000 / sessions
+        return {"get_chat_messages_ms": read_ms, "delete_messages_from_no_ms": delete_ms}
+
+    return asyncio.run(run())
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Memory footprint of the in-memory chat repository")
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--sessions", type=int, default=10_000)
+    args = parser.parse_args()
+    # 1メッセージごとのINFOログを計測に含めない
+    logging.getLogger("uvicorn.app").setLevel(logging.WARNING)
+
+    legacy, legacy_result = _measure(lambda: _build_legacy(args.messages, args.sessions))
+    del legacy
+    repo, compact_result = _measure(lambda: _build_compact(args.messages, args.sessions))
+    compact_result.update(_time_compact_operations(repo, args.sessions))
+    compact_result["stats"] = repo.stats()
+
+    print(json.dumps({
+        "messages": args.messages,
+        "sessions": args.sessions,
+        "before": legacy_result,
+        "after": compact_result,
+        "memory_ratio": compact_result["memory_mb"] / legacy_result["memory_mb"] if legacy_result["memory_mb"] else None
+    }, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
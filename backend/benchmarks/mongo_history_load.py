@@ -0,0 +1,76 @@
+"""
+MongoDBリポジトリの負荷テスト
+
+同じセッションの履歴読み込み（/chat/history 相当）を並行実行しながら、
+イベントループの遅延（10ms間隔のタイマーの遅れ）を計測する。
+同期ドライバ（mongodb）ではDBアクセスの間ループが止まり、非同期ドライバ（mongodb_async）では止まらないことを確認する。
+
+使い方（backendディレクトリで、ローカルのmongodを起動した状態で実行）:
+    python -m benchmarks.mongo_history_load --db-type mongodb_async --concurrency 50 --seconds 10
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from db.chat.models import ChatMessage
+from db.chat.mongodb import MongoChatRepo
+from db.chat.mongodb_async import AsyncMongoChatRepo
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+async def _measure_loop_lag(stop: asyncio.Event, lags: list, interval: float = 0.01) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - start - interval) * 1000)
+
+async def _reader(repo, stop: asyncio.Event, latencies: list) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await repo.get_chat_messages("bench-user", "bench-session")
+        latencies.append((time.perf_counter() - start) * 1000)
+
+async def run(db_type: str, host: str, port: int, messages: int, concurrency: int, seconds: float) -> None:
+    repo_class = AsyncMongoChatRepo if db_type == "mongodb_async" else MongoChatRepo
+    repo = repo_class(host, port, db_name="chatdb_bench")
+    await repo.clear_chat_messages("bench-user", "bench-session")
+    for i in range(messages):
+        role = "user" if i % 2 == 0 else "assistant"
+        await repo.save_chat_message("bench-user", "bench-session", ChatMessage(no=0, role=role, content="x" * 500))
+
+    stop = asyncio.Event()
+    lags, latencies = [], []
+    tasks = [asyncio.create_task(_measure_loop_lag(stop, lags))]
+    tasks += [asyncio.create_task(_reader(repo, stop, latencies)) for _ in range(concurrency)]
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+    await repo.clear_chat_messages("bench-user", "bench-session")
+    await repo.close()
+
+    print(json.dumps({
+        "db_type": db_type,
+        "concurrency": concurrency,
+        "reads_per_sec": len(latencies) / seconds,
+        "read_ms": {"p50": _percentile(latencies, 50), "p95": _percentile(latencies, 95), "p99": _percentile(latencies, 99)},
+        "loop_lag_ms": {"mean": statistics.fmean(lags) if lags else 0.0, "p99": _percentile(lags, 99), "max": max(lags, default=0.0)}
+    }, indent=2))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Concurrent chat history reads against a local mongod")
+    parser.add_argument("--db-type", choices=["mongodb", "mongodb_async"], default="mongodb_async")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=27017)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.db_type, args.host, args.port, args.messages, args.concurrency, args.seconds))
+
+if __name__ == "__main__":
+    main()
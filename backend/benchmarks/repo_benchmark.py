@@ -0,0 +1,161 @@
+"""
+チャット履歴リポジトリ（IChatRepo）のスループットのベンチマーク
+
+主要な操作（保存・読み込み・末尾削除・セッション一覧・タイトル）のスループットとレイテンシを
+バックエンドごとに計測し、JSONで出力する。リリース間で結果を比較して性能の劣化を検出するために使う。
+動作の正しさ（契約）は tests/test_chat_repo_contract.py で確認する。
+
+使い方（backendディレクトリで実行。mongodb / mongodb_async はローカルのmongod、cosmosはエミュレーターが必要）:
+    python -m benchmarks.repo_benchmark --backends inmemory sqlite --iterations 1000
+    python -m benchmarks.repo_benchmark --backends mongodb_async --host localhost --port 27017 --output result.json
+    python -m benchmarks.repo_benchmark --backends sqlite --write-behind
+    python -m benchmarks.repo_benchmark --backends mongodb_async --cache
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List
+from db.chat.interface import IChatRepo
+from db.chat.cached import CachedChatRepo
+from db.chat.models import ChatMessage
+from db.chat.write_behind import WriteBehindChatRepo
+
+BACKENDS = ["inmemory", "sqlite", "mongodb", "mongodb_async", "cosmos"]
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def create_repository(backend: str, args: argparse.Namespace) -> IChatRepo:
+    """バックエンド名からリポジトリを作成する（ファクトリーのシングルトンを使わず、バックエンドごとに新しく作る）"""
+    if backend == "inmemory":
+        from db.chat.inmemory import InMemoryChatRepo
+        return InMemoryChatRepo()
+    if backend == "sqlite":
+        from db.chat.sqlite import SQLiteChatRepo
+        return SQLiteChatRepo(path=os.path.join(tempfile.mkdtemp(prefix="repo_benchmark_"), "chat.sqlite3"))
+    if backend == "mongodb":
+        from db.chat.mongodb import MongoChatRepo
+        return MongoChatRepo(args.host, args.port, db_name="chatdb_bench")
+    if backend == "mongodb_async":
+        from db.chat.mongodb_async import AsyncMongoChatRepo
+        return AsyncMongoChatRepo(args.host, args.port, db_name="chatdb_bench")
+    if backend == "cosmos":
+        from db.chat.cosmos_client import CosmosDBClient
+        return CosmosDBClient(container_name="chats_bench", connection_verify=os.getenv("COSMOS_VERIFY_SSL", "true").lower() == "true")
+    raise ValueError(f"Unknown backend: {backend}")
+
+def _turn(i: int) -> List[ChatMessage]:
+    return [
+        ChatMessage(no=0, role="user", content=f"GCASのAzure環境について質問です ({i})"),
+        ChatMessage(no=0, role="assistant", content="ユーザーの追加はGCASポータルから申請し、承認後に反映されます。" * 4)
+    ]
+
+async def _timed(latencies: List[float], operation: Awaitable) -> None:
+    start = time.perf_counter()
+    await operation
+    latencies.append((time.perf_counter() - start) * 1000)
+
+def _summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99)
+    }
+
+async def run_benchmark(repo: IChatRepo, iterations: int, history_turns: int, sessions: int) -> Dict[str, Dict[str, float]]:
+    """主要な操作を順に計測し、操作ごとのスループットとレイテンシを返す"""
+    user_id = f"bench-{uuid.uuid4()}"
+    session_ids = [f"session-{i:05d}" for i in range(sessions)]
+    results = {}
+
+    async def measure(name: str, make_operation: Callable[[int], Awaitable]) -> None:
+        latencies: List[float] = []
+        start = time.perf_counter()
+        for i in range(iterations):
+            await _timed(latencies, make_operation(i))
+        results[name] = _summarize(latencies, time.perf_counter() - start)
+
+    # 保存: 1往復（2メッセージ）ずつ複数セッションに書き込む
+    await measure("save_turn", lambda i: repo.save_chat_messages(user_id, session_ids[i % sessions], _turn(i)))
+    # 読み込み: history_turns往復分の履歴があるセッションを全件読み込む
+    for i in range(history_turns):
+        await repo.save_chat_messages(user_id, "history", _turn(i))
+    await measure("load_history", lambda i: repo.get_chat_messages(user_id, "history"))
+    await measure("load_history_page", lambda i: repo.get_chat_messages(user_id, "history", limit=20, after_no=history_turns))
+
+    # 末尾削除（編集）: 最後の1往復を削除して書き戻す操作のうち、削除のみを計測する
+    delete_latencies: List[float] = []
+    for i in range(iterations):
+        await _timed(delete_latencies, repo.delete_messages_from_no(user_id, "history", history_turns * 2 - 1))
+        await repo.save_chat_messages(user_id, "history", _turn(i))
+    results["delete_from_no"] = _summarize(delete_latencies, sum(delete_latencies) / 1000)
+
+    await measure("list_sessions", lambda i: repo.get_session_ids(user_id))
+    await measure("list_sessions_page", lambda i: repo.get_session_ids(user_id, limit=20))
+    await measure("save_title", lambda i: repo.update_session_title(user_id, session_ids[i % sessions], f"タイトル {i}"))
+    await measure("list_titles_page", lambda i: repo.get_session_titles(user_id, limit=20, before=datetime.utcnow() + timedelta(seconds=1)))
+    await measure("list_session_summaries_page", lambda i: repo.get_session_summaries(user_id, limit=20))
+
+    # 後片付け
+    for session_id in session_ids + ["history"]:
+        await repo.clear_chat_messages(user_id, session_id)
+        await repo.delete_session_title(user_id, session_id)
+    return results
+
+async def run(args: argparse.Namespace) -> int:
+    report = {"started_at": datetime.utcnow().isoformat(), "iterations": args.iterations, "backends": {}}
+    failed = False
+    for backend in args.backends:
+        repo = create_repository(backend, args)
+        if args.write_behind:
+            repo = WriteBehindChatRepo(repo)
+        if args.cache:
+            repo = CachedChatRepo(repo)
+        try:
+            await repo.initialize()
+            report["backends"][backend] = {"benchmark": await run_benchmark(repo, args.iterations, args.history_turns, args.sessions)}
+            if args.cache:
+                report["backends"][backend]["cache"] = repo.stats()
+        except Exception as e:
+            failed = True
+            report["backends"][backend] = {"error": f"{type(e).__name__}: {e}"}
+        finally:
+            await repo.close()
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+    return 1 if failed else 0
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Throughput benchmark for chat repositories")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=["inmemory", "sqlite"])
+    parser.add_argument("--host", default="localhost", help="MongoDB host (mongodb / mongodb_async)")
+    parser.add_argument("--port", type=int, default=27017, help="MongoDB port (mongodb / mongodb_async)")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--history-turns", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--write-behind", action="store_true", help="Wrap each backend with the write-behind repository")
+    parser.add_argument("--cache", action="store_true", help="Wrap each backend with the session cache repository")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    # 1操作ごとのINFOログを計測に含めない
+    logging.getLogger("uvicorn.app").setLevel(logging.WARNING)
+    sys.exit(asyncio.run(run(args)))
+
+if __name__ == "__main__":
+    main()
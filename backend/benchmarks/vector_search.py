@@ -0,0 +1,144 @@
+"""
+ベクトル検索のベンチマーク（ローカルインデックスとChromaDBサーバーの比較）
+
+ランダムな埋め込みのスナップショットを件数ごとに作成し、LocalVectorIndexのtop-k検索
+（float32 / int8量子化、メモリ読み込み / メモリマップ）のレイテンシを計測する。
+int8はfloat32の検索結果に対する再現率（recall@k）も出力する。
+--chroma-host を指定した場合は同じ埋め込みをChromaDBのコレクションに投入し、HttpClientでの検索と比較する。
+
+使い方（backendディレクトリで実行。1M件・1536次元のfloat32は約6GBのディスクを使う）:
+    python -m benchmarks.vector_search --sizes 10000 100000 1000000 --dimension 1536
+    python -m benchmarks.vector_search --sizes 10000 100000 --chroma-host localhost --chroma-port 8001
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import uuid
+from typing import Dict, List
+import numpy as np
+from retrieval.local_index import LocalVectorIndex, SnapshotWriter
+
+# スナップショットに書き込む1回あたりの件数（大きな件数でもメモリに全件を載せない）
+WRITE_BATCH = 10000
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def _latency(samples: List[float]) -> Dict[str, float]:
+    return {
+        "p50_ms": round(_percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(_percentile(samples, 95) * 1000, 3),
+        "qps": round(len(samples) / sum(samples), 1) if sum(samples) > 0 else 0.0
+    }
+
+def _batches(size: int, dimension: int, seed: int):
+    """(開始位置, 埋め込み) をWRITE_BATCH件ずつ生成する（同じseedなら同じ埋め込み）"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, size, WRITE_BATCH):
+        yield start, rng.standard_normal((min(WRITE_BATCH, size - start), dimension), dtype=np.float32)
+
+def write_snapshot(path: str, size: int, dimension: int, quantize: bool, seed: int) -> None:
+    writer = SnapshotWriter(path, size, dimension, collection_name="bench", quantize=quantize)
+    for start, vectors in _batches(size, dimension, seed):
+        ids = [f"doc-{start + i}" for i in range(len(vectors))]
+        writer.add(ids, vectors, [f"document {start + i}" for i in range(len(vectors))], [{"no": start + i} for i in range(len(vectors))])
+    writer.close()
+
+def bench_local(index: LocalVectorIndex, queries: np.ndarray, k: int) -> Dict[str, object]:
+    index.search(queries[0], k)
+    samples = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        results.append([row for row, _ in index.search(query, k)])
+        samples.append(time.perf_counter() - started)
+    return {"latency": _latency(samples), "results": results}
+
+def bench_chroma(args: argparse.Namespace, size: int, queries: np.ndarray) -> Dict[str, object]:
+    import chromadb
+    from chromadb.config import Settings
+
+    client = chromadb.HttpClient(host=args.chroma_host, port=args.chroma_port, settings=Settings(anonymized_telemetry=False))
+    name = f"bench_{size}_{uuid.uuid4().hex[:8]}"
+    collection = client.create_collection(name, metadata={"hnsw:space": "cosine"})
+    try:
+        max_batch = min(WRITE_BATCH, client.get_max_batch_size())
+        started = time.perf_counter()
+        for start, vectors in _batches(size, args.dimension, args.seed):
+            for offset in range(0, len(vectors), max_batch):
+                chunk = vectors[offset:offset + max_batch]
+                first = start + offset
+                collection.add(
+                    ids=[f"doc-{first + i}" for i in range(len(chunk))],
+                    embeddings=chunk.tolist(),
+                    documents=[f"document {first + i}" for i in range(len(chunk))]
+                )
+        load_seconds = time.perf_counter() - started
+        samples = []
+        for query in queries:
+            started = time.perf_counter()
+            collection.query(query_embeddings=[query.tolist()], n_results=args.k, include=["documents", "metadatas", "distances"])
+            samples.append(time.perf_counter() - started)
+        return {"load_seconds": round(load_seconds, 1), "latency": _latency(samples)}
+    finally:
+        client.delete_collection(name)
+
+def run(args: argparse.Namespace) -> List[Dict[str, object]]:
+    queries = np.random.default_rng(args.seed + 1).standard_normal((args.queries, args.dimension), dtype=np.float32)
+    report = []
+    for size in args.sizes:
+        result: Dict[str, object] = {"size": size, "dimension": args.dimension, "k": args.k}
+        with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+            exact = None
+            for quantize in (False, True):
+                path = os.path.join(workdir, "int8" if quantize else "float32")
+                started = time.perf_counter()
+                write_snapshot(path, size, args.dimension, quantize, args.seed)
+                build_seconds = time.perf_counter() - started
+                for mmap in (False, True):
+                    started = time.perf_counter()
+                    index = LocalVectorIndex(path, mmap=mmap)
+                    load_seconds = time.perf_counter() - started
+                    measured = bench_local(index, queries, args.k)
+                    index.close()
+                    entry = {
+                        "build_seconds": round(build_seconds, 1),
+                        "load_seconds": round(load_seconds, 3),
+                        "latency": measured["latency"]
+                    }
+                    if exact is None:
+                        exact = measured["results"]
+                    else:
+                        hits = sum(len(set(a) & set(b)) for a, b in zip(exact, measured["results"]))
+                        entry["recall_at_k"] = round(hits / (len(exact) * args.k), 4)
+                    result[f"local_{'int8' if quantize else 'float32'}{'_mmap' if mmap else ''}"] = entry
+        if args.chroma_host:
+            result["chroma_http"] = bench_chroma(args, size, queries)
+        print(json.dumps(result))
+        report.append(result)
+    return report
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare in-process NumPy vector search with ChromaDB HttpClient queries")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="Directory for temporary snapshots (defaults to the system temp dir)")
+    parser.add_argument("--chroma-host", default=None)
+    parser.add_argument("--chroma-port", type=int, default=8001)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    report = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
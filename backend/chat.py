@@ -1,17 +1,44 @@
 import uuid
+import asyncio
+import os
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessage
 from pydantic import BaseModel, Field
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableConfig, RunnableLambda, RunnablePassthrough
+from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
 from containers import Container
-from typing import List, Dict
+from typing import List, Dict, Any, AsyncIterator, Optional, Set, Tuple
 from langsmith import traceable
 from logging import getLogger
-from db.chat.models import ChatMessage
-from utils.title_generator import create_title_generation_chain, generate_title_from_message_with_llm
+from db.chat.models import ChatMessage, HistorySummary
+from db.chat.write_behind import WriteBehindChatRepo
+from db.chat.cached import CachedChatRepo
+from db.chat.inmemory import InMemoryChatRepo
+from chromadb.config import Settings
+from retrieval import HydeQueryExpander, HydeFusionRetriever, SemanticAnswerCache, AsyncChromaRetriever, LocalVectorIndex, LocalIndexRetriever, RetrievalOptions
+from utils.history_policy import HistoryPolicy, create_summary_chain
+from utils.session_deletion import SessionDeletionJobs
+from utils.title_generator import create_title_generation_chain, generate_title_from_message_with_llm, generate_title_fallback
+
+# セッションタイトルの生成モード
+# - sync: 回答生成の前にLLMでタイトルを生成して保存する
+# - concurrent: フォールバックタイトルを即座に保存し、LLMタイトルを回答と並行して生成して更新する
+# - background: フォールバックタイトルを即座に保存し、LLMタイトルは回答の生成・保存が終わってからバックグラウンドで更新する
+# - fallback: フォールバックタイトルのみを保存する（LLMを呼び出さない）
+TITLE_MODES = ("sync", "concurrent", "background", "fallback")
+
+# 検索モード
+# - hyde: HyDEステージの出力（仮想回答または質問文）で検索する
+# - fusion: 質問文とHyDEの検索を並行実行し、RRFで統合する
+RETRIEVAL_MODES = ("hyde", "fusion")
+
+# ベクトル検索のバックエンド
+# - chroma: ChromaDBサーバーにAsyncHttpClientで問い合わせる
+# - local: Chromaコレクションのスナップショットをプロセス内に読み込み、NumPyで検索する
+VECTOR_BACKENDS = ("chroma", "local")
 
 class DatabaseHistory(BaseChatMessageHistory):
     def __init__(self, messages: List[BaseMessage] = None):
@@ -42,6 +69,15 @@ class ChatManager:
         質問: {input}
         ''')
         hypothetical_chain = hypothetical_prompt | container.llm() | StrOutputParser()
+        # HyDEによるクエリ拡張（off / on / adaptive とキャッシュは設定で切り替える）
+        hyde_config = container.config.retrieval.hyde() or {}
+        self.hyde = HydeQueryExpander(
+            hypothetical_chain,
+            mode=os.getenv("HYDE_MODE", hyde_config.get("mode", "on")),
+            cache_size=int(hyde_config.get("cache_size", 1024)),
+            cache_ttl=int(hyde_config.get("cache_ttl", 3600)),
+            adaptive_min_chars=int(hyde_config.get("adaptive_min_chars", 12))
+        )
         
         # プロンプトテンプレートの設定
         prompt = ChatPromptTemplate.from_messages([
@@ -64,12 +100,54 @@ class ChatManager:
         ])
 
         # RAG用のベクトルデータベース設定
-        retriever = container.chroma_db().as_retriever()
+        self.embeddings = container.embeddings()
+        self.collection_name = container.config.chroma.collection_name()
+        # 検索オプションの既定値（件数・スコアの閾値・MMR・メタデータの絞り込み。リクエストごとに上書きできる）
+        self.retrieval_options = RetrievalOptions.model_validate(container.config.retrieval.search() or {})
+        self.vector_backend = os.getenv("VECTOR_BACKEND", container.config.retrieval.backend() or "chroma")
+        if self.vector_backend not in VECTOR_BACKENDS:
+            raise ValueError(f"Unknown vector backend: {self.vector_backend}")
+        self.chroma_client = None
+        self.local_index = None
+        if self.vector_backend == "local":
+            local_config = container.config.retrieval.local() or {}
+            self.local_index = LocalVectorIndex(
+                os.getenv("LOCAL_INDEX_PATH", local_config.get("path", "data/local_index")),
+                mmap=os.getenv("LOCAL_INDEX_MMAP", str(local_config.get("mmap", False))).lower() == "true"
+            )
+            self.vector_retriever = LocalIndexRetriever(index=self.local_index, embeddings=self.embeddings, options=self.retrieval_options)
+            self.logger.info(f"Loaded local vector index: {self.local_index.meta}")
+        else:
+            self.vector_retriever = self._create_chroma_retriever(container)
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", container.config.retrieval.mode() or "hyde")
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {self.retrieval_mode}")
+        fusion_config = container.config.retrieval.fusion() or {}
+        self.fusion_retriever = HydeFusionRetriever(
+            retriever=self.vector_retriever,
+            expander=self.hyde,
+            hyde_timeout=fusion_config.get("hyde_timeout"),
+            rrf_k=int(fusion_config.get("rrf_k", 60)),
+            k=int(fusion_config.get("k", 4))
+        )
+
+        # 意味的に近い初回質問に過去の回答を返すキャッシュ（オプトイン）
+        answer_cache_config = container.config.answer_cache() or {}
+        self.answer_cache = None
+        if os.getenv("ANSWER_CACHE_ENABLED", str(answer_cache_config.get("enabled", False))).lower() == "true":
+            self.answer_cache = SemanticAnswerCache(
+                self.embeddings,
+                self._collection_version,
+                threshold=float(answer_cache_config.get("threshold", 0.95)),
+                max_entries=int(answer_cache_config.get("max_entries", 1000)),
+                ttl=int(answer_cache_config.get("ttl", 3600)),
+                version_check_interval=float(answer_cache_config.get("version_check_interval", 60))
+            )
 
         # チェーンの設定
         self.chain = (
             {
-                "rag_context":  hypothetical_chain | retriever,
+                "rag_context": RunnableLambda(self._retrieve),
                 "input": lambda x: x["input"],
                 "history": lambda x: x["history"]
             }
@@ -79,18 +157,135 @@ class ChatManager:
         
         # タイトル生成チェーンの設定
         self.title_chain = create_title_generation_chain(container.llm())
+        self.title_mode = os.getenv("TITLE_MODE", container.config.chat.title_mode() or "concurrent")
+        if self.title_mode not in TITLE_MODES:
+            raise ValueError(f"Unknown title mode: {self.title_mode}")
+        self._background_tasks: Set[asyncio.Task] = set()
+
+        # セッションの一括削除（バックグラウンドジョブ）
+        self.deletion_jobs = SessionDeletionJobs(
+            self.chat_repository,
+            batch_size=int(os.getenv("SESSION_DELETE_BATCH_SIZE", container.config.chat.delete_batch_size() or 100))
+        )
+
+        # プロンプトに含める会話履歴のポリシー（トークン予算と古い会話の要約）
+        history_config = container.config.history() or {}
+        self.history_policy = HistoryPolicy(
+            self.chat_repository,
+            max_turns=int(history_config.get("max_turns", 10)),
+            max_tokens=int(history_config.get("max_tokens", 3000)),
+            summary_chain=create_summary_chain(container.llm()) if history_config.get("summarize", False) else None,
+            summary_batch_turns=int(history_config.get("summary_batch_turns", 5)),
+            encoding_name=history_config.get("encoding", "o200k_base")
+        )
+
+    def _create_chroma_retriever(self, container: Container) -> AsyncChromaRetriever:
+        """ChromaDBサーバーに問い合わせるリトリーバーを作成する"""
+        self.chroma_client = container.client()
+        # 検索はAsyncHttpClientで行い、イベントループをブロックしない（同期呼び出しのみ従来のクライアントを使う）
+        chroma_config = container.config.retrieval.chroma() or {}
+        max_connections = int(chroma_config.get("max_connections", 20))
+        return AsyncChromaRetriever(
+            host=os.getenv("CHROMA_HOST", container.config.chroma.host()),
+            port=int(os.getenv("CHROMA_PORT", container.config.chroma.port())),
+            collection_name=self.collection_name,
+            embeddings=self.embeddings,
+            options=self.retrieval_options,
+            timeout=float(chroma_config.get("timeout", 10.0)),
+            max_retries=int(chroma_config.get("max_retries", 2)),
+            settings=Settings(
+                anonymized_telemetry=False,
+                chroma_http_keepalive_secs=float(chroma_config.get("keepalive_secs", 45.0)),
+                chroma_http_max_connections=max_connections,
+                chroma_http_max_keepalive_connections=max_connections
+            ),
+            sync_retriever=container.chroma_db().as_retriever(
+                search_type=self.retrieval_options.langchain_search_type(),
+                search_kwargs=self.retrieval_options.search_kwargs()
+            )
+        )
+
+    async def _retrieve(self, inputs: Dict[str, Any], config: RunnableConfig) -> List[Document]:
+        """
+        チェーンの入力の質問文で検索する
+
+        retrieval_modeに従い、HyDEの出力で検索するか質問文とHyDEの検索を統合する。
+        入力にretrieval（リクエストごとの検索オプション）がある場合はリトリーバーに渡す。
+        """
+        options: Optional[RetrievalOptions] = inputs.get("retrieval")
+        kwargs = {"options": options} if options is not None else {}
+        if self.retrieval_mode == "fusion":
+            return await self.fusion_retriever.ainvoke(inputs["input"], config=config, **kwargs)
+        query = await self.hyde.as_runnable().ainvoke(inputs["input"], config=config)
+        return await self.vector_retriever.ainvoke(query, config=config, **kwargs)
+
+    async def warm_up(self) -> None:
+        """
+        起動時のウォームアップ
 
-    async def _load_messages(self, user_id: str, session_id: str) -> List[BaseMessage]:
-        """Load messages from database for a session"""
+        リポジトリを初期化し、外部サービスへの接続を事前に確立して初回リクエストの遅延を抑える。
+        ChromaDBへの接続に失敗してもアプリケーションの起動は継続する。
+        """
+        await self.chat_repository.initialize()
+        if not isinstance(self.vector_retriever, AsyncChromaRetriever):
+            return
+        try:
+            await self.vector_retriever.connect()
+            self.logger.info("ChromaDB connection warmed up")
+        except Exception as e:
+            self.logger.warning(f"ChromaDB warm-up failed: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """各ステージのキャッシュ・メトリクスを返す"""
+        return {
+            "hyde": self.hyde.stats(),
+            "fusion": self.fusion_retriever.stats(),
+            "vector_search": dict(self.vector_retriever.stats(), backend=self.vector_backend),
+            "embeddings": self.embeddings.stats(),
+            "answer_cache": self.answer_cache.stats() if self.answer_cache is not None else None,
+            "write_behind": self._repository_stats(WriteBehindChatRepo),
+            "chat_cache": self._repository_stats(CachedChatRepo),
+            "inmemory": self._repository_stats(InMemoryChatRepo),
+            "session_deletion": self.deletion_jobs.stats()
+        }
+
+    def _repository_stats(self, repository_type: type) -> Optional[Dict[str, Any]]:
+        """リポジトリのデコレーター（キャッシュ・write-behind）をたどり、指定した種類のリポジトリのメトリクスを返す"""
+        repository = self.chat_repository
+        while True:
+            if isinstance(repository, repository_type):
+                return repository.stats()
+            if not isinstance(repository, (CachedChatRepo, WriteBehindChatRepo)):
+                return None
+            repository = repository.repository
+
+    def _collection_version(self) -> str:
+        """コレクションのバージョンを返す（再投入でIDが、追加で件数が変わる。ローカルインデックスはスナップショットの作成日時）"""
+        if self.local_index is not None:
+            return self.local_index.version
+        collection = self.chroma_client.get_collection(self.collection_name)
+        return f"{collection.id}:{collection.count()}"
+
+    async def close(self) -> None:
+        """保持しているリソースを解放する"""
+        try:
+            # 実行中のバックグラウンドタスク（タイトル生成など）の完了を待つ
+            if self._background_tasks:
+                self.logger.info(f"Waiting for {len(self._background_tasks)} background tasks")
+                await asyncio.gather(*self._background_tasks, return_exceptions=True)
+            await self.deletion_jobs.close()
+            await self.chat_repository.close()
+            self.embeddings.close()
+            if self.local_index is not None:
+                self.local_index.close()
+        except Exception as e:
+            self.logger.error(f"Error closing chat repository: {str(e)}", exc_info=True)
+            raise
+
+    async def _load_messages(self, user_id: str, session_id: str) -> Tuple[List[ChatMessage], Optional[HistorySummary]]:
+        """Load messages after the history summary and the summary itself from database for a session"""
         try:
-            db_messages = await self.chat_repository.get_chat_messages(user_id, session_id)
-            messages = []
-            for msg in db_messages:
-                if msg.role == "user":
-                    messages.append(HumanMessage(content=msg.content))
-                elif msg.role == "assistant":
-                    messages.append(AIMessage(content=msg.content))
-            return messages
+            return await self.history_policy.load(user_id, session_id)
         except Exception as e:
             self.logger.error(f"Error loading messages for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
             raise
@@ -100,24 +295,20 @@ class ChatManager:
         self.logger.info(f"Saving messages for user {user_id}, session {session_id}")
         self.logger.info(f"Messages count: {len(messages)}")
         try:
-            saved_messages = []
+            chat_messages = []
             for message in messages:
                 if isinstance(message, HumanMessage):
-                    saved_messages.append(await self.chat_repository.save_chat_message(user_id, session_id, ChatMessage(no=0, role="user", content=message.content)))
+                    chat_messages.append(ChatMessage(no=0, role="user", content=message.content))
                 elif isinstance(message, AIMessage):
-                    saved_messages.append(await self.chat_repository.save_chat_message(user_id, session_id, ChatMessage(no=0, role="assistant", content=message.content)))
-            return saved_messages
+                    chat_messages.append(ChatMessage(no=0, role="assistant", content=message.content))
+            # ユーザー/アシスタントのメッセージを1回の書き込みで順序どおりに保存する
+            return await self.chat_repository.save_chat_messages(user_id, session_id, chat_messages)
         except Exception as e:
             self.logger.error(f"Error saving messages for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
             raise
 
-    @traceable
-    async def get_response(self, message: str, user_id: str, session_id: str) -> List[ChatMessage]:
-        """
-        Get a response from the LLM based on the input message.
-        Returns:
-            ChatMessage: The latest assistant message (with no, role, content)
-        """
+    def _validate_request(self, message: str, user_id: str, session_id: str) -> None:
+        """リクエストパラメータを検証する"""
         if message == "":
             raise ValueError("message is empty")
         if user_id == "":
@@ -125,47 +316,195 @@ class ChatManager:
         if session_id == "":
             raise ValueError("session_id is empty")
 
+    async def _prepare_history(self, message: str, user_id: str, session_id: str) -> Tuple[DatabaseHistory, bool, Optional[asyncio.Task]]:
+        """
+        DBから会話履歴を読み込み、初回メッセージの場合はセッションタイトルの生成を開始する
+
+        Returns:
+            Tuple[DatabaseHistory, bool, Optional[asyncio.Task]]: チェーンに渡す会話履歴、初回メッセージかどうか、
+                回答と並行して実行中のタイトル生成タスク（concurrentモードの初回メッセージのみ）
+        """
+        # メッセージ履歴を取得
+        history = DatabaseHistory()
+        # DBからメッセージを読み込む
+        self.logger.info(f"Loading messages for db with user_id: {user_id}, session_id: {session_id}")
+        # 要約済み（履歴から外れた）メッセージは読まず、直近の履歴の候補のみを読み込む
+        db_messages, summary = await self._load_messages(user_id, session_id)
+        self.logger.info(f"Loaded {len(db_messages)} messages")
+        # トークン予算内の直近の履歴（と古い会話の要約）に絞り込む
+        messages, pending = self.history_policy.build(db_messages, summary)
+        history.add_messages(messages)
+        if pending:
+            # 要約の更新は回答を待たせないようバックグラウンドで行う
+            task = asyncio.create_task(self.history_policy.update_summary(user_id, session_id, pending))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+        # 初回メッセージの場合（履歴も要約もない）、タイトルを生成して保存
+        title_task = None
+        is_first_message = len(db_messages) == 0 and summary is None
+        if is_first_message:
+            title_task = await self._start_title_generation(message, user_id, session_id)
+        return history, is_first_message, title_task
+
+    async def _start_title_generation(self, message: str, user_id: str, session_id: str) -> Optional[asyncio.Task]:
+        """
+        title_modeに従ってセッションタイトルを保存する
+
+        backgroundモードのLLMタイトルは回答と競合しないよう、回答の保存後に_schedule_title_upgradeで開始する。
+
+        Returns:
+            Optional[asyncio.Task]: concurrentモードの場合は回答完了後に待機するタスク
+                （回答が失敗した場合や接続が切れた場合も取り残されないよう、バックグラウンドタスクとしても管理する）
+        """
+        if self.title_mode == "sync":
+            title = await generate_title_from_message_with_llm(message, self.title_chain)
+            self.logger.info(f"Generated title for new session: {title}")
+            await self.chat_repository.save_session_title(user_id, session_id, title)
+            return None
+
+        # フォールバックタイトルを即座に保存し、LLMタイトルは後から上書きする
+        await self.chat_repository.save_session_title(user_id, session_id, generate_title_fallback(message))
+        if self.title_mode in ("fallback", "background"):
+            return None
+        return self._create_title_task(message, user_id, session_id)
+
+    def _create_title_task(self, message: str, user_id: str, session_id: str) -> asyncio.Task:
+        """LLMタイトルの生成をバックグラウンドタスクとして開始する（終了時にclose()で待機する）"""
+        task = asyncio.create_task(self._upgrade_session_title(message, user_id, session_id))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    def _schedule_title_upgrade(self, message: str, user_id: str, session_id: str, is_first_message: bool) -> None:
+        """backgroundモードの初回メッセージの場合、回答の保存後にLLMタイトルの生成を開始する"""
+        if is_first_message and self.title_mode == "background":
+            self._create_title_task(message, user_id, session_id)
+
+    async def _upgrade_session_title(self, message: str, user_id: str, session_id: str) -> None:
+        """LLMでタイトルを生成し、フォールバックタイトルを置き換える"""
         try:
-            # メッセージ履歴を取得
-            history = DatabaseHistory()
-            # DBからメッセージを読み込む
-            self.logger.info(f"Loading messages for db with user_id: {user_id}, session_id: {session_id}")
-            messages = await self._load_messages(user_id, session_id)
-            history.add_messages(messages)
-            self.logger.info(f"Loaded {len(messages)} messages")
-
-            # 初回メッセージの場合（履歴が空）、タイトルを生成して保存
-            is_first_message = len(messages) == 0
-            if is_first_message:
-                title = generate_title_from_message_with_llm(message, self.title_chain)
-                self.logger.info(f"Generated title for new session: {title}")
-                await self.chat_repository.save_session_title(user_id, session_id, title)
-
-            def get_memory(_):
-                return history
-            chain_with_history = RunnableWithMessageHistory(
-                self.chain,
-                get_memory,
-                input_messages_key="input",
-                history_messages_key="history"
-            )
-            self.logger.info(f"Invoking chain with history with user_id: {user_id}, session_id: {session_id}")
-            response = chain_with_history.invoke(
-                {"input": message},
-                config={"configurable": {"session_id": session_id}}
-            )
+            title = await generate_title_from_message_with_llm(message, self.title_chain)
+            self.logger.info(f"Generated title for new session: {title}")
+            await self.chat_repository.update_session_title(user_id, session_id, title)
+        except Exception as e:
+            # タイトル生成の失敗で回答を失敗させない
+            self.logger.error(f"Error generating session title for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+
+    async def _lookup_cached_answer(self, message: str, is_first_message: bool) -> Tuple[Optional[str], Any]:
+        """
+        初回メッセージの場合に意味的に近い質問の回答をキャッシュから探す
+
+        Returns:
+            Tuple[Optional[str], Any]: キャッシュ済みの回答（なければNone）と、回答を保存する際に使う質問文の埋め込み
+        """
+        if self.answer_cache is None or not is_first_message:
+            return None, None
+        try:
+            return await self.answer_cache.lookup(message)
+        except Exception as e:
+            # キャッシュの失敗で回答を失敗させない
+            self.logger.warning(f"Answer cache lookup failed: {str(e)}")
+            return None, None
+
+    def _with_history(self, history: DatabaseHistory) -> RunnableWithMessageHistory:
+        """会話履歴を差し込んだチェーンを作成する"""
+        def get_memory(_):
+            return history
+        return RunnableWithMessageHistory(
+            self.chain,
+            get_memory,
+            input_messages_key="input",
+            history_messages_key="history"
+        )
+
+    @traceable
+    async def get_response(self, message: str, user_id: str, session_id: str, retrieval: Optional[RetrievalOptions] = None) -> List[ChatMessage]:
+        """
+        Get a response from the LLM based on the input message.
+        retrieval: 検索オプション（指定した項目だけ既定値を上書きする）
+        Returns:
+            ChatMessage: The latest assistant message (with no, role, content)
+        """
+        self._validate_request(message, user_id, session_id)
+
+        try:
+            history, is_first_message, title_task = await self._prepare_history(message, user_id, session_id)
+            # 検索オプションを指定した場合は、既定の検索で生成したキャッシュ済みの回答を使わない
+            cached_answer, question_embedding = await self._lookup_cached_answer(message, is_first_message and retrieval is None)
+            if cached_answer is not None:
+                answer = cached_answer
+            else:
+                chain_with_history = self._with_history(history)
+                self.logger.info(f"Invoking chain with history with user_id: {user_id}, session_id: {session_id}")
+                response = await chain_with_history.ainvoke(
+                    {"input": message, "retrieval": self.retrieval_options.merge(retrieval) if retrieval is not None else None},
+                    config={"configurable": {"session_id": session_id}}
+                )
+                answer = response.content
+                if question_embedding is not None:
+                    self.answer_cache.store(message, question_embedding, answer)
             self.logger.info(f"History messages count: {len(history.messages)}")
+            if title_task is not None:
+                await title_task
             # メッセージをDBに保存
             current_messages = DatabaseHistory()
             current_messages.add_messages([
                 HumanMessage(content=message), 
-                AIMessage(content=response.content)
+                AIMessage(content=answer)
             ])
-            return await self._save_messages(user_id, session_id, current_messages.messages)
+            saved_messages = await self._save_messages(user_id, session_id, current_messages.messages)
+            self._schedule_title_upgrade(message, user_id, session_id, is_first_message)
+            return saved_messages
         except Exception as e:
             self.logger.error(f"Error in get_response for user_id={user_id}, session_id={session_id}, message='{message[:100]}...': {str(e)}", exc_info=True)
             raise
 
+    async def stream_response(self, message: str, user_id: str, session_id: str, retrieval: Optional[RetrievalOptions] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        LLMの回答をトークン単位でストリーミングし、完了後にユーザー/アシスタントのメッセージを保存する
+        retrieval: 検索オプション（指定した項目だけ既定値を上書きする）
+
+        Yields:
+            {"type": "token", "content": str}: 生成されたトークン
+            {"type": "done", "messages": List[ChatMessage]}: 保存済みのメッセージ（no割り当て済み）
+        """
+        self._validate_request(message, user_id, session_id)
+
+        try:
+            history, is_first_message, title_task = await self._prepare_history(message, user_id, session_id)
+            # 検索オプションを指定した場合は、既定の検索で生成したキャッシュ済みの回答を使わない
+            cached_answer, question_embedding = await self._lookup_cached_answer(message, is_first_message and retrieval is None)
+            chunks = []
+            if cached_answer is not None:
+                chunks.append(cached_answer)
+                yield {"type": "token", "content": cached_answer}
+            else:
+                chain_with_history = self._with_history(history)
+                self.logger.info(f"Streaming chain with history with user_id: {user_id}, session_id: {session_id}")
+                async for chunk in chain_with_history.astream(
+                    {"input": message, "retrieval": self.retrieval_options.merge(retrieval) if retrieval is not None else None},
+                    config={"configurable": {"session_id": session_id}}
+                ):
+                    if chunk.content:
+                        chunks.append(chunk.content)
+                        yield {"type": "token", "content": chunk.content}
+                if question_embedding is not None:
+                    self.answer_cache.store(message, question_embedding, "".join(chunks))
+            if title_task is not None:
+                await title_task
+
+            # ストリーミング完了後にメッセージをDBに保存
+            saved_messages = await self._save_messages(user_id, session_id, [
+                HumanMessage(content=message),
+                AIMessage(content="".join(chunks))
+            ])
+            self._schedule_title_upgrade(message, user_id, session_id, is_first_message)
+            yield {"type": "done", "messages": saved_messages}
+        except Exception as e:
+            self.logger.error(f"Error in stream_response for user_id={user_id}, session_id={session_id}, message='{message[:100]}...': {str(e)}", exc_info=True)
+            raise
+
     async def clear_memory(self, user_id: str, session_id: str = "default"):
         """
         Clear the conversation memory for a specific session.
@@ -181,7 +520,7 @@ class ChatManager:
             raise
 
     @traceable
-    async def edit_message_and_get_response(self, message: str, user_id: str, session_id: str, no: int) -> ChatMessage:
+    async def edit_message_and_get_response(self, message: str, user_id: str, session_id: str, no: int, retrieval: Optional[RetrievalOptions] = None) -> ChatMessage:
         """
         指定されたNo以降の履歴を削除し、新しいメッセージを送信してレスポンスを取得する
         
@@ -190,6 +529,7 @@ class ChatManager:
             user_id (str): ユーザーID
             session_id (str): セッションID
             no (int): 削除開始するNo
+            retrieval (Optional[RetrievalOptions]): 検索オプション
             
         Returns:
             ChatMessage: AIのレスポンスメッセージのみ
@@ -210,7 +550,7 @@ class ChatManager:
             
             # 2. 新しいメッセージを送信
             self.logger.info(f"Sending new message for user_id={user_id}, session_id={session_id}")
-            messages = await self.get_response(message, user_id, session_id)
+            messages = await self.get_response(message, user_id, session_id, retrieval)
             
             # 3. AIのレスポンス（最後のメッセージ）のみを返す
             if not messages:
@@ -6,6 +6,7 @@ from db.chat.factory import ChatRepositoryFactory
 from dotenv import load_dotenv
 from langchain_openai import AzureOpenAIEmbeddings,AzureChatOpenAI
 from chromadb.config import Settings
+from retrieval.embedding_cache import create_cached_embeddings
 
 class Container(containers.DeclarativeContainer):
     # 環境変数の読み込み
@@ -31,7 +32,7 @@ class Container(containers.DeclarativeContainer):
     #     OllamaEmbeddings,
     #     **embeddings_kwargs
     # )
-    embeddings = providers.Singleton(
+    azure_embeddings = providers.Singleton(
         AzureOpenAIEmbeddings,
         api_key = os.getenv("AZURE_OPENAI_API_KEY"),  
         api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21"),
@@ -39,6 +40,16 @@ class Container(containers.DeclarativeContainer):
         model = os.getenv("AZURE_EMBEDDING_MODEL", "text-embedding-3-small")
     )
 
+    # 埋め込みキャッシュ（プロセス内LRU + EMBEDDING_CACHE_PATH指定時はSQLiteにEMBEDDING_CACHE_MAX_ROWS件まで永続化）
+    embeddings = providers.Singleton(
+        create_cached_embeddings,
+        embeddings=azure_embeddings,
+        model_name=os.getenv("AZURE_EMBEDDING_MODEL", "text-embedding-3-small"),
+        max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+        store_path=os.getenv("EMBEDDING_CACHE_PATH", ""),
+        store_max_rows=int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "100000"))
+    )
+
     # ChromaDB Settings
     chroma_settings = providers.Singleton(
         Settings,
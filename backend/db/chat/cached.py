@@ -0,0 +1,188 @@
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from logging import getLogger
+from cachetools import LRUCache, TTLCache
+from .interface import IChatRepo
+from .models import ChatMessage, SessionTitle, SessionSummary, HistorySummary
+
+# ChatMessage 1件あたりの内容以外のメモリ使用量の目安（バイト）
+MESSAGE_OVERHEAD_BYTES = 200
+
+class _CachedSession(NamedTuple):
+    """キャッシュしたセッションのメッセージ（after_noより後のメッセージをすべて保持する）"""
+    after_no: int
+    messages: List[ChatMessage]
+
+def _session_size(session: _CachedSession) -> int:
+    """キャッシュするセッションのおおよそのメモリ使用量（バイト）を返す"""
+    return sum(len(message.content.encode("utf-8")) + MESSAGE_OVERHEAD_BYTES for message in session.messages) + MESSAGE_OVERHEAD_BYTES
+
+class CachedChatRepo(IChatRepo):
+    """
+    直近に使われたセッションのメッセージをキャッシュするリポジトリ
+
+    セッションの読み込み結果をバイト数で上限を設けたLRU（+ TTL）に保持し、以降の読み込みはキャッシュから返す。
+    会話履歴の読み込み（after_no以降の全メッセージ）は末尾だけをキャッシュし、after_noが進むと古いメッセージを捨てる。
+    保存時はキャッシュ済みのセッションに追記し、削除系の操作ではセッションのキャッシュを破棄する。
+    他のプロセスからの書き込みはTTLが切れるまで反映されない。
+    """
+
+    def __init__(self, repository: IChatRepo, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300.0):
+        """
+        Args:
+            repository: 実際に永続化を行うリポジトリ
+            max_bytes: キャッシュするメッセージの合計サイズの上限（バイト）
+            ttl: セッションをキャッシュする期間（秒）
+        """
+        self.logger = getLogger("uvicorn.app")
+        self.repository = repository
+        self._sessions: TTLCache = TTLCache(maxsize=max_bytes, ttl=ttl, getsizeof=_session_size)
+        # (user_id, session_id) -> 最後に書き込んだ時点の書き込み番号（読み込み中の書き込みを検出するため）
+        self._write_seqs: LRUCache = LRUCache(maxsize=10000)
+        self._write_seq = 0
+        self._hits = 0
+        self._misses = 0
+
+    def _mark_written(self, key: Tuple[str, str]) -> None:
+        """セッションへの書き込みを記録する"""
+        self._write_seq += 1
+        self._write_seqs[key] = self._write_seq
+
+    def _store(self, key: Tuple[str, str], session: _CachedSession) -> None:
+        """セッションをキャッシュする（上限を超える大きさのセッションはキャッシュしない）"""
+        try:
+            self._sessions[key] = session
+        except ValueError:
+            self._sessions.pop(key, None)
+            self.logger.info(f"Session too large to cache for user_id={key[0]}, session_id={key[1]}")
+
+    def stats(self) -> Dict[str, Any]:
+        """キャッシュのヒット率と使用量を返す"""
+        total = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / total if total else 0.0,
+            "sessions": len(self._sessions),
+            "bytes": self._sessions.currsize,
+            "max_bytes": self._sessions.maxsize
+        }
+
+    async def initialize(self) -> None:
+        await self.repository.initialize()
+
+    async def health_check(self) -> bool:
+        return await self.repository.health_check()
+
+    async def close(self) -> None:
+        self._sessions.clear()
+        await self.repository.close()
+
+    async def save_chat_message(self, user_id: str, session_id: str, message: ChatMessage) -> ChatMessage:
+        """チャットメッセージを保存し、キャッシュ済みのセッションに追記する"""
+        saved_message = await self.repository.save_chat_message(user_id, session_id, message)
+        self._append(user_id, session_id, [saved_message])
+        return saved_message
+
+    async def save_chat_messages(self, user_id: str, session_id: str, messages: List[ChatMessage]) -> List[ChatMessage]:
+        """複数のチャットメッセージを保存し、キャッシュ済みのセッションに追記する"""
+        saved_messages = await self.repository.save_chat_messages(user_id, session_id, messages)
+        self._append(user_id, session_id, saved_messages)
+        return saved_messages
+
+    def _append(self, user_id: str, session_id: str, messages: List[ChatMessage]) -> None:
+        """キャッシュ済みのセッションに保存したメッセージを追記する"""
+        key = (user_id, session_id)
+        self._mark_written(key)
+        cached = self._sessions.get(key)
+        if cached is not None:
+            # サイズを計算し直すため、追記したリストで置き換える
+            self._store(key, _CachedSession(cached.after_no, cached.messages + list(messages)))
+
+    def _invalidate(self, user_id: str, session_id: str) -> None:
+        """セッションのキャッシュを破棄する"""
+        key = (user_id, session_id)
+        self._mark_written(key)
+        self._sessions.pop(key, None)
+
+    async def reserve_nos(self, user_id: str, session_id: str, count: int) -> int:
+        return await self.repository.reserve_nos(user_id, session_id, count)
+
+    async def get_chat_messages(self, user_id: str, session_id: str, limit: Optional[int] = None, after_no: Optional[int] = None) -> List[ChatMessage]:
+        """
+        キャッシュ済みの範囲の読み込みはキャッシュから、それ以外は内部のリポジトリから取得する
+
+        limitを指定しない読み込み（ChatManagerの会話履歴の読み込みなど）はafter_noより後の全メッセージをキャッシュする。
+        limitを指定したページ単位の読み込みは、キャッシュ済みの範囲でなければキャッシュしない。
+        """
+        key = (user_id, session_id)
+        from_no = after_no or 0
+        cached = self._sessions.get(key)
+        if cached is not None and from_no >= cached.after_no:
+            self._hits += 1
+            messages = [message for message in cached.messages if message.no > from_no] if from_no > cached.after_no else cached.messages
+            if limit is None and from_no > cached.after_no:
+                # 会話履歴の範囲が進んだ場合は、以降読まれない古いメッセージをキャッシュから捨てる
+                self._store(key, _CachedSession(from_no, messages))
+            return list(messages[:limit] if limit is not None else messages)
+
+        self._misses += 1
+        if limit is not None:
+            # ページ単位の読み込みは範囲の末尾までではないためキャッシュしない
+            return await self.repository.get_chat_messages(user_id, session_id, limit=limit, after_no=after_no)
+
+        start_seq = self._write_seq
+        messages = list(await self.repository.get_chat_messages(user_id, session_id, after_no=after_no))
+        # 読み込み中に書き込まれたセッションは古い内容をキャッシュしないようにする
+        if self._write_seqs.get(key, 0) <= start_seq:
+            self._store(key, _CachedSession(from_no, messages))
+        return list(messages)
+
+    async def clear_chat_messages(self, user_id: str, session_id: str) -> None:
+        try:
+            await self.repository.clear_chat_messages(user_id, session_id)
+        finally:
+            self._invalidate(user_id, session_id)
+
+    async def delete_chat_message_by_no(self, user_id: str, session_id: str, no: int) -> None:
+        try:
+            await self.repository.delete_chat_message_by_no(user_id, session_id, no)
+        finally:
+            self._invalidate(user_id, session_id)
+
+    async def delete_messages_from_no(self, user_id: str, session_id: str, no: int) -> None:
+        try:
+            await self.repository.delete_messages_from_no(user_id, session_id, no)
+        finally:
+            self._invalidate(user_id, session_id)
+
+    async def delete_sessions(self, user_id: str, session_ids: List[str]) -> int:
+        try:
+            return await self.repository.delete_sessions(user_id, session_ids)
+        finally:
+            for session_id in session_ids:
+                self._invalidate(user_id, session_id)
+
+    async def get_session_ids(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None) -> List[str]:
+        return await self.repository.get_session_ids(user_id, limit=limit, after=after)
+
+    async def save_session_title(self, user_id: str, session_id: str, title: str) -> SessionTitle:
+        return await self.repository.save_session_title(user_id, session_id, title)
+
+    async def get_session_titles(self, user_id: str, limit: Optional[int] = None, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> List[SessionTitle]:
+        return await self.repository.get_session_titles(user_id, limit=limit, before=before, before_session_id=before_session_id)
+
+    async def update_session_title(self, user_id: str, session_id: str, title: str) -> SessionTitle:
+        return await self.repository.update_session_title(user_id, session_id, title)
+
+    async def delete_session_title(self, user_id: str, session_id: str) -> None:
+        await self.repository.delete_session_title(user_id, session_id)
+
+    async def get_session_summaries(self, user_id: str, limit: Optional[int] = None, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> List[SessionSummary]:
+        return await self.repository.get_session_summaries(user_id, limit=limit, before=before, before_session_id=before_session_id)
+
+    async def get_history_summary(self, user_id: str, session_id: str) -> Optional[HistorySummary]:
+        return await self.repository.get_history_summary(user_id, session_id)
+
+    async def save_history_summary(self, user_id: str, session_id: str, summary: HistorySummary) -> None:
+        await self.repository.save_history_summary(user_id, session_id, summary)
@@ -1,119 +1,697 @@
-from azure.cosmos import CosmosClient
-from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from azure.core import MatchConditions
+from azure.cosmos import PartitionKey
+from azure.cosmos.aio import CosmosClient
+from azure.cosmos.exceptions import (
+    CosmosAccessConditionFailedError,
+    CosmosBatchOperationError,
+    CosmosResourceExistsError,
+    CosmosResourceNotFoundError
+)
 from .interface import IChatRepo
-from .models import ChatMessage
+from .models import ChatMessage, SessionTitle, SessionSummary, HistorySummary, SESSION_PREVIEW_LENGTH
+from datetime import datetime
+from logging import getLogger
+import asyncio
 import os
-from typing import Optional, List, Dict, Any
+from typing import Callable, Optional, List, Dict, Any, Tuple
+
+# 1回のトランザクションバッチに含められる操作数の上限
+MAX_BATCH_OPERATIONS = 100
+# セッション一覧・タイトル一覧を(updated_at, session_id)の降順で並べるための複合インデックス
+# （Cosmos DBは複数のプロパティでのORDER BYに複合インデックスが必要）
+SESSION_ORDER_COMPOSITE_INDEX = [
+    {"path": "/updated_at", "order": "descending"},
+    {"path": "/session_id", "order": "descending"}
+]
+
+def _format_datetime(value: datetime) -> str:
+    """日時を文字列の大小で比較できる形式に変換する"""
+    return value.isoformat(timespec="microseconds")
+
+def _before_cursor(parameters: List[Dict[str, Any]], before: Optional[datetime], before_session_id: Optional[str]) -> str:
+    """一覧のカーソルより後ろ（(updated_at, session_id)の降順で後ろ）のセッションの条件を返し、パラメータをparametersに追加する"""
+    if before is None:
+        return ""
+    parameters.append({"name": "@before", "value": _format_datetime(before)})
+    if before_session_id is None:
+        return " AND c.updated_at < @before"
+    parameters.append({"name": "@before_session_id", "value": before_session_id})
+    return " AND (c.updated_at < @before OR (c.updated_at = @before AND c.session_id < @before_session_id))"
+
+class _RequestCharge:
+    """response_hookで受け取ったRU（x-ms-request-charge）を合計する"""
 
-class CosmosDBClient(IChatRepo):
     def __init__(self):
+        self.total = 0.0
+
+    def __call__(self, headers: Dict[str, Any], *args: Any) -> None:
+        self.total += float(headers.get("x-ms-request-charge", 0) or 0)
+
+class CosmosDBClient(IChatRepo):
+    """
+    Azure Cosmos DB（NoSQL API）にチャット履歴を保存するリポジトリ
+
+    1つのコンテナーに、メッセージ・セッションのサマリー（採番用のseq・タイトル・メッセージ数・プレビュー）・
+    履歴の要約をtypeで区別して保存する。
+    パーティションキーは/user_idのため、セッションの読み書きもセッション一覧の取得もすべて単一パーティションで完結する。
+    1往復分のメッセージはセッションのサマリーの更新（ETagによる楽観的排他）と合わせてトランザクションバッチで保存する。
+    各操作のRU消費量はログに出力する。
+    """
+
+    def __init__(
+        self,
+        endpoint: Optional[str] = None,
+        key: Optional[str] = None,
+        database_name: Optional[str] = None,
+        container_name: Optional[str] = None,
+        connection_verify: bool = True,
+        max_conflict_retries: int = 5
+    ):
+        """
+        Args:
+            endpoint: Cosmos DBのエンドポイント（省略時は環境変数 COSMOS_ENDPOINT）
+            key: アカウントキー（省略時は環境変数 COSMOS_KEY）
+            database_name: データベース名（省略時は環境変数 COSMOS_DATABASE_NAME）
+            container_name: コンテナー名（省略時は環境変数 COSMOS_CONTAINER_NAME）
+            connection_verify: TLS証明書を検証するか（エミュレーターではFalseにする）
+            max_conflict_retries: 同じセッションへの同時書き込みでサマリーの更新が競合した場合の再試行回数
+        """
+        self.logger = getLogger("uvicorn.app")
         # 環境変数から接続情報を取得
-        self.endpoint = os.getenv("COSMOS_ENDPOINT")
-        self.key = os.getenv("COSMOS_KEY")
-        self.database_name = os.getenv("COSMOS_DATABASE_NAME", "chatdb")
-        self.container_name = os.getenv("COSMOS_CONTAINER_NAME", "chats")
-        
-        # Cosmos DBクライアントの初期化
-        self.client = CosmosClient(self.endpoint, self.key)
-        self.database = self.client.get_database_client(self.database_name)
-        self.container = self.database.get_container_client(self.container_name)
-
-    # IChatRepoインターフェースの実装（まだ実装されていないメソッド）
+        self.endpoint = endpoint or os.getenv("COSMOS_ENDPOINT")
+        self.key = key or os.getenv("COSMOS_KEY")
+        self.database_name = database_name or os.getenv("COSMOS_DATABASE_NAME", "chatdb")
+        self.container_name = container_name or os.getenv("COSMOS_CONTAINER_NAME", "chats")
+        self.max_conflict_retries = max_conflict_retries
+
+        # Cosmos DBクライアントの初期化（コンテナーはinitializeで作成する）
+        self.client = CosmosClient(self.endpoint, credential=self.key, connection_verify=connection_verify)
+        self.database = None
+        self.container = None
+        self._container_lock = asyncio.Lock()
+
+    async def _get_container(self):
+        """データベースとコンテナーを作成し（作成済みの場合は取得し）、コンテナーを返す"""
+        if self.container is None:
+            async with self._container_lock:
+                if self.container is None:
+                    self.database = await self.client.create_database_if_not_exists(id=self.database_name)
+                    self.container = await self.database.create_container_if_not_exists(
+                        id=self.container_name,
+                        partition_key=PartitionKey(path="/user_id"),
+                        indexing_policy={
+                            "indexingMode": "consistent",
+                            "includedPaths": [{"path": "/*"}],
+                            "excludedPaths": [{"path": "/\"_etag\"/?"}],
+                            "compositeIndexes": [SESSION_ORDER_COMPOSITE_INDEX]
+                        }
+                    )
+        return self.container
+
+    async def _ensure_composite_index(self) -> None:
+        """作成済みのコンテナーのインデックスポリシーに一覧の並び順の複合インデックスがなければ追加する"""
+        container = await self._get_container()
+        properties = await container.read()
+        policy = properties.get("indexingPolicy") or {}
+        composite_indexes = policy.get("compositeIndexes") or []
+        if SESSION_ORDER_COMPOSITE_INDEX in composite_indexes:
+            return
+        policy["compositeIndexes"] = composite_indexes + [SESSION_ORDER_COMPOSITE_INDEX]
+        await self.database.replace_container(
+            container,
+            partition_key=PartitionKey(path="/user_id"),
+            indexing_policy=policy
+        )
+        self.logger.info(f"Added composite index (updated_at, session_id) to Cosmos DB container: {self.container_name}")
+
+    def _log_charge(self, operation: str, charge: _RequestCharge, user_id: str, session_id: Optional[str] = None) -> None:
+        """操作ごとのRU消費量をログに出力する"""
+        self.logger.info(f"Cosmos DB {operation} for user_id={user_id}, session_id={session_id} consumed {charge.total:.2f} RU")
+
+    async def _query(
+        self,
+        query: str,
+        parameters: List[Dict[str, Any]],
+        user_id: str,
+        charge: _RequestCharge,
+        limit: Optional[int] = None
+    ) -> List[Any]:
+        """単一パーティション（user_id）へのクエリを実行し、継続トークンでページをたどって結果を返す"""
+        container = await self._get_container()
+        pages = container.query_items(
+            query=query,
+            parameters=parameters,
+            partition_key=user_id,
+            max_item_count=limit if limit is not None else -1,
+            response_hook=charge
+        ).by_page()
+        items: List[Any] = []
+        async for page in pages:
+            async for item in page:
+                items.append(item)
+                if limit is not None and len(items) >= limit:
+                    return items
+        return items
+
+    async def _delete_items(self, user_id: str, item_ids: List[str], charge: _RequestCharge) -> None:
+        """同じパーティションのアイテムをトランザクションバッチでまとめて削除する（最大100件ずつ）"""
+        container = await self._get_container()
+        for i in range(0, len(item_ids), MAX_BATCH_OPERATIONS):
+            await container.execute_item_batch(
+                batch_operations=[("delete", (item_id,)) for item_id in item_ids[i:i + MAX_BATCH_OPERATIONS]],
+                partition_key=user_id,
+                response_hook=charge
+            )
+
+    async def _read_item(self, item_id: str, user_id: str, charge: _RequestCharge) -> Optional[Dict[str, Any]]:
+        """アイテムをポイント読み取りする（存在しない場合はNone）"""
+        container = await self._get_container()
+        try:
+            return await container.read_item(item=item_id, partition_key=user_id, response_hook=charge)
+        except CosmosResourceNotFoundError:
+            return None
+
+    async def _delete_item_if_exists(self, item_id: str, user_id: str, charge: _RequestCharge) -> bool:
+        """アイテムを削除し、削除できたかを返す（存在しない場合はFalse）"""
+        container = await self._get_container()
+        try:
+            await container.delete_item(item=item_id, partition_key=user_id, response_hook=charge)
+            return True
+        except CosmosResourceNotFoundError:
+            return False
+
+    @staticmethod
+    def _message_id(session_id: str, no: int) -> str:
+        return f"message:{session_id}:{no}"
+
+    @staticmethod
+    def _session_doc_id(session_id: str) -> str:
+        return f"session:{session_id}"
+
+    @staticmethod
+    def _summary_id(session_id: str) -> str:
+        return f"summary:{session_id}"
+
+    def _session_body(self, user_id: str, session_id: str, existing: Optional[Dict[str, Any]], now: str) -> Dict[str, Any]:
+        """書き戻すセッションのサマリーを返す（既存のドキュメントはシステムプロパティを除いてコピーする）"""
+        if existing is not None:
+            return {key: value for key, value in existing.items() if not key.startswith("_")}
+        return {
+            "id": self._session_doc_id(session_id),
+            "type": "session",
+            "user_id": user_id,
+            "session_id": session_id,
+            "seq": 0,
+            "message_count": 0,
+            "last_no": 0,
+            "preview": "",
+            "created_at": now,
+            "updated_at": now
+        }
+
+    @staticmethod
+    def _drop_if_empty(body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """メッセージもタイトルもなく採番も始まっていないセッションのサマリーは削除する（Noneを返す）"""
+        if "title" not in body and body["seq"] == 0 and body["message_count"] == 0:
+            return None
+        return body
+
+    async def _update_session(
+        self,
+        user_id: str,
+        session_id: str,
+        update: Callable[[Optional[Dict[str, Any]]], Optional[Dict[str, Any]]],
+        charge: _RequestCharge
+    ) -> Optional[Dict[str, Any]]:
+        """
+        セッションのサマリーを読み取り、updateで変更した内容をETagによる楽観的排他で書き戻す
+
+        updateは既存のドキュメント（存在しない場合はNone）を受け取り、書き込むドキュメント（削除する場合はNone）を返す。
+        受け取ったドキュメントをそのまま返した場合は書き込まない。読み取り後に他の書き込みで更新されていた場合は読み直して再試行する。
+        """
+        container = await self._get_container()
+        item_id = self._session_doc_id(session_id)
+        attempt = 0
+        while True:
+            existing = await self._read_item(item_id, user_id, charge)
+            body = update(existing)
+            if body is existing:
+                return body
+            try:
+                if body is None:
+                    if existing is not None:
+                        await container.delete_item(
+                            item=item_id,
+                            partition_key=user_id,
+                            etag=existing["_etag"],
+                            match_condition=MatchConditions.IfNotModified,
+                            response_hook=charge
+                        )
+                elif existing is None:
+                    await container.create_item(body=body, response_hook=charge)
+                else:
+                    await container.replace_item(
+                        item=item_id,
+                        body=body,
+                        etag=existing["_etag"],
+                        match_condition=MatchConditions.IfNotModified,
+                        response_hook=charge
+                    )
+                return body
+            except (CosmosAccessConditionFailedError, CosmosResourceExistsError):
+                if attempt >= self.max_conflict_retries:
+                    raise
+                attempt += 1
+                self.logger.warning(f"Retrying session summary update after conflict for user_id={user_id}, session_id={session_id} (attempt {attempt})")
+
+    async def _latest_message(self, user_id: str, session_id: str, charge: _RequestCharge) -> Optional[Dict[str, Any]]:
+        """セッションの最後のメッセージ（no, content）を返す"""
+        items = await self._query(
+            "SELECT TOP 1 c.no, c.content FROM c WHERE c.type = 'message' AND c.session_id = @session_id ORDER BY c.no DESC",
+            [{"name": "@session_id", "value": session_id}],
+            user_id,
+            charge,
+            1
+        )
+        return items[0] if items else None
+
+    async def initialize(self) -> None:
+        """データベースとコンテナーを作成する（作成済みの場合は何もしない）"""
+        try:
+            await self._get_container()
+            await self._ensure_composite_index()
+            self.logger.info(f"Ensured Cosmos DB container: {self.database_name}/{self.container_name}")
+        except Exception as e:
+            self.logger.error(f"Error creating Cosmos DB container: {str(e)}", exc_info=True)
+            raise
+
+    async def health_check(self) -> bool:
+        """Cosmos DBのコンテナーを読み取れるかを返す"""
+        try:
+            container = await self._get_container()
+            await container.read()
+            return True
+        except Exception as e:
+            self.logger.error(f"Cosmos DB health check failed: {str(e)}")
+            return False
+
+    async def close(self) -> None:
+        """Cosmos DBクライアントの接続を閉じる"""
+        await self.client.close()
+        self.logger.info("Closed Cosmos DB client")
+
     async def save_chat_message(self, user_id: str, session_id: str, message: ChatMessage) -> ChatMessage:
         """チャットメッセージを保存し、no割り当て済みのChatMessageを返す"""
-        # TODO: 実装が必要
-        raise NotImplementedError("This method needs to be implemented")
+        saved_messages = await self.save_chat_messages(user_id, session_id, [message])
+        return saved_messages[0]
+
+    async def save_chat_messages(self, user_id: str, session_id: str, messages: List[ChatMessage]) -> List[ChatMessage]:
+        """複数のチャットメッセージを連続したnoでまとめて保存し、no割り当て済みのChatMessageを順に返す"""
+        self.logger.info(f"Saving {len(messages)} chat messages for user {user_id}, session {session_id}")
+        charge = _RequestCharge()
+        try:
+            saved_messages: List[ChatMessage] = []
+            # セッションのサマリーの更新を含めてバッチの上限に収まるよう分割する
+            for i in range(0, len(messages), MAX_BATCH_OPERATIONS - 1):
+                saved_messages.extend(await self._save_batch(user_id, session_id, messages[i:i + MAX_BATCH_OPERATIONS - 1], charge))
+            self._log_charge("save_chat_messages", charge, user_id, session_id)
+            return saved_messages
+        except Exception as e:
+            self.logger.error(f"Error saving chat messages for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
 
-    async def get_chat_messages(self, user_id: str, session_id: str) -> List[ChatMessage]:
+    async def _save_batch(self, user_id: str, session_id: str, messages: List[ChatMessage], charge: _RequestCharge) -> List[ChatMessage]:
+        """セッションのサマリーの更新（採番を含む）とメッセージの作成を1つのトランザクションバッチで行う"""
+        container = await self._get_container()
+        session_doc_id = self._session_doc_id(session_id)
+        attempt = 0
+        while True:
+            session = await self._read_item(session_doc_id, user_id, charge)
+            body = self._session_body(user_id, session_id, session, _format_datetime(datetime.utcnow()))
+            if all(message.no > 0 for message in messages):
+                # 採番済みのメッセージ（write-behind）はそのnoで保存し、seqを追いつかせる
+                messages_with_no = list(messages)
+                max_no = max(message.no for message in messages_with_no)
+                body["seq"] = max(body["seq"], max_no)
+                body["last_no"] = max(body["last_no"], max_no)
+            else:
+                messages_with_no = [
+                    ChatMessage(no=body["seq"] + i, role=message.role, content=message.content)
+                    for i, message in enumerate(messages, start=1)
+                ]
+                body["seq"] += len(messages)
+                body["last_no"] = body["seq"]
+            body["message_count"] += len(messages_with_no)
+            body["preview"] = messages_with_no[-1].content[:SESSION_PREVIEW_LENGTH]
+            body["updated_at"] = _format_datetime(datetime.utcnow())
+
+            if session is None:
+                operations: List[Tuple[Any, ...]] = [("create", (body,))]
+            else:
+                # 読み取り後に他の書き込みでサマリーが更新されていた場合はバッチ全体が失敗する
+                operations = [("replace", (session_doc_id, body), {"if_match_etag": session["_etag"]})]
+            operations.extend(
+                ("create", ({
+                    "id": self._message_id(session_id, message.no),
+                    "type": "message",
+                    "user_id": user_id,
+                    "session_id": session_id,
+                    "no": message.no,
+                    "role": message.role,
+                    "content": message.content
+                },))
+                for message in messages_with_no
+            )
+            try:
+                await container.execute_item_batch(batch_operations=operations, partition_key=user_id, response_hook=charge)
+                return messages_with_no
+            except CosmosBatchOperationError as e:
+                # サマリーの操作（先頭）が競合した場合のみ読み直して再試行する
+                if e.error_index != 0 or attempt >= self.max_conflict_retries:
+                    raise
+                attempt += 1
+                self.logger.warning(f"Retrying chat message batch after session summary conflict for user_id={user_id}, session_id={session_id} (attempt {attempt})")
+
+    async def reserve_nos(self, user_id: str, session_id: str, count: int) -> int:
+        """メッセージを保存せずにセッションのnoをcount個連続で確保し、最後のnoを返す"""
+        charge = _RequestCharge()
+        try:
+            def reserve(session: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+                body = self._session_body(user_id, session_id, session, _format_datetime(datetime.utcnow()))
+                body["seq"] += count
+                return body
+
+            body = await self._update_session(user_id, session_id, reserve, charge)
+            self._log_charge("reserve_nos", charge, user_id, session_id)
+            return body["seq"]
+        except Exception as e:
+            self.logger.error(f"Error reserving chat message numbers for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def get_chat_messages(self, user_id: str, session_id: str, limit: Optional[int] = None, after_no: Optional[int] = None) -> List[ChatMessage]:
         """セッションIDに紐づくチャットメッセージを取得する"""
-        # TODO: 実装が必要
-        raise NotImplementedError("This method needs to be implemented")
+        self.logger.info(f"Getting chat messages for user {user_id}, session {session_id}")
+        charge = _RequestCharge()
+        try:
+            top = f"TOP {int(limit)} " if limit is not None else ""
+            items = await self._query(
+                f"SELECT {top}c.no, c.role, c.content FROM c "
+                "WHERE c.type = 'message' AND c.session_id = @session_id AND c.no > @after_no ORDER BY c.no",
+                [{"name": "@session_id", "value": session_id}, {"name": "@after_no", "value": after_no if after_no is not None else 0}],
+                user_id,
+                charge,
+                limit
+            )
+            self._log_charge("get_chat_messages", charge, user_id, session_id)
+            return [ChatMessage(**item) for item in items]
+        except Exception as e:
+            self.logger.error(f"Error getting chat messages for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
 
     async def clear_chat_messages(self, user_id: str, session_id: str) -> None:
         """指定したsession_idの全メッセージを削除する"""
-        # TODO: 実装が必要
-        raise NotImplementedError("This method needs to be implemented")
+        charge = _RequestCharge()
+        try:
+            deleted_count = await self._delete_messages(user_id, session_id, 1, charge)
+
+            def reset(session: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+                if session is None:
+                    return None
+                # 全削除した場合はnoを1から振り直す（タイトルは残す）
+                body = self._session_body(user_id, session_id, session, "")
+                body.update(seq=0, message_count=0, last_no=0, preview="")
+                return self._drop_if_empty(body)
+
+            await self._update_session(user_id, session_id, reset, charge)
+            await self._invalidate_history_summary(user_id, session_id, 1, charge)
+            self._log_charge("clear_chat_messages", charge, user_id, session_id)
+            self.logger.info(f"Cleared {deleted_count} messages for user_id={user_id}, session_id={session_id}")
+        except Exception as e:
+            self.logger.error(f"Error clearing chat messages for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def _delete_messages(self, user_id: str, session_id: str, from_no: int, charge: _RequestCharge) -> int:
+        """from_no以降のメッセージを削除し、削除した件数を返す"""
+        item_ids = await self._query(
+            "SELECT VALUE c.id FROM c WHERE c.type = 'message' AND c.session_id = @session_id AND c.no >= @no",
+            [{"name": "@session_id", "value": session_id}, {"name": "@no", "value": from_no}],
+            user_id,
+            charge
+        )
+        await self._delete_items(user_id, item_ids, charge)
+        return len(item_ids)
 
     async def delete_chat_message_by_no(self, user_id: str, session_id: str, no: int) -> None:
         """指定されたnoのメッセージを削除する"""
-        # TODO: 実装が必要
-        raise NotImplementedError("This method needs to be implemented")
+        charge = _RequestCharge()
+        try:
+            if not await self._delete_item_if_exists(self._message_id(session_id, no), user_id, charge):
+                self.logger.warning(f"No message found to delete for user_id={user_id}, session_id={session_id}, no={no}")
+                return
+            await self._refresh_last_message(user_id, session_id, 1, None, charge)
+            await self._invalidate_history_summary(user_id, session_id, no, charge)
+            self._log_charge("delete_chat_message_by_no", charge, user_id, session_id)
+            self.logger.info(f"Deleted message no={no} for user_id={user_id}, session_id={session_id}")
+        except Exception as e:
+            self.logger.error(f"Error deleting chat message for user_id={user_id}, session_id={session_id}, no={no}: {str(e)}", exc_info=True)
+            raise
 
-    async def get_session_ids(self, user_id: str) -> List[str]:
-        """user_idに紐づくすべてのsession_idを取得する"""
-        # TODO: 実装が必要
-        raise NotImplementedError("This method needs to be implemented")
+    async def delete_sessions(self, user_id: str, session_ids: List[str]) -> int:
+        """複数のセッションのメッセージ・サマリー・会話の要約を、トランザクションバッチでまとめて削除する"""
+        self.logger.info(f"Deleting {len(session_ids)} sessions for user {user_id}")
+        if not session_ids:
+            return 0
+        charge = _RequestCharge()
+        try:
+            items = await self._query(
+                "SELECT c.id, c.type FROM c WHERE ARRAY_CONTAINS(@session_ids, c.session_id)",
+                [{"name": "@session_ids", "value": list(session_ids)}],
+                user_id,
+                charge
+            )
+            await self._delete_items(user_id, [item["id"] for item in items], charge)
+            deleted_count = sum(1 for item in items if item["type"] == "message")
+            self._log_charge("delete_sessions", charge, user_id)
+            self.logger.info(f"Deleted {deleted_count} messages in {len(session_ids)} sessions for user_id={user_id}")
+            return deleted_count
+        except Exception as e:
+            self.logger.error(f"Error deleting sessions for user_id={user_id}: {str(e)}", exc_info=True)
+            raise
 
-    def create_chat(self, chat_data: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        チャットデータをCosmos DBに保存する
-        
-        Args:
-            chat_data (Dict[str, Any]): 保存するチャットデータ
-            
-        Returns:
-            Dict[str, Any]: 保存されたチャットデータ
-        """
-        return self.container.create_item(body=chat_data)
+    async def get_session_ids(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None) -> List[str]:
+        """user_idに紐づくsession_idを取得する"""
+        self.logger.info(f"Getting session IDs for user {user_id}")
+        charge = _RequestCharge()
+        try:
+            # メッセージを持つセッションにはサマリーが1つずつあるため、DISTINCTを使わずにサマリーを列挙する
+            top = f"TOP {int(limit)} " if limit is not None else ""
+            session_ids = await self._query(
+                f"SELECT {top}VALUE c.session_id FROM c "
+                "WHERE c.type = 'session' AND c.message_count > 0 AND c.session_id > @after ORDER BY c.session_id",
+                [{"name": "@after", "value": after if after is not None else ""}],
+                user_id,
+                charge,
+                limit
+            )
+            self._log_charge("get_session_ids", charge, user_id)
+            self.logger.info(f"Found {len(session_ids)} sessions for user {user_id}")
+            return session_ids
+        except Exception as e:
+            self.logger.error(f"Error getting session IDs for user_id={user_id}: {str(e)}", exc_info=True)
+            raise
 
-    def get_chat(self, chat_id: str) -> Optional[Dict[str, Any]]:
-        """
-        指定されたIDのチャットデータを取得する
-        
-        Args:
-            chat_id (str): 取得するチャットのID
-            
-        Returns:
-            Optional[Dict[str, Any]]: チャットデータ。存在しない場合はNone
-        """
+    async def delete_messages_from_no(self, user_id: str, session_id: str, no: int) -> None:
+        """指定されたno以降のメッセージを削除する"""
+        charge = _RequestCharge()
         try:
-            return self.container.read_item(item=chat_id, partition_key=chat_id)
-        except CosmosResourceNotFoundError:
-            return None
+            deleted_count = await self._delete_messages(user_id, session_id, no, charge)
+            # 末尾を削除した場合（編集）は削除したnoから振り直す。途中のnoは再利用しない
+            await self._refresh_last_message(user_id, session_id, deleted_count, no - 1, charge)
+            await self._invalidate_history_summary(user_id, session_id, no, charge)
+            self._log_charge("delete_messages_from_no", charge, user_id, session_id)
+            self.logger.info(f"Deleted {deleted_count} messages from no={no} for user_id={user_id}, session_id={session_id}")
+        except Exception as e:
+            self.logger.error(f"Error deleting messages from no={no} for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
 
-    def update_chat(self, chat_id: str, chat_data: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        チャットデータを更新する
-        
-        Args:
-            chat_id (str): 更新するチャットのID
-            chat_data (Dict[str, Any]): 更新するチャットデータ
-            
-        Returns:
-            Dict[str, Any]: 更新されたチャットデータ
-        """
-        return self.container.upsert_item(body=chat_data)
+    async def save_session_title(self, user_id: str, session_id: str, title: str) -> SessionTitle:
+        """セッションタイトルを保存する（既存のタイトルがある場合は更新する）"""
+        self.logger.info(f"Saving session title for user {user_id}, session {session_id}")
+        charge = _RequestCharge()
+        try:
+            now = datetime.utcnow()
 
-    def delete_chat(self, chat_id: str) -> None:
-        """
-        チャットデータを削除する
-        
-        Args:
-            chat_id (str): 削除するチャットのID
-        """
-        self.container.delete_item(item=chat_id, partition_key=chat_id)
+            def set_title(session: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+                body = self._session_body(user_id, session_id, session, _format_datetime(now))
+                body["title"] = title
+                body["updated_at"] = _format_datetime(now)
+                return body
 
-    def query_chats(self, query: str, parameters: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
-        """
-        クエリを実行してチャットデータを取得する
-        
-        Args:
-            query (str): 実行するクエリ
-            parameters (Optional[List[Dict[str, Any]]]): クエリパラメータ
-            
-        Returns:
-            List[Dict[str, Any]]: クエリ結果のリスト
-        """
-        if parameters:
-            return list(self.container.query_items(query=query, parameters=parameters))
-        return list(self.container.query_items(query=query))
+            body = await self._update_session(user_id, session_id, set_title, charge)
+            session_title = SessionTitle(
+                user_id=user_id,
+                session_id=session_id,
+                title=title,
+                created_at=datetime.fromisoformat(body["created_at"]),
+                updated_at=now
+            )
+            self._log_charge("save_session_title", charge, user_id, session_id)
+            self.logger.info(f"Saved session title for user {user_id}, session {session_id}")
+            return session_title
+        except Exception as e:
+            self.logger.error(f"Error saving session title for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
 
-    def get_all_chats(self) -> List[Dict[str, Any]]:
-        """
-        すべてのチャットデータを取得する
-        
-        Returns:
-            List[Dict[str, Any]]: チャットデータのリスト
-        """
-        query = "SELECT * FROM c"
-        return list(self.container.query_items(query=query)) 
\ No newline at end of file
+    async def get_session_titles(self, user_id: str, limit: Optional[int] = None, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> List[SessionTitle]:
+        """ユーザーのセッションタイトル一覧を更新日時の降順（同じ更新日時はsession_idの降順）で取得する"""
+        self.logger.info(f"Getting session titles for user {user_id}")
+        charge = _RequestCharge()
+        try:
+            top = f"TOP {int(limit)} " if limit is not None else ""
+            query = f"SELECT {top}c.user_id, c.session_id, c.title, c.created_at, c.updated_at FROM c WHERE c.type = 'session' AND IS_DEFINED(c.title)"
+            parameters: List[Dict[str, Any]] = []
+            query += _before_cursor(parameters, before, before_session_id)
+            query += " ORDER BY c.updated_at DESC, c.session_id DESC"
+            items = await self._query(query, parameters, user_id, charge, limit)
+            self._log_charge("get_session_titles", charge, user_id)
+            session_titles = [
+                SessionTitle(
+                    user_id=item["user_id"],
+                    session_id=item["session_id"],
+                    title=item["title"],
+                    created_at=datetime.fromisoformat(item["created_at"]),
+                    updated_at=datetime.fromisoformat(item["updated_at"])
+                )
+                for item in items
+            ]
+            self.logger.info(f"Found {len(session_titles)} session titles for user {user_id}")
+            return session_titles
+        except Exception as e:
+            self.logger.error(f"Error getting session titles for user_id={user_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def update_session_title(self, user_id: str, session_id: str, title: str) -> SessionTitle:
+        """セッションタイトルを更新する（タイトルが存在しない場合は新規作成する）"""
+        self.logger.info(f"Updating session title for user {user_id}, session {session_id}")
+        try:
+            return await self.save_session_title(user_id, session_id, title)
+        except Exception as e:
+            self.logger.error(f"Error updating session title for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def delete_session_title(self, user_id: str, session_id: str) -> None:
+        """セッションタイトルを削除する（メッセージ数やnoの採番はサマリーに残す）"""
+        self.logger.info(f"Deleting session title for user {user_id}, session {session_id}")
+        charge = _RequestCharge()
+        try:
+            deleted = False
+
+            def unset_title(session: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+                nonlocal deleted
+                deleted = session is not None and "title" in session
+                if not deleted:
+                    # タイトルがない場合は書き込まない
+                    return session
+                body = self._session_body(user_id, session_id, session, "")
+                del body["title"]
+                return self._drop_if_empty(body)
+
+            await self._update_session(user_id, session_id, unset_title, charge)
+            if deleted:
+                self.logger.info(f"Deleted session title for user_id={user_id}, session_id={session_id}")
+            else:
+                self.logger.warning(f"No session title found to delete for user_id={user_id}, session_id={session_id}")
+            self._log_charge("delete_session_title", charge, user_id, session_id)
+        except Exception as e:
+            self.logger.error(f"Error deleting session title for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def get_session_summaries(self, user_id: str, limit: Optional[int] = None, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> List[SessionSummary]:
+        """ユーザーのセッション一覧を、セッションのサマリーへの1回のクエリで更新日時の降順に取得する"""
+        self.logger.info(f"Getting session summaries for user {user_id}")
+        charge = _RequestCharge()
+        try:
+            top = f"TOP {int(limit)} " if limit is not None else ""
+            query = (
+                f"SELECT {top}c.user_id, c.session_id, c.title, c.created_at, c.updated_at, c.message_count, c.last_no, c.preview FROM c "
+                "WHERE c.type = 'session' AND (c.message_count > 0 OR IS_DEFINED(c.title))"
+            )
+            parameters: List[Dict[str, Any]] = []
+            query += _before_cursor(parameters, before, before_session_id)
+            query += " ORDER BY c.updated_at DESC, c.session_id DESC"
+            items = await self._query(query, parameters, user_id, charge, limit)
+            self._log_charge("get_session_summaries", charge, user_id)
+            summaries = [
+                SessionSummary(
+                    user_id=item["user_id"],
+                    session_id=item["session_id"],
+                    title=item.get("title"),
+                    created_at=datetime.fromisoformat(item["created_at"]),
+                    updated_at=datetime.fromisoformat(item["updated_at"]),
+                    message_count=item["message_count"],
+                    last_no=item["last_no"],
+                    preview=item["preview"]
+                )
+                for item in items
+            ]
+            self.logger.info(f"Found {len(summaries)} session summaries for user {user_id}")
+            return summaries
+        except Exception as e:
+            self.logger.error(f"Error getting session summaries for user_id={user_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def get_history_summary(self, user_id: str, session_id: str) -> Optional[HistorySummary]:
+        """セッションの古い会話の要約を取得する"""
+        charge = _RequestCharge()
+        try:
+            item = await self._read_item(self._summary_id(session_id), user_id, charge)
+            self._log_charge("get_history_summary", charge, user_id, session_id)
+            if item is None:
+                return None
+            return HistorySummary(content=item["content"], up_to_no=item["up_to_no"], updated_at=datetime.fromisoformat(item["updated_at"]))
+        except Exception as e:
+            self.logger.error(f"Error getting history summary for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def save_history_summary(self, user_id: str, session_id: str, summary: HistorySummary) -> None:
+        """セッションの古い会話の要約を保存する"""
+        self.logger.info(f"Saving history summary for user {user_id}, session {session_id}")
+        charge = _RequestCharge()
+        try:
+            container = await self._get_container()
+            await container.upsert_item(body={
+                "id": self._summary_id(session_id),
+                "type": "history_summary",
+                "user_id": user_id,
+                "session_id": session_id,
+                "content": summary.content,
+                "up_to_no": summary.up_to_no,
+                "updated_at": _format_datetime(summary.updated_at)
+            }, response_hook=charge)
+            self._log_charge("save_history_summary", charge, user_id, session_id)
+        except Exception as e:
+            self.logger.error(f"Error saving history summary for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def _refresh_last_message(self, user_id: str, session_id: str, deleted_count: int, seq_max: Optional[int], charge: _RequestCharge) -> None:
+        """メッセージを削除した後、セッションのサマリーのメッセージ数・最後のno・プレビューを更新する"""
+        latest = await self._latest_message(user_id, session_id, charge)
+
+        def refresh(session: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            if session is None:
+                return None
+            body = self._session_body(user_id, session_id, session, "")
+            body["message_count"] = max(body["message_count"] - deleted_count, 0)
+            body["last_no"] = latest["no"] if latest else 0
+            body["preview"] = latest["content"][:SESSION_PREVIEW_LENGTH] if latest else ""
+            if seq_max is not None:
+                body["seq"] = min(body["seq"], seq_max)
+            return self._drop_if_empty(body)
+
+        await self._update_session(user_id, session_id, refresh, charge)
+
+    async def _invalidate_history_summary(self, user_id: str, session_id: str, no: int, charge: _RequestCharge) -> None:
+        """削除されたメッセージ（no以降）を含む要約を破棄する"""
+        summary = await self._read_item(self._summary_id(session_id), user_id, charge)
+        if summary is not None and summary["up_to_no"] >= no:
+            await self._delete_items(user_id, [summary["id"]], charge)
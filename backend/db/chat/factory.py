@@ -2,6 +2,11 @@ from typing import Optional,Literal
 from .interface import IChatRepo
 from .inmemory import InMemoryChatRepo
 from .mongodb import MongoChatRepo
+from .mongodb_async import AsyncMongoChatRepo
+from .sqlite import SQLiteChatRepo
+from .cosmos_client import CosmosDBClient
+from .write_behind import WriteBehindChatRepo
+from .cached import CachedChatRepo
 import os
 
 class ChatRepositoryFactory:
@@ -10,30 +15,83 @@ class ChatRepositoryFactory:
     @classmethod
     def create_database(
         cls,
-        db_type: Literal["inmemory", "mongodb"] = "inmemory",
+        db_type: Literal["inmemory", "mongodb", "mongodb_async", "sqlite", "cosmos"] = "inmemory",
         **kwargs
     ) -> IChatRepo:
         """
         データベースインスタンスを作成する
         
         Args:
-            db_type: データベースの種類 ("inmemory" or "mongodb")
+            db_type: データベースの種類 ("inmemory", "mongodb", "mongodb_async", "sqlite" or "cosmos")
             **kwargs: データベース固有のパラメータ
                 - mongodbの場合: db_name, collection_name
-                - inmemoryの場合: なし
+                - mongodb_asyncの場合: db_name, collection_name, max_pool_size, min_pool_size,
+                  server_selection_timeout_ms, connect_timeout_ms, socket_timeout_ms
+                - sqliteの場合: path（データベースファイルのパス）
+                - cosmosの場合: endpoint, key, database_name, container_name, connection_verify
+                - inmemoryの場合: max_messages, max_bytes（上限を超えた場合は使われていないセッションから破棄する）
+                - 共通: write_behind（Trueの場合はメッセージの保存をバックグラウンドでまとめて行う）,
+                  write_behind_queue_size, write_behind_batch_size,
+                  cache（Trueの場合は直近のセッションのメッセージをキャッシュする）, cache_max_bytes, cache_ttl
                 
         Returns:
             DatabaseInterface: データベースインスタンス
         """
         if cls._instance is None:
             if db_type == "inmemory":
-                cls._instance = InMemoryChatRepo()
+                max_messages = kwargs.get("max_messages", os.getenv("INMEMORY_MAX_MESSAGES"))
+                max_bytes = kwargs.get("max_bytes", os.getenv("INMEMORY_MAX_BYTES"))
+                cls._instance = InMemoryChatRepo(
+                    max_messages=int(max_messages) if max_messages else None,
+                    max_bytes=int(max_bytes) if max_bytes else None
+                )
             elif db_type == "mongodb":
                 host = kwargs.get("host", os.getenv("MONGODB_HOST", "localhost"))
                 port = int(kwargs.get("port", os.getenv("MONGODB_PORT", "27017")))
                 db_name = kwargs.get("db_name", "chatdb")
                 collection_name = kwargs.get("collection_name", "messages")
                 cls._instance = MongoChatRepo(host, port, db_name=db_name, collection_name=collection_name)
+            elif db_type == "mongodb_async":
+                host = kwargs.get("host", os.getenv("MONGODB_HOST", "localhost"))
+                port = int(kwargs.get("port", os.getenv("MONGODB_PORT", "27017")))
+                cls._instance = AsyncMongoChatRepo(
+                    host,
+                    port,
+                    db_name=kwargs.get("db_name", "chatdb"),
+                    collection_name=kwargs.get("collection_name", "messages"),
+                    max_pool_size=int(kwargs.get("max_pool_size", os.getenv("MONGODB_MAX_POOL_SIZE", "100"))),
+                    min_pool_size=int(kwargs.get("min_pool_size", os.getenv("MONGODB_MIN_POOL_SIZE", "0"))),
+                    server_selection_timeout_ms=int(kwargs.get("server_selection_timeout_ms", os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))),
+                    connect_timeout_ms=int(kwargs.get("connect_timeout_ms", os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000"))),
+                    socket_timeout_ms=int(kwargs.get("socket_timeout_ms", os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "10000")))
+                )
+            elif db_type == "sqlite":
+                cls._instance = SQLiteChatRepo(path=kwargs.get("path", os.getenv("SQLITE_PATH", "data/chat.sqlite3")))
+            elif db_type == "cosmos":
+                cls._instance = CosmosDBClient(
+                    endpoint=kwargs.get("endpoint", os.getenv("COSMOS_ENDPOINT")),
+                    key=kwargs.get("key", os.getenv("COSMOS_KEY")),
+                    database_name=kwargs.get("database_name", os.getenv("COSMOS_DATABASE_NAME", "chatdb")),
+                    container_name=kwargs.get("container_name", os.getenv("COSMOS_CONTAINER_NAME", "chats")),
+                    # エミュレーターは自己署名証明書のため検証を無効にできるようにする
+                    connection_verify=str(kwargs.get("connection_verify", os.getenv("COSMOS_VERIFY_SSL", "true"))).lower() == "true"
+                )
             else:
                 raise ValueError(f"Unknown database type: {db_type}")
+
+            write_behind = str(kwargs.get("write_behind", os.getenv("CHAT_WRITE_BEHIND", "false"))).lower() == "true"
+            if write_behind:
+                cls._instance = WriteBehindChatRepo(
+                    cls._instance,
+                    max_queue_size=int(kwargs.get("write_behind_queue_size", os.getenv("CHAT_WRITE_BEHIND_QUEUE_SIZE", "1000"))),
+                    batch_size=int(kwargs.get("write_behind_batch_size", os.getenv("CHAT_WRITE_BEHIND_BATCH_SIZE", "100")))
+                )
+
+            cache = str(kwargs.get("cache", os.getenv("CHAT_CACHE_ENABLED", "false"))).lower() == "true"
+            if cache:
+                cls._instance = CachedChatRepo(
+                    cls._instance,
+                    max_bytes=int(kwargs.get("cache_max_bytes", os.getenv("CHAT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))),
+                    ttl=float(kwargs.get("cache_ttl", os.getenv("CHAT_CACHE_TTL", "300")))
+                )
         return cls._instance
\ No newline at end of file
@@ -1,45 +1,188 @@
-from typing import List, Dict
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import List, Dict, Optional, Set, Tuple
 from logging import getLogger
 from .interface import IChatRepo
-from .models import ChatMessage, SessionTitle
+from .models import ChatMessage, SessionTitle, SessionSummary, HistorySummary, SESSION_PREVIEW_LENGTH, is_before_cursor
 from datetime import datetime
 
-class InMemoryChatRepo(IChatRepo):
+class _SessionMessages:
+    """
+    1セッション分のメッセージを列ごとに保持する追記型の領域
+
+    ChatMessage（pydanticモデル）をメッセージごとに保持する代わりに、noはint64の配列、
+    roleはインターンした文字列のリストで持つ。noは昇順のため、noによる検索・削除はbisectで行う。
+    """
+    __slots__ = ("nos", "roles", "contents", "content_bytes", "last_no", "created_at", "updated_at")
+
     def __init__(self):
+        self.nos = array("q")
+        self.roles: List[str] = []
+        self.contents: List[str] = []
+        # 保持しているcontentの合計サイズ（UTF-8のバイト数）
+        self.content_bytes = 0
+        # 最後に採番したno（削除されたnoを再利用しないため件数とは別に保持する）
+        self.last_no = 0
+        # セッション一覧に表示する作成日時・最後にメッセージを追加した日時
+        self.created_at = datetime.utcnow()
+        self.updated_at = self.created_at
+
+    def __len__(self) -> int:
+        return len(self.nos)
+
+    def add(self, no: int, role: str, content: str) -> int:
+        """メッセージをnoの順に追加し、増えたバイト数を返す"""
+        if self.nos and no <= self.nos[-1]:
+            # 通常は末尾への追記。既存のnoより小さいnoは挿入位置を二分探索する
+            index = bisect_left(self.nos, no)
+            self.nos.insert(index, no)
+            self.roles.insert(index, sys.intern(role))
+            self.contents.insert(index, content)
+        else:
+            self.nos.append(no)
+            self.roles.append(sys.intern(role))
+            self.contents.append(content)
+        self.last_no = max(self.last_no, no)
+        self.updated_at = datetime.utcnow()
+        size = len(content.encode("utf-8"))
+        self.content_bytes += size
+        return size
+
+    def truncate(self, start: int, stop: Optional[int] = None) -> Tuple[int, int]:
+        """start〜stopの位置のメッセージを削除し、削除した件数とバイト数を返す"""
+        stop = len(self.nos) if stop is None else stop
+        size = sum(len(content.encode("utf-8")) for content in self.contents[start:stop])
+        count = stop - start
+        del self.nos[start:stop]
+        del self.roles[start:stop]
+        del self.contents[start:stop]
+        self.content_bytes -= size
+        return count, size
+
+    def to_messages(self, start: int = 0, stop: Optional[int] = None) -> List[ChatMessage]:
+        """start〜stopの位置のメッセージをChatMessageに変換して返す"""
+        return [
+            ChatMessage(no=no, role=role, content=content)
+            for no, role, content in zip(self.nos[start:stop], self.roles[start:stop], self.contents[start:stop])
+        ]
+
+class InMemoryChatRepo(IChatRepo):
+    def __init__(self, max_messages: Optional[int] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            max_messages: 保持するメッセージ数の上限（超えた場合は最も長く使われていないセッションから破棄する）
+            max_bytes: 保持するメッセージ内容の合計サイズの上限（バイト、超えた場合は同様に破棄する）
+        """
         self.logger = getLogger("uvicorn.app")
-        # user_id -> session_id -> messages の構造に変更
-        self._chat_messages: Dict[str, Dict[str, List[ChatMessage]]] = {}
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        # (user_id, session_id) -> メッセージ の構造（最近使われた順に並べ、上限を超えた場合は先頭から破棄する）
+        self._sessions: "OrderedDict[Tuple[str, str], _SessionMessages]" = OrderedDict()
+        # user_id -> session_id の集合
+        self._user_sessions: Dict[str, Set[str]] = {}
         # user_id -> session_id -> SessionTitle の構造
         self._session_titles: Dict[str, Dict[str, SessionTitle]] = {}
+        # user_id -> session_id -> HistorySummary の構造
+        self._history_summaries: Dict[str, Dict[str, HistorySummary]] = {}
+        # 全セッションのメッセージ数と内容の合計サイズ（統計用、O(1)で参照する）
+        self._message_count = 0
+        self._content_bytes = 0
+        self._evicted_sessions = 0
+
+    def _get_session(self, user_id: str, session_id: str, create: bool = False) -> Optional[_SessionMessages]:
+        """セッションのメッセージ領域を返し、最近使われたセッションとして記録する"""
+        key = (user_id, session_id)
+        session = self._sessions.get(key)
+        if session is None:
+            if not create:
+                return None
+            session = _SessionMessages()
+            self._sessions[key] = session
+            self._user_sessions.setdefault(user_id, set()).add(session_id)
+        else:
+            self._sessions.move_to_end(key)
+        return session
+
+    def _evict_idle_sessions(self) -> None:
+        """上限を超えている間、最も長く使われていないセッションを破棄する（直近に使ったセッションは残す）"""
+        while len(self._sessions) > 1 and (
+            (self.max_messages is not None and self._message_count > self.max_messages)
+            or (self.max_bytes is not None and self._content_bytes > self.max_bytes)
+        ):
+            (user_id, session_id), session = self._sessions.popitem(last=False)
+            self._message_count -= len(session)
+            self._content_bytes -= session.content_bytes
+            self._user_sessions[user_id].discard(session_id)
+            if not self._user_sessions[user_id]:
+                del self._user_sessions[user_id]
+            self._session_titles.get(user_id, {}).pop(session_id, None)
+            self._history_summaries.get(user_id, {}).pop(session_id, None)
+            self._evicted_sessions += 1
+            self.logger.info(f"Evicted idle session user_id={user_id}, session_id={session_id} ({len(session)} messages)")
+
+    def stats(self) -> Dict[str, int]:
+        """保持しているセッション数・メッセージ数・サイズを返す"""
+        return {
+            "sessions": len(self._sessions),
+            "messages": self._message_count,
+            "content_bytes": self._content_bytes,
+            "evicted_sessions": self._evicted_sessions
+        }
 
     async def save_chat_message(self, user_id: str, session_id: str, message: ChatMessage) -> ChatMessage:
         """チャットメッセージを保存し、no割り当て済みのChatMessageを返す"""
         self.logger.info(f"Saving chat message for user {user_id}, session {session_id}")
         try:
-            if user_id not in self._chat_messages:
-                self._chat_messages[user_id] = {}
-            if session_id not in self._chat_messages[user_id]:
-                self._chat_messages[user_id][session_id] = []
-            # noを自動付与
-            next_no = len(self._chat_messages[user_id][session_id]) + 1
-            message_with_no = ChatMessage(no=next_no, role=message.role, content=message.content)
-            self._chat_messages[user_id][session_id].append(message_with_no)
-            self.logger.info(f"Saved chat message for user {user_id}, session {session_id}")
-            self.logger.info(f"Chat messages count: {len(self._chat_messages[user_id][session_id])}")
-            return message_with_no
+            saved_messages = await self.save_chat_messages(user_id, session_id, [message])
+            return saved_messages[0]
         except Exception as e:
             self.logger.error(f"Error saving chat message for user_id={user_id}, session_id={session_id}, role={message.role}: {str(e)}", exc_info=True)
             raise
 
-    async def get_chat_messages(self, user_id: str, session_id: str) -> List[ChatMessage]:
+    async def save_chat_messages(self, user_id: str, session_id: str, messages: List[ChatMessage]) -> List[ChatMessage]:
+        """複数のチャットメッセージを連続したnoでまとめて保存し、no割り当て済みのChatMessageを順に返す"""
+        self.logger.info(f"Saving {len(messages)} chat messages for user {user_id}, session {session_id}")
+        try:
+            session = self._get_session(user_id, session_id, create=True)
+            if messages and all(message.no > 0 for message in messages):
+                # 採番済みのメッセージ（write-behind）はそのnoで保存する
+                messages_with_no = sorted(messages, key=lambda message: message.no)
+            else:
+                # noを連続して自動付与
+                messages_with_no = [
+                    ChatMessage(no=session.last_no + i, role=message.role, content=message.content)
+                    for i, message in enumerate(messages, start=1)
+                ]
+            for message in messages_with_no:
+                self._content_bytes += session.add(message.no, message.role, message.content)
+                self._message_count += 1
+            self._evict_idle_sessions()
+            self.logger.info(f"Saved chat messages for user {user_id}, session {session_id}")
+            self.logger.info(f"Chat messages count: {len(session)}")
+            return messages_with_no
+        except Exception as e:
+            self.logger.error(f"Error saving chat messages for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def reserve_nos(self, user_id: str, session_id: str, count: int) -> int:
+        """メッセージを保存せずにセッションのnoをcount個連続で確保し、最後のnoを返す"""
+        session = self._get_session(user_id, session_id, create=True)
+        session.last_no += count
+        return session.last_no
+
+    async def get_chat_messages(self, user_id: str, session_id: str, limit: Optional[int] = None, after_no: Optional[int] = None) -> List[ChatMessage]:
         """セッションIDに紐づくチャットメッセージを取得する"""
         self.logger.info(f"Getting chat messages for user {user_id}, session {session_id}")
         try:
-            total_sessions = sum(len(sessions) for sessions in self._chat_messages.values())
-            self.logger.info(f"Chat messages all count: {total_sessions}")
-            if user_id in self._chat_messages and session_id in self._chat_messages[user_id]:
-                return self._chat_messages[user_id][session_id]
-            return []
+            self.logger.info(f"Chat messages all count: {self._message_count}")
+            session = self._get_session(user_id, session_id)
+            if session is None:
+                return []
+            start = bisect_left(session.nos, after_no + 1) if after_no is not None else 0
+            stop = start + limit if limit is not None else None
+            return session.to_messages(start, stop)
         except Exception as e:
             self.logger.error(f"Error getting chat messages for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
             raise
@@ -47,9 +190,14 @@ class InMemoryChatRepo(IChatRepo):
     async def clear_chat_messages(self, user_id: str, session_id: str) -> None:
         """指定したsession_idの全メッセージを削除する"""
         try:
-            if user_id in self._chat_messages and session_id in self._chat_messages[user_id]:
-                message_count = len(self._chat_messages[user_id][session_id])
-                self._chat_messages[user_id][session_id] = []
+            session = self._get_session(user_id, session_id)
+            if session is not None:
+                message_count, size = session.truncate(0)
+                self._message_count -= message_count
+                self._content_bytes -= size
+                # 全削除した場合はnoを1から振り直す
+                session.last_no = 0
+                self._invalidate_history_summary(user_id, session_id, 1)
                 self.logger.info(f"Cleared {message_count} messages for user_id={user_id}, session_id={session_id}")
             else:
                 self.logger.info(f"No messages to clear for user_id={user_id}, session_id={session_id}")
@@ -60,13 +208,16 @@ class InMemoryChatRepo(IChatRepo):
     async def delete_chat_message_by_no(self, user_id: str, session_id: str, no: int) -> None:
         """指定されたnoのメッセージを削除する"""
         try:
-            if user_id in self._chat_messages and session_id in self._chat_messages[user_id]:
-                original_count = len(self._chat_messages[user_id][session_id])
-                self._chat_messages[user_id][session_id] = [msg for msg in self._chat_messages[user_id][session_id] if msg.no != no]
-                new_count = len(self._chat_messages[user_id][session_id])
-                if original_count == new_count:
+            session = self._get_session(user_id, session_id)
+            if session is not None:
+                index = bisect_left(session.nos, no)
+                if index == len(session) or session.nos[index] != no:
                     self.logger.warning(f"No message found to delete for user_id={user_id}, session_id={session_id}, no={no}")
                 else:
+                    _, size = session.truncate(index, index + 1)
+                    self._message_count -= 1
+                    self._content_bytes -= size
+                    self._invalidate_history_summary(user_id, session_id, no)
                     self.logger.info(f"Deleted message no={no} for user_id={user_id}, session_id={session_id}")
             else:
                 self.logger.warning(f"No messages found for user_id={user_id}, session_id={session_id}")
@@ -74,12 +225,38 @@ class InMemoryChatRepo(IChatRepo):
             self.logger.error(f"Error deleting chat message for user_id={user_id}, session_id={session_id}, no={no}: {str(e)}", exc_info=True)
             raise
 
-    async def get_session_ids(self, user_id: str) -> List[str]:
+    async def delete_sessions(self, user_id: str, session_ids: List[str]) -> int:
+        """複数のセッションのメッセージ・タイトル・会話の要約を削除する"""
+        self.logger.info(f"Deleting {len(session_ids)} sessions for user {user_id}")
+        try:
+            deleted_count = 0
+            for session_id in session_ids:
+                session = self._sessions.pop((user_id, session_id), None)
+                if session is not None:
+                    deleted_count += len(session)
+                    self._message_count -= len(session)
+                    self._content_bytes -= session.content_bytes
+                    self._user_sessions[user_id].discard(session_id)
+                    if not self._user_sessions[user_id]:
+                        del self._user_sessions[user_id]
+                self._session_titles.get(user_id, {}).pop(session_id, None)
+                self._history_summaries.get(user_id, {}).pop(session_id, None)
+            self.logger.info(f"Deleted {deleted_count} messages in {len(session_ids)} sessions for user_id={user_id}")
+            return deleted_count
+        except Exception as e:
+            self.logger.error(f"Error deleting sessions for user_id={user_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def get_session_ids(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None) -> List[str]:
         """user_idに紐づくすべてのsession_idを取得する"""
         self.logger.info(f"Getting session IDs for user {user_id}")
         try:
-            if user_id in self._chat_messages:
-                session_ids = list(self._chat_messages[user_id].keys())
+            if user_id in self._user_sessions:
+                session_ids = sorted(self._user_sessions[user_id])
+                if after is not None:
+                    session_ids = session_ids[bisect_right(session_ids, after):]
+                if limit is not None:
+                    session_ids = session_ids[:limit]
                 self.logger.info(f"Found {len(session_ids)} sessions for user {user_id}")
                 return session_ids
             return []
@@ -90,11 +267,15 @@ class InMemoryChatRepo(IChatRepo):
     async def delete_messages_from_no(self, user_id: str, session_id: str, no: int) -> None:
         """指定されたno以降のメッセージを削除する"""
         try:
-            if user_id in self._chat_messages and session_id in self._chat_messages[user_id]:
-                original_count = len(self._chat_messages[user_id][session_id])
-                self._chat_messages[user_id][session_id] = [msg for msg in self._chat_messages[user_id][session_id] if msg.no < no]
-                new_count = len(self._chat_messages[user_id][session_id])
-                deleted_count = original_count - new_count
+            session = self._get_session(user_id, session_id)
+            if session is not None:
+                # noは昇順のため、削除開始位置を二分探索して末尾をまとめて削除する
+                deleted_count, size = session.truncate(bisect_left(session.nos, no))
+                self._message_count -= deleted_count
+                self._content_bytes -= size
+                # 末尾を削除した場合（編集）は削除したnoから振り直す。途中のnoは再利用しない
+                session.last_no = min(session.last_no, no - 1)
+                self._invalidate_history_summary(user_id, session_id, no)
                 self.logger.info(f"Deleted {deleted_count} messages from no={no} for user_id={user_id}, session_id={session_id}")
             else:
                 self.logger.warning(f"No messages found for user_id={user_id}, session_id={session_id}")
@@ -135,14 +316,18 @@ class InMemoryChatRepo(IChatRepo):
             self.logger.error(f"Error saving session title for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
             raise
 
-    async def get_session_titles(self, user_id: str) -> List[SessionTitle]:
+    async def get_session_titles(self, user_id: str, limit: Optional[int] = None, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> List[SessionTitle]:
         """ユーザーのセッションタイトル一覧を取得する"""
         self.logger.info(f"Getting session titles for user {user_id}")
         try:
             if user_id in self._session_titles:
                 session_titles = list(self._session_titles[user_id].values())
-                # 更新日時の降順でソート
-                session_titles.sort(key=lambda x: x.updated_at, reverse=True)
+                # 更新日時の降順（同じ更新日時はsession_idの降順）でソート
+                session_titles.sort(key=lambda x: (x.updated_at, x.session_id), reverse=True)
+                if before is not None:
+                    session_titles = [x for x in session_titles if is_before_cursor(x.updated_at, x.session_id, before, before_session_id)]
+                if limit is not None:
+                    session_titles = session_titles[:limit]
                 self.logger.info(f"Found {len(session_titles)} session titles for user {user_id}")
                 return session_titles
             return []
@@ -179,4 +364,62 @@ class InMemoryChatRepo(IChatRepo):
                 self.logger.warning(f"No session title found to delete for user_id={user_id}, session_id={session_id}")
         except Exception as e:
             self.logger.error(f"Error deleting session title for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
-            raise 
\ No newline at end of file
+            raise
+
+    async def get_session_summaries(self, user_id: str, limit: Optional[int] = None, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> List[SessionSummary]:
+        """ユーザーのセッション一覧（メッセージのあるセッションとタイトルのあるセッション）を更新日時の降順で取得する"""
+        self.logger.info(f"Getting session summaries for user {user_id}")
+        try:
+            titles = self._session_titles.get(user_id, {})
+            summaries = []
+            for session_id in self._user_sessions.get(user_id, set()) | titles.keys():
+                # 一覧の取得は最近使われたセッションとして扱わない
+                session = self._sessions.get((user_id, session_id))
+                title = titles.get(session_id)
+                if title is None and (session is None or len(session) == 0):
+                    continue
+                times = [t for t in (session, title) if t is not None]
+                summaries.append(SessionSummary(
+                    user_id=user_id,
+                    session_id=session_id,
+                    title=title.title if title is not None else None,
+                    created_at=min(t.created_at for t in times),
+                    updated_at=max(t.updated_at for t in times),
+                    message_count=len(session) if session is not None else 0,
+                    last_no=session.nos[-1] if session else 0,
+                    preview=session.contents[-1][:SESSION_PREVIEW_LENGTH] if session else ""
+                ))
+            summaries.sort(key=lambda x: (x.updated_at, x.session_id), reverse=True)
+            if before is not None:
+                summaries = [x for x in summaries if is_before_cursor(x.updated_at, x.session_id, before, before_session_id)]
+            if limit is not None:
+                summaries = summaries[:limit]
+            self.logger.info(f"Found {len(summaries)} session summaries for user {user_id}")
+            return summaries
+        except Exception as e:
+            self.logger.error(f"Error getting session summaries for user_id={user_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def get_history_summary(self, user_id: str, session_id: str) -> Optional[HistorySummary]:
+        """セッションの古い会話の要約を取得する"""
+        try:
+            return self._history_summaries.get(user_id, {}).get(session_id)
+        except Exception as e:
+            self.logger.error(f"Error getting history summary for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def save_history_summary(self, user_id: str, session_id: str, summary: HistorySummary) -> None:
+        """セッションの古い会話の要約を保存する"""
+        self.logger.info(f"Saving history summary for user {user_id}, session {session_id}")
+        try:
+            self._history_summaries.setdefault(user_id, {})[session_id] = summary
+        except Exception as e:
+            self.logger.error(f"Error saving history summary for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    def _invalidate_history_summary(self, user_id: str, session_id: str, no: int) -> None:
+        """削除されたメッセージ（no以降）を含む要約を破棄する"""
+        summary = self._history_summaries.get(user_id, {}).get(session_id)
+        if summary is not None and summary.up_to_no >= no:
+            del self._history_summaries[user_id][session_id]
+            self.logger.info(f"Invalidated history summary for user_id={user_id}, session_id={session_id}")
@@ -1,6 +1,7 @@
-from typing import List
+from typing import List, Optional
+from datetime import datetime
 from abc import ABC, abstractmethod
-from .models import ChatMessage, SessionTitle
+from .models import ChatMessage, SessionTitle, SessionSummary, HistorySummary
 
 class IChatRepo(ABC):
     @abstractmethod
@@ -9,8 +10,33 @@ class IChatRepo(ABC):
         pass
 
     @abstractmethod
-    async def get_chat_messages(self, user_id: str, session_id: str) -> List[ChatMessage]:
-        """Get all chat messages for a given session"""
+    async def save_chat_messages(self, user_id: str, session_id: str, messages: List[ChatMessage]) -> List[ChatMessage]:
+        """
+        複数のチャットメッセージを連続したnoでまとめて保存し、no割り当て済みのChatMessageを順に返す
+
+        すべてのメッセージのnoが1以上の場合は採番済みとみなし、そのnoのまま保存する（以降の採番はその続きから行う）。
+        """
+        pass
+
+    @abstractmethod
+    async def reserve_nos(self, user_id: str, session_id: str, count: int) -> int:
+        """
+        メッセージを保存せずにセッションのnoをcount個連続で確保し、最後のnoを返す
+
+        保存と同じ採番（seq）から確保するため、確保したnoは以降の保存・確保と重複しない。
+        delete_chat_message_by_noで削除したメッセージのnoも再利用されない。
+        ただしdelete_messages_from_noは削除したno以降から（確保済みのnoを含めて）、clear_chat_messagesは1から採番し直す。
+        確保したnoのメッセージは採番済みのメッセージとしてsave_chat_messagesで保存する。
+        """
+        pass
+
+    @abstractmethod
+    async def get_chat_messages(self, user_id: str, session_id: str, limit: Optional[int] = None, after_no: Optional[int] = None) -> List[ChatMessage]:
+        """
+        Get chat messages for a given session in ascending order of no
+
+        after_noを指定した場合はそれより大きいnoのメッセージのみ、limitを指定した場合は先頭からlimit件を返す。
+        """
         pass
 
     @abstractmethod
@@ -24,8 +50,21 @@ class IChatRepo(ABC):
         pass
 
     @abstractmethod
-    async def get_session_ids(self, user_id: str) -> List[str]:
-        """Get all session IDs for a given user"""
+    async def delete_sessions(self, user_id: str, session_ids: List[str]) -> int:
+        """
+        複数のセッションのメッセージ・サマリー（タイトル）・会話の要約をまとめて削除し、削除したメッセージ数を返す
+
+        存在しないsession_idは無視する。件数の多い削除は呼び出し側でsession_idsを分割して呼ぶ。
+        """
+        pass
+
+    @abstractmethod
+    async def get_session_ids(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None) -> List[str]:
+        """
+        Get session IDs for a given user in ascending order
+
+        afterを指定した場合はそれより後ろのsession_idのみ、limitを指定した場合は先頭からlimit件を返す。
+        """
         pass
 
     @abstractmethod
@@ -39,8 +78,14 @@ class IChatRepo(ABC):
         pass
 
     @abstractmethod
-    async def get_session_titles(self, user_id: str) -> List[SessionTitle]:
-        """ユーザーのセッションタイトル一覧を取得する"""
+    async def get_session_titles(self, user_id: str, limit: Optional[int] = None, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> List[SessionTitle]:
+        """
+        ユーザーのセッションタイトル一覧を更新日時の降順（同じ更新日時はsession_idの降順）で取得する
+
+        beforeを指定した場合はそれより前に更新されたセッションのみ、limitを指定した場合は先頭からlimit件を返す。
+        before_session_idも指定した場合は(updated_at, session_id)のカーソルとして扱い、更新日時がbeforeと同じで
+        session_idがbefore_session_idより小さいセッションも返す（同じ更新日時のセッションをページの境界で読み飛ばさない）。
+        """
         pass
 
     @abstractmethod
@@ -51,4 +96,38 @@ class IChatRepo(ABC):
     @abstractmethod
     async def delete_session_title(self, user_id: str, session_id: str) -> None:
         """セッションタイトルを削除する"""
-        pass 
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    async def get_session_summaries(self, user_id: str, limit: Optional[int] = None, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> List[SessionSummary]:
+        """
+        ユーザーのセッション一覧（タイトル・メッセージ数・最後のno・最後のメッセージのプレビュー）を
+        更新日時の降順（同じ更新日時はsession_idの降順）で取得する
+
+        セッションを操作するたびに更新されるセッションごとのサマリーから返すため、メッセージを走査しない。
+        beforeを指定した場合はそれより前に更新されたセッションのみ、limitを指定した場合は先頭からlimit件を返す。
+        before_session_idはget_session_titlesと同じく(updated_at, session_id)のカーソルとして扱う。
+        """
+        pass
+
+    @abstractmethod
+    async def get_history_summary(self, user_id: str, session_id: str) -> Optional[HistorySummary]:
+        """セッションの古い会話の要約を取得する"""
+        pass
+
+    @abstractmethod
+    async def save_history_summary(self, user_id: str, session_id: str, summary: HistorySummary) -> None:
+        """セッションの古い会話の要約を保存する"""
+        pass
+
+    async def initialize(self) -> None:
+        """起動時の初期化（インデックス作成など）を行う"""
+        pass
+
+    async def health_check(self) -> bool:
+        """バックエンドに接続できるかを返す"""
+        return True
+
+    async def close(self) -> None:
+        """保持している接続などのリソースを解放する"""
+        pass
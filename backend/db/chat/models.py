@@ -12,4 +12,34 @@ class SessionTitle(BaseModel):
     session_id: str
     title: str
     created_at: datetime
-    updated_at: datetime 
\ No newline at end of file
+    updated_at: datetime
+
+# セッション一覧に表示する最後のメッセージのプレビューの文字数
+SESSION_PREVIEW_LENGTH = 100
+
+class SessionSummary(BaseModel):
+    user_id: str
+    session_id: str
+    title: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    message_count: int = 0
+    last_no: int = 0
+    preview: str = ""
+
+class HistorySummary(BaseModel):
+    content: str
+    up_to_no: int
+    updated_at: datetime
+
+def is_before_cursor(updated_at: datetime, session_id: str, before: Optional[datetime], before_session_id: Optional[str] = None) -> bool:
+    """
+    セッションが一覧のカーソルより後ろ（(updated_at, session_id)の降順で後ろ）にあるかを返す
+
+    before_session_idを省略した場合はupdated_atだけで比較する。
+    """
+    if before is None:
+        return True
+    if updated_at != before:
+        return updated_at < before
+    return before_session_id is not None and session_id < before_session_id
@@ -0,0 +1,150 @@
+"""
+MongoDBのチャット関連コレクションのインデックス定義
+
+起動時に ensure_indexes / aensure_indexes でインデックスを作成する。
+モジュールとして実行すると、リポジトリが発行する各クエリの実行計画（explain）を表示する。
+
+使い方（backendディレクトリで実行）:
+    python -m db.chat.mongo_indexes --host localhost --port 27017 --user-id <user_id> --session-id <session_id>
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+from logging import getLogger
+from typing import Any, Dict, List
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient
+
+logger = getLogger("uvicorn.app")
+
+# セッションごとのサマリー（タイトル・no採番用のseq・メッセージ数など。mongo_sessions を参照）
+SESSION_TITLES_COLLECTION = "session_titles"
+HISTORY_SUMMARIES_COLLECTION = "history_summaries"
+# 起動時のデータ移行の完了マーカー（_idが移行名）
+MIGRATIONS_COLLECTION = "migrations"
+
+def index_models(collection_name: str = "messages") -> Dict[str, List[IndexModel]]:
+    """
+    コレクション名ごとのインデックス定義を返す
+
+    Args:
+        collection_name: メッセージを保存するコレクション名
+    """
+    user_session = [("user_id", ASCENDING), ("session_id", ASCENDING)]
+    return {
+        # 履歴の取得（sort no）、最新のnoの取得、no指定の削除
+        collection_name: [
+            IndexModel(user_session + [("no", ASCENDING)], unique=True)
+        ],
+        # セッション・タイトル一覧（(updated_at, session_id)の降順）と、session_id順の一覧・セッション単位の更新
+        SESSION_TITLES_COLLECTION: [
+            IndexModel([("user_id", ASCENDING), ("updated_at", DESCENDING), ("session_id", DESCENDING)]),
+            IndexModel(user_session, unique=True)
+        ],
+        HISTORY_SUMMARIES_COLLECTION: [
+            IndexModel(user_session, unique=True)
+        ]
+    }
+
+def ensure_indexes(db, collection_name: str = "messages") -> Dict[str, List[str]]:
+    """
+    インデックスを作成し、コレクションごとのインデックス名を返す（作成済みの場合は何もしない）
+
+    既存データの重複などで作成できないコレクションはログに出力し、他のコレクションの作成は継続する。
+    """
+    created = {}
+    for name, models in index_models(collection_name).items():
+        try:
+            created[name] = db[name].create_indexes(models)
+        except Exception as e:
+            logger.error(f"Error creating indexes for collection {name}: {str(e)}", exc_info=True)
+    return created
+
+async def aensure_indexes(db, collection_name: str = "messages") -> Dict[str, List[str]]:
+    """インデックスを作成し、コレクションごとのインデックス名を返す（非同期クライアント用）"""
+    created = {}
+    for name, models in index_models(collection_name).items():
+        try:
+            created[name] = await db[name].create_indexes(models)
+        except Exception as e:
+            logger.error(f"Error creating indexes for collection {name}: {str(e)}", exc_info=True)
+    return created
+
+def _summarize_plan(plan: Dict[str, Any]) -> str:
+    """実行計画のステージを「FETCH <- IXSCAN(index)」の形式にまとめる"""
+    stages = []
+    while plan:
+        stage = plan.get("stage", "?")
+        if "indexName" in plan:
+            stage += f"({plan['indexName']})"
+        stages.append(stage)
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return " <- ".join(stages)
+
+def _winning_plan(explain: Dict[str, Any]) -> Dict[str, Any]:
+    planner = explain.get("queryPlanner", {})
+    plan = planner.get("winningPlan", {})
+    # SBEエンジンの場合はqueryPlanの下に計画がある
+    return plan.get("queryPlan", plan)
+
+def explain_queries(db, collection_name: str, user_id: str, session_id: str) -> Dict[str, str]:
+    """
+    リポジトリが発行するクエリの実行計画をまとめて返す
+
+    フィルター・射影・並び順はリポジトリと同じmongo_queriesの定義から組み立てる（クエリを変えても実行計画の確認がずれない）。
+    一覧の2ページ目以降（(updated_at, session_id)のカーソル指定）の実行計画も確認する。
+
+    Returns:
+        Dict[str, str]: クエリ名 -> 実行計画のステージ
+    """
+    # mongo_queriesはmongo_sessions経由でこのモジュールを読み込むため、ここで読み込む
+    from . import mongo_queries as queries
+    session_filter = queries.session_filter(user_id, session_id)
+    messages = db[collection_name]
+    titles = db[SESSION_TITLES_COLLECTION]
+    cursor = (datetime.utcnow(), session_id)
+    explains = {
+        "get_chat_messages": messages.find(queries.messages_query(user_id, session_id), queries.MESSAGE_PROJECTION).sort(queries.MESSAGE_SORT).explain(),
+        "get_chat_messages_after_no": messages.find(queries.messages_query(user_id, session_id, after_no=1), queries.MESSAGE_PROJECTION).sort(queries.MESSAGE_SORT).explain(),
+        "latest_message_no": messages.find(session_filter, queries.LATEST_MESSAGE_PROJECTION).sort(queries.LATEST_MESSAGE_SORT).limit(1).explain(),
+        "get_session_ids": titles.find(queries.session_ids_query(user_id), queries.SESSION_ID_PROJECTION).sort(queries.SESSION_ID_SORT).explain(),
+        "delete_chat_message_by_no": db.command("explain", {"delete": collection_name, "deletes": [{"q": queries.message_by_no_filter(user_id, session_id, 1), "limit": 1}]}, verbosity="queryPlanner"),
+        "delete_messages_from_no": db.command("explain", {"delete": collection_name, "deletes": [{"q": queries.messages_from_no_filter(user_id, session_id, 1), "limit": 0}]}, verbosity="queryPlanner"),
+        "get_session_titles": titles.find(queries.session_titles_query(user_id), queries.SESSION_TITLE_PROJECTION).sort(queries.SESSION_ORDER_SORT).explain(),
+        "get_session_titles_page": titles.find(queries.session_titles_query(user_id, *cursor), queries.SESSION_TITLE_PROJECTION).sort(queries.SESSION_ORDER_SORT).explain(),
+        "get_session_summaries": titles.find(queries.session_summaries_query(user_id), queries.SESSION_SUMMARY_PROJECTION).sort(queries.SESSION_ORDER_SORT).explain(),
+        "get_session_summaries_page": titles.find(queries.session_summaries_query(user_id, *cursor), queries.SESSION_SUMMARY_PROJECTION).sort(queries.SESSION_ORDER_SORT).explain(),
+        "allocate_nos": titles.find(session_filter).limit(1).explain(),
+        "get_history_summary": db[HISTORY_SUMMARIES_COLLECTION].find(session_filter, queries.HISTORY_SUMMARY_PROJECTION).limit(1).explain()
+    }
+    return {name: _summarize_plan(_winning_plan(explain)) for name, explain in explains.items()}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ensure chat indexes and print explain() plans for repository queries")
+    parser.add_argument("--host", default=os.getenv("MONGODB_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MONGODB_PORT", "27017")))
+    parser.add_argument("--db-name", default="chatdb")
+    parser.add_argument("--collection-name", default="messages")
+    parser.add_argument("--user-id", default="explain-user")
+    parser.add_argument("--session-id", default="explain-session")
+    parser.add_argument("--no-create", action="store_true", help="Do not create missing indexes before explaining")
+    args = parser.parse_args()
+
+    username = os.getenv("MONGODB_USER")
+    password = os.getenv("MONGODB_PASSWORD")
+    if username and password:
+        client = MongoClient(f"mongodb://{username}:{password}@{args.host}:{args.port}/admin")
+    else:
+        client = MongoClient(host=args.host, port=args.port)
+    db = client[args.db_name]
+    if not args.no_create:
+        print(json.dumps({"ensured_indexes": ensure_indexes(db, args.collection_name)}, indent=2))
+    plans = explain_queries(db, args.collection_name, args.user_id, args.session_id)
+    print(json.dumps({"checked_at": datetime.utcnow().isoformat(), "plans": plans}, indent=2, ensure_ascii=False))
+    collscans = [name for name, plan in plans.items() if "COLLSCAN" in plan]
+    if collscans:
+        print(f"WARNING: collection scans in {', '.join(collscans)}")
+    client.close()
+
+if __name__ == "__main__":
+    main()
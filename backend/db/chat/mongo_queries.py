@@ -0,0 +1,180 @@
+"""
+MongoChatRepo（同期）とAsyncMongoChatRepo（非同期）で共通のクエリ定義
+
+フィルター・更新内容・射影・ドキュメントとモデルの変換をここにまとめ、
+2つのリポジトリはこれらを使ってクエリを発行し、結果を待つ部分だけを実装する。
+"""
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from .models import ChatMessage, SessionTitle, SessionSummary, HistorySummary, SESSION_PREVIEW_LENGTH
+from .mongo_sessions import SESSION_SUMMARY_PROJECTION
+
+# get_chat_messages で返すフィールドと並び順
+MESSAGE_PROJECTION = {"_id": 0, "no": 1, "role": 1, "content": 1}
+MESSAGE_SORT = [("no", 1)]
+# 最新のメッセージ（no・内容）の取得に使うフィールドと並び順
+LATEST_MESSAGE_PROJECTION = {"_id": 0, "no": 1, "content": 1}
+LATEST_MESSAGE_SORT = [("no", -1)]
+# get_session_ids で返すフィールドと並び順
+SESSION_ID_PROJECTION = {"_id": 0, "session_id": 1}
+SESSION_ID_SORT = [("session_id", 1)]
+# セッションのサマリーのうちタイトルとして返すフィールド
+SESSION_TITLE_PROJECTION = {"_id": 0, "user_id": 1, "session_id": 1, "title": 1, "created_at": 1, "updated_at": 1}
+HISTORY_SUMMARY_PROJECTION = {"_id": 0, "content": 1, "up_to_no": 1, "updated_at": 1}
+# 全メッセージを削除した場合のサマリー（noを1から振り直す。タイトルは残す）
+CLEARED_SESSION_UPDATE = {"$set": {"seq": 0, "message_count": 0, "last_no": 0, "preview": ""}}
+# タイトルの削除（メッセージ数やnoの採番はサマリーに残す）
+DELETE_TITLE_UPDATE = {"$unset": {"title": ""}}
+# セッション・タイトル一覧の並び順（更新日時の降順、同じ更新日時はsession_idの降順）
+SESSION_ORDER_SORT = [("updated_at", -1), ("session_id", -1)]
+
+def client_options(host_name: str, port_num: int) -> Tuple[Tuple[Any, ...], Dict[str, Any]]:
+    """
+    MongoClient / AsyncMongoClient に渡す引数を返す
+
+    環境変数（MONGODB_USER / MONGODB_PASSWORD）に認証情報がある場合はURIを使う。
+    """
+    username = os.getenv("MONGODB_USER")
+    password = os.getenv("MONGODB_PASSWORD")
+    if username and password:
+        return (f"mongodb://{username}:{password}@{host_name}:{port_num}/admin",), {}
+    return (), {"host": host_name, "port": port_num}
+
+def session_filter(user_id: str, session_id: str) -> Dict[str, Any]:
+    return {"user_id": user_id, "session_id": session_id}
+
+def sessions_filter(user_id: str, session_ids: List[str]) -> Dict[str, Any]:
+    return {"user_id": user_id, "session_id": {"$in": list(session_ids)}}
+
+def message_document(user_id: str, session_id: str, message: ChatMessage) -> Dict[str, Any]:
+    return {
+        "user_id": user_id,
+        "session_id": session_id,
+        "no": message.no,
+        "role": message.role,
+        "content": message.content
+    }
+
+def number_messages(messages: List[ChatMessage], last_no: int) -> List[ChatMessage]:
+    """last_noで終わる連続したnoをメッセージに割り当てる"""
+    first_no = last_no - len(messages) + 1
+    return [ChatMessage(no=first_no + i, role=message.role, content=message.content) for i, message in enumerate(messages)]
+
+def is_prenumbered(messages: List[ChatMessage]) -> bool:
+    """採番済みのメッセージ（write-behind）かを返す"""
+    return all(message.no > 0 for message in messages)
+
+def needs_legacy_seq(seq: int, count: int) -> bool:
+    """採番を始めたばかりのセッションか（seq導入前のメッセージの続きから採番する必要があるか）を返す"""
+    return seq == count
+
+def legacy_seq_update(latest: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """seq導入前のメッセージがある場合に、seqをその続きまで進める更新を返す（ない場合はNone）"""
+    if latest is None or latest["no"] <= 0:
+        return None
+    return {"$inc": {"seq": latest["no"], "last_no": latest["no"]}}
+
+def reserve_update(count: int, now: datetime) -> Dict[str, Any]:
+    """メッセージを保存せずにseqをcount進める更新を返す（サマリーがない場合は空のサマリーを作成する）"""
+    return {
+        "$inc": {"seq": count},
+        "$setOnInsert": {"message_count": 0, "last_no": 0, "preview": "", "created_at": now, "updated_at": now}
+    }
+
+def inserted_count(error: Any) -> int:
+    """順序どおりのinsert_manyが失敗したときに、保存できた先頭からのメッセージ数を返す"""
+    return error.details.get("nInserted", 0)
+
+def messages_query(user_id: str, session_id: str, after_no: Optional[int] = None) -> Dict[str, Any]:
+    query = session_filter(user_id, session_id)
+    if after_no is not None:
+        query["no"] = {"$gt": after_no}
+    return query
+
+def message_by_no_filter(user_id: str, session_id: str, no: int) -> Dict[str, Any]:
+    return dict(session_filter(user_id, session_id), no=no)
+
+def messages_from_no_filter(user_id: str, session_id: str, no: int) -> Dict[str, Any]:
+    return dict(session_filter(user_id, session_id), no={"$gte": no})
+
+def refresh_last_message_update(latest: Optional[Dict[str, Any]], deleted_count: int, seq_max: Optional[int] = None) -> Dict[str, Any]:
+    """メッセージを削除した後のサマリーの更新（メッセージ数・最後のno・プレビュー）を返す"""
+    update: Dict[str, Any] = {
+        "$inc": {"message_count": -deleted_count},
+        "$set": {
+            "last_no": latest["no"] if latest else 0,
+            "preview": latest["content"][:SESSION_PREVIEW_LENGTH] if latest else ""
+        }
+    }
+    if seq_max is not None:
+        update["$min"] = {"seq": seq_max}
+    return update
+
+def session_ids_query(user_id: str, after: Optional[str] = None) -> Dict[str, Any]:
+    """メッセージのあるセッションをsession_id順に読むクエリを返す"""
+    query: Dict[str, Any] = {"user_id": user_id, "message_count": {"$gt": 0}}
+    if after is not None:
+        query["session_id"] = {"$gt": after}
+    return query
+
+def title_upsert(title: str, now: datetime) -> Dict[str, Any]:
+    return {"$set": {"title": title, "updated_at": now}, "$setOnInsert": {"created_at": now}}
+
+def before_cursor(before: Optional[datetime], before_session_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    一覧のカーソルより後ろ（(updated_at, session_id)の降順で後ろ）のセッションの条件を返す（カーソルがない場合はNone）
+
+    before_session_idを省略した場合はupdated_atだけで比較する。
+    """
+    if before is None:
+        return None
+    if before_session_id is None:
+        return {"updated_at": {"$lt": before}}
+    return {"$or": [{"updated_at": {"$lt": before}}, {"updated_at": before, "session_id": {"$lt": before_session_id}}]}
+
+def session_titles_query(user_id: str, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> Dict[str, Any]:
+    """タイトルのあるセッションのサマリーを読むクエリを返す"""
+    query: Dict[str, Any] = {"user_id": user_id, "title": {"$exists": True}}
+    cursor = before_cursor(before, before_session_id)
+    if cursor is not None:
+        query.update(cursor)
+    return query
+
+def delete_title_filter(user_id: str, session_id: str) -> Dict[str, Any]:
+    return dict(session_filter(user_id, session_id), title={"$exists": True})
+
+def session_summaries_query(user_id: str, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> Dict[str, Any]:
+    """メッセージまたはタイトルのあるセッションのサマリーを読むクエリを返す"""
+    listed = {"$or": [{"message_count": {"$gt": 0}}, {"title": {"$exists": True}}]}
+    cursor = before_cursor(before, before_session_id)
+    if cursor is None:
+        return dict(listed, user_id=user_id)
+    # カーソルの条件も$orになるため$andでまとめる
+    return {"user_id": user_id, "$and": [listed, cursor]}
+
+def migration_filter(name: str) -> Dict[str, Any]:
+    return {"_id": name}
+
+def migration_done_update(now: datetime) -> Dict[str, Any]:
+    return {"$set": {"completed_at": now}}
+
+def history_summary_invalidation_filter(user_id: str, session_id: str, no: int) -> Dict[str, Any]:
+    """削除されたメッセージ（no以降）を含む要約のフィルターを返す"""
+    return dict(session_filter(user_id, session_id), up_to_no={"$gte": no})
+
+def history_summary_update(summary: HistorySummary) -> Dict[str, Any]:
+    return {"$set": summary.model_dump()}
+
+def to_message(doc: Dict[str, Any]) -> ChatMessage:
+    return ChatMessage(**doc)
+
+def to_session_title(doc: Dict[str, Any]) -> SessionTitle:
+    return SessionTitle(**doc)
+
+def to_session_summary(doc: Dict[str, Any]) -> SessionSummary:
+    return SessionSummary(**doc)
+
+def to_history_summary(doc: Optional[Dict[str, Any]]) -> Optional[HistorySummary]:
+    return HistorySummary(**doc) if doc else None
+
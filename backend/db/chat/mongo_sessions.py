@@ -0,0 +1,131 @@
+"""
+MongoDBのセッションのサマリードキュメント（session_titlesコレクション）の更新処理
+
+セッションごとに1ドキュメントで、タイトル・作成/更新日時・no採番用のseq・メッセージ数・最後のno・
+最後のメッセージのプレビューを保持する。メッセージの保存時にupsertで更新するため、
+サイドバーのセッション一覧はメッセージを走査せずに1回のクエリで取得できる。
+
+このドキュメントを導入する前に保存されたセッションはメッセージ数・プレビューを持たないため、
+リポジトリのinitializeが初回の起動時にメッセージから作り直す（完了したらmigrationsコレクションに
+SESSION_SUMMARIES_MIGRATIONのマーカーを書く）。モジュールとして実行して手動で作り直すこともできる。
+
+使い方（backendディレクトリで実行）:
+    python -m db.chat.mongo_sessions --host localhost --port 27017
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, List
+from pymongo import MongoClient
+from .mongo_indexes import SESSION_TITLES_COLLECTION, ensure_indexes
+from .models import SESSION_PREVIEW_LENGTH
+
+# サマリーをメッセージから作り直す移行の名前（migrationsコレクションのマーカーの_id）
+SESSION_SUMMARIES_MIGRATION = "session_summaries_backfill"
+
+# get_session_summaries で返すフィールド
+SESSION_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "user_id": 1,
+    "session_id": 1,
+    "title": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "message_count": 1,
+    "last_no": 1,
+    "preview": 1
+}
+
+def session_update_pipeline(last_content: str, count: int, now: datetime, max_no: int) -> List[Dict[str, Any]]:
+    """
+    メッセージを保存した後のセッションのサマリーの更新（aggregation pipeline形式）を返す
+
+    noは保存前に確保済み（seqは進めてある）のため、seq・last_noはmax_noまでしか進めない。
+    パイプライン形式にすることで、並行して保存した他のメッセージより小さいnoでlast_noを戻さない。
+
+    Args:
+        last_content: 保存したメッセージのうち最後のものの内容
+        count: 保存したメッセージ数
+        now: 更新日時
+        max_no: 保存したメッセージの最大のno
+    """
+    return [
+        {"$set": {
+            "seq": {"$max": [{"$ifNull": ["$seq", 0]}, max_no]},
+            "last_no": {"$max": [{"$ifNull": ["$last_no", 0]}, max_no]},
+            "message_count": {"$add": [{"$ifNull": ["$message_count", 0]}, count]},
+            # 内容が$で始まる場合にフィールド参照として解釈されないようにする
+            "preview": {"$literal": last_content[:SESSION_PREVIEW_LENGTH]},
+            "updated_at": now,
+            "created_at": {"$ifNull": ["$created_at", now]}
+        }}
+    ]
+
+def backfill_pipeline(now: datetime) -> List[Dict[str, Any]]:
+    """メッセージからセッションのサマリーを作り直し、session_titlesコレクションにマージするパイプラインを返す"""
+    return [
+        {"$sort": {"user_id": 1, "session_id": 1, "no": 1}},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "session_id": "$session_id"},
+            "message_count": {"$sum": 1},
+            "last_no": {"$max": "$no"},
+            "last_content": {"$last": "$content"}
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id.user_id",
+            "session_id": "$_id.session_id",
+            "message_count": 1,
+            "last_no": 1,
+            "seq": "$last_no",
+            "preview": {"$substrCP": ["$last_content", 0, SESSION_PREVIEW_LENGTH]},
+            "created_at": {"$literal": now},
+            "updated_at": {"$literal": now}
+        }},
+        {"$merge": {
+            "into": SESSION_TITLES_COLLECTION,
+            "on": ["user_id", "session_id"],
+            # 既存のタイトル・日時は残し、seqは小さくしない（途中のnoを再利用しないため）
+            "whenMatched": [{"$set": {
+                "message_count": "$$new.message_count",
+                "last_no": "$$new.last_no",
+                "preview": "$$new.preview",
+                "seq": {"$max": [{"$ifNull": ["$seq", 0]}, "$$new.seq"]},
+                "created_at": {"$ifNull": ["$created_at", "$$new.created_at"]},
+                "updated_at": {"$ifNull": ["$updated_at", "$$new.updated_at"]}
+            }}],
+            "whenNotMatched": "insert"
+        }}
+    ]
+
+def backfill_session_summaries(db, collection_name: str = "messages") -> int:
+    """
+    メッセージからセッションのサマリーを作り直し、サマリーの件数を返す
+
+    $mergeは(user_id, session_id)の一意インデックスを必要とするため、先にインデックスを作成する。
+    """
+    ensure_indexes(db, collection_name)
+    db[collection_name].aggregate(backfill_pipeline(datetime.utcnow()), allowDiskUse=True)
+    return db[SESSION_TITLES_COLLECTION].count_documents({})
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild per-session summary documents from stored chat messages")
+    parser.add_argument("--host", default=os.getenv("MONGODB_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MONGODB_PORT", "27017")))
+    parser.add_argument("--db-name", default="chatdb")
+    parser.add_argument("--collection-name", default="messages")
+    args = parser.parse_args()
+
+    username = os.getenv("MONGODB_USER")
+    password = os.getenv("MONGODB_PASSWORD")
+    if username and password:
+        client = MongoClient(f"mongodb://{username}:{password}@{args.host}:{args.port}/admin")
+    else:
+        client = MongoClient(host=args.host, port=args.port)
+    sessions = backfill_session_summaries(client[args.db_name], args.collection_name)
+    print(json.dumps({"backfilled_at": datetime.utcnow().isoformat(), "session_documents": sessions}, indent=2))
+    client.close()
+
+if __name__ == "__main__":
+    main()
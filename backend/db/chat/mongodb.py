@@ -1,61 +1,169 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 from logging import getLogger
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import BulkWriteError
 from .interface import IChatRepo
-from .models import ChatMessage, SessionTitle
+from .mongo_indexes import ensure_indexes, SESSION_TITLES_COLLECTION, HISTORY_SUMMARIES_COLLECTION, MIGRATIONS_COLLECTION
+from .mongo_sessions import session_update_pipeline, backfill_pipeline, SESSION_SUMMARIES_MIGRATION
+from .models import ChatMessage, SessionTitle, SessionSummary, HistorySummary
+from . import mongo_queries as queries
 from datetime import datetime
-import os
 
 class MongoChatRepo(IChatRepo):
     def __init__(self, host_name: str, port_num: int, db_name: str = "chatdb", collection_name: str = "messages"):
         self.logger = getLogger("uvicorn.app")
-        
-        # 環境変数から認証情報を取得
-        username = os.getenv("MONGODB_USER")
-        password = os.getenv("MONGODB_PASSWORD")
-        
-        if username and password:
-            # 認証情報がある場合はURIを使用
-            uri = f"mongodb://{username}:{password}@{host_name}:{port_num}/admin"
-            self.client = MongoClient(uri)
-        else:
-            # 認証情報がない場合は従来通り
-            self.client = MongoClient(host=host_name, port=port_num)
-        
+        # 環境変数に認証情報がある場合はURIで接続する
+        args, kwargs = queries.client_options(host_name, port_num)
+        self.client = MongoClient(*args, **kwargs)
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
-        self.session_titles_collection = self.db["session_titles"]
+        # セッションごとのサマリー（タイトル・no採番用のseq・メッセージ数・最後のno・プレビュー）
+        self.session_titles_collection = self.db[SESSION_TITLES_COLLECTION]
+        self.history_summaries_collection = self.db[HISTORY_SUMMARIES_COLLECTION]
+        # 起動時のデータ移行の完了を記録するマーカー
+        self.migrations_collection = self.db[MIGRATIONS_COLLECTION]
+
+    async def initialize(self) -> None:
+        """
+        クエリで使うインデックスを作成する（作成済みの場合は何もしない）
+
+        サマリードキュメントの導入前に保存されたセッションがセッション一覧・get_session_idsから
+        漏れないよう、初回の起動時にメッセージからサマリーを作り直す。
+        """
+        try:
+            indexes = ensure_indexes(self.db, self.collection.name)
+            self.logger.info(f"Ensured MongoDB indexes: {indexes}")
+        except Exception as e:
+            # インデックスがなくても動作はするため起動は継続する
+            self.logger.error(f"Error creating MongoDB indexes: {str(e)}", exc_info=True)
+            return
+        try:
+            self._backfill_session_summaries()
+        except Exception as e:
+            # 次回の起動で再実行する
+            self.logger.error(f"Error backfilling MongoDB session summaries: {str(e)}", exc_info=True)
+
+    def _backfill_session_summaries(self) -> None:
+        """
+        メッセージからセッションのサマリーを作り直す（マーカーがある場合は何もしない）
+
+        $mergeは(user_id, session_id)の一意インデックスを必要とするため、インデックスの作成後に呼ぶ。
+        完了後にmigrationsコレクションへマーカーを書き、以降の起動では実行しない。
+        """
+        marker = queries.migration_filter(SESSION_SUMMARIES_MIGRATION)
+        if self.migrations_collection.find_one(marker) is not None:
+            return
+        now = datetime.utcnow()
+        self.collection.aggregate(backfill_pipeline(now), allowDiskUse=True)
+        self.migrations_collection.update_one(marker, queries.migration_done_update(now), upsert=True)
+        self.logger.info(f"Backfilled MongoDB session summaries from {self.collection.name}")
+
+    def _allocate_nos(self, user_id: str, session_id: str, count: int) -> int:
+        """
+        セッションのnoをcount個連続で確保し、最後のnoを返す
+
+        セッションのサマリードキュメントのseqを1回の更新で進めるため、O(1)かつ並行書き込みでも重複しない。
+        メッセージ数・最後のno・プレビューはここでは更新しない（保存できたメッセージだけを_update_session_summaryで反映する）。
+        """
+        session_filter = queries.session_filter(user_id, session_id)
+        session = self.session_titles_collection.find_one_and_update(
+            session_filter,
+            queries.reserve_update(count, datetime.utcnow()),
+            upsert=True,
+            projection={"_id": 0, "seq": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if queries.needs_legacy_seq(session["seq"], count):
+            # 採番を始めたばかりのセッションの場合、seq導入前のメッセージがあればその続きから採番する
+            latest = self.collection.find_one(session_filter, queries.LATEST_MESSAGE_PROJECTION, sort=queries.LATEST_MESSAGE_SORT)
+            update = queries.legacy_seq_update(latest)
+            if update is not None:
+                session = self.session_titles_collection.find_one_and_update(
+                    session_filter,
+                    update,
+                    projection={"_id": 0, "seq": 1},
+                    return_document=ReturnDocument.AFTER
+                )
+        return session["seq"]
+
+    def _update_session_summary(self, user_id: str, session_id: str, messages: List[ChatMessage]) -> None:
+        """保存したメッセージ（noの昇順）をセッションのサマリーのメッセージ数・最後のno・プレビュー・更新日時に反映する"""
+        if not messages:
+            return
+        self.session_titles_collection.update_one(
+            queries.session_filter(user_id, session_id),
+            session_update_pipeline(messages[-1].content, len(messages), datetime.utcnow(), max_no=max(message.no for message in messages)),
+            upsert=True
+        )
+
+    def _refresh_last_message(self, user_id: str, session_id: str, deleted_count: int, seq_max: Optional[int] = None) -> None:
+        """メッセージを削除した後、セッションのサマリーのメッセージ数・最後のno・プレビューを更新する"""
+        session_filter = queries.session_filter(user_id, session_id)
+        latest = self.collection.find_one(session_filter, queries.LATEST_MESSAGE_PROJECTION, sort=queries.LATEST_MESSAGE_SORT)
+        self.session_titles_collection.update_one(session_filter, queries.refresh_last_message_update(latest, deleted_count, seq_max))
 
     async def save_chat_message(self, user_id: str, session_id: str, message: ChatMessage) -> ChatMessage:
         """チャットメッセージを保存し、no割り当て済みのChatMessageを返す"""
         self.logger.info(f"Saving chat message for user {user_id}, session {session_id}")
         try:
             # noを自動付与
-            next_no = self.collection.count_documents({"user_id": user_id, "session_id": session_id}) + 1
-            self.collection.insert_one({
-                "user_id": user_id,
-                "session_id": session_id,
-                "no": next_no,
-                "role": message.role,
-                "content": message.content
-            })
-            count = self.collection.count_documents({"user_id": user_id, "session_id": session_id})
-            self.logger.info(f"Saved chat message for user {user_id}, session {session_id}")
-            self.logger.info(f"Chat messages count: {count}")
-            return ChatMessage(no=next_no, role=message.role, content=message.content)
+            next_no = self._allocate_nos(user_id, session_id, 1)
+            saved = ChatMessage(no=next_no, role=message.role, content=message.content)
+            self.collection.insert_one(queries.message_document(user_id, session_id, saved))
+            # 保存できた場合のみサマリーに反映する
+            self._update_session_summary(user_id, session_id, [saved])
+            self.logger.info(f"Saved chat message no={next_no} for user {user_id}, session {session_id}")
+            return saved
         except Exception as e:
             self.logger.error(f"Error saving chat message for user_id={user_id}, session_id={session_id}, role={message.role}: {str(e)}", exc_info=True)
             raise
 
-    async def get_chat_messages(self, user_id: str, session_id: str) -> List[ChatMessage]:
+    async def save_chat_messages(self, user_id: str, session_id: str, messages: List[ChatMessage]) -> List[ChatMessage]:
+        """複数のチャットメッセージを連続したnoでまとめて保存し、no割り当て済みのChatMessageを順に返す"""
+        self.logger.info(f"Saving {len(messages)} chat messages for user {user_id}, session {session_id}")
+        if not messages:
+            return []
+        try:
+            if queries.is_prenumbered(messages):
+                # 採番済みのメッセージ（write-behind）はそのnoで保存する（サマリーの更新でseqを追いつかせる）
+                messages_with_no = list(messages)
+            else:
+                # noを連続して確保する
+                last_no = self._allocate_nos(user_id, session_id, len(messages))
+                messages_with_no = queries.number_messages(messages, last_no)
+            # 1回のinsert_manyで順序どおりに保存する
+            try:
+                self.collection.insert_many([queries.message_document(user_id, session_id, message) for message in messages_with_no], ordered=True)
+            except BulkWriteError as e:
+                # 途中まで保存された場合は、保存されたメッセージだけをサマリーに反映する
+                self._update_session_summary(user_id, session_id, messages_with_no[:queries.inserted_count(e)])
+                raise
+            self._update_session_summary(user_id, session_id, messages_with_no)
+            self.logger.info(f"Saved chat messages no={messages_with_no[0].no}-{messages_with_no[-1].no} for user {user_id}, session {session_id}")
+            return messages_with_no
+        except Exception as e:
+            self.logger.error(f"Error saving chat messages for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def reserve_nos(self, user_id: str, session_id: str, count: int) -> int:
+        """メッセージを保存せずにセッションのnoをcount個連続で確保し、最後のnoを返す"""
+        try:
+            last_no = self._allocate_nos(user_id, session_id, count)
+            self.logger.info(f"Reserved chat message no={last_no - count + 1}-{last_no} for user {user_id}, session {session_id}")
+            return last_no
+        except Exception as e:
+            self.logger.error(f"Error reserving chat message numbers for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def get_chat_messages(self, user_id: str, session_id: str, limit: Optional[int] = None, after_no: Optional[int] = None) -> List[ChatMessage]:
         """セッションIDに紐づくチャットメッセージを取得する"""
         self.logger.info(f"Getting chat messages for user {user_id}, session {session_id}")
         try:
-            all_count = self.collection.count_documents({})
-            self.logger.info(f"Chat messages all count: {all_count}")
-            cursor = self.collection.find({"user_id": user_id, "session_id": session_id}, {"_id": 0, "no": 1, "role": 1, "content": 1}).sort("no", 1)
-            messages = [ChatMessage(**msg) for msg in cursor]
-            return messages
+            # (user_id, session_id, no)のインデックスで範囲検索し、必要なフィールドのみ返す
+            cursor = self.collection.find(queries.messages_query(user_id, session_id, after_no), queries.MESSAGE_PROJECTION).sort(queries.MESSAGE_SORT)
+            if limit is not None:
+                cursor = cursor.limit(limit)
+            return [queries.to_message(doc) for doc in cursor]
         except Exception as e:
             self.logger.error(f"Error getting chat messages for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
             raise
@@ -63,7 +171,11 @@ class MongoChatRepo(IChatRepo):
     async def clear_chat_messages(self, user_id: str, session_id: str) -> None:
         """指定したsession_idの全メッセージを削除する"""
         try:
-            result = self.collection.delete_many({"user_id": user_id, "session_id": session_id})
+            session_filter = queries.session_filter(user_id, session_id)
+            result = self.collection.delete_many(session_filter)
+            # 全削除した場合はnoを1から振り直す（タイトルは残す）
+            self.session_titles_collection.update_one(session_filter, queries.CLEARED_SESSION_UPDATE)
+            self._invalidate_history_summary(user_id, session_id, 1)
             self.logger.info(f"Cleared {result.deleted_count} messages for user_id={user_id}, session_id={session_id}")
         except Exception as e:
             self.logger.error(f"Error clearing chat messages for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
@@ -72,21 +184,42 @@ class MongoChatRepo(IChatRepo):
     async def delete_chat_message_by_no(self, user_id: str, session_id: str, no: int) -> None:
         """指定されたnoのメッセージを削除する"""
         try:
-            result = self.collection.delete_one({"user_id": user_id, "session_id": session_id, "no": no})
+            result = self.collection.delete_one(queries.message_by_no_filter(user_id, session_id, no))
             if result.deleted_count == 0:
                 self.logger.warning(f"No message found to delete for user_id={user_id}, session_id={session_id}, no={no}")
             else:
+                self._refresh_last_message(user_id, session_id, result.deleted_count)
+                self._invalidate_history_summary(user_id, session_id, no)
                 self.logger.info(f"Deleted message no={no} for user_id={user_id}, session_id={session_id}")
         except Exception as e:
             self.logger.error(f"Error deleting chat message for user_id={user_id}, session_id={session_id}, no={no}: {str(e)}", exc_info=True)
             raise
 
-    async def get_session_ids(self, user_id: str) -> List[str]:
+    async def delete_sessions(self, user_id: str, session_ids: List[str]) -> int:
+        """複数のセッションのメッセージ・サマリー・会話の要約を、コレクションごとに1回のdelete_manyで削除する"""
+        self.logger.info(f"Deleting {len(session_ids)} sessions for user {user_id}")
+        if not session_ids:
+            return 0
+        try:
+            sessions_filter = queries.sessions_filter(user_id, session_ids)
+            result = self.collection.delete_many(sessions_filter)
+            self.session_titles_collection.delete_many(sessions_filter)
+            self.history_summaries_collection.delete_many(sessions_filter)
+            self.logger.info(f"Deleted {result.deleted_count} messages in {len(session_ids)} sessions for user_id={user_id}")
+            return result.deleted_count
+        except Exception as e:
+            self.logger.error(f"Error deleting sessions for user_id={user_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def get_session_ids(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None) -> List[str]:
         """user_idに紐づくすべてのsession_idを取得する"""
         self.logger.info(f"Getting session IDs for user {user_id}")
         try:
-            # user_idでフィルタして、重複のないsession_idを取得
-            session_ids = self.collection.distinct("session_id", {"user_id": user_id})
+            # メッセージを走査せず、セッションのサマリーを(user_id, session_id)のインデックス順に読む
+            cursor = self.session_titles_collection.find(queries.session_ids_query(user_id, after), queries.SESSION_ID_PROJECTION).sort(queries.SESSION_ID_SORT)
+            if limit is not None:
+                cursor = cursor.limit(limit)
+            session_ids = [doc["session_id"] for doc in cursor]
             self.logger.info(f"Found {len(session_ids)} sessions for user {user_id}")
             return session_ids
         except Exception as e:
@@ -96,65 +229,46 @@ class MongoChatRepo(IChatRepo):
     async def delete_messages_from_no(self, user_id: str, session_id: str, no: int) -> None:
         """指定されたno以降のメッセージを削除する"""
         try:
-            result = self.collection.delete_many({
-                "user_id": user_id, 
-                "session_id": session_id, 
-                "no": {"$gte": no}
-            })
+            result = self.collection.delete_many(queries.messages_from_no_filter(user_id, session_id, no))
+            # 末尾を削除した場合（編集）は削除したnoから振り直す。途中のnoは再利用しない
+            self._refresh_last_message(user_id, session_id, result.deleted_count, seq_max=no - 1)
+            self._invalidate_history_summary(user_id, session_id, no)
             self.logger.info(f"Deleted {result.deleted_count} messages from no={no} for user_id={user_id}, session_id={session_id}")
         except Exception as e:
             self.logger.error(f"Error deleting messages from no={no} for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
             raise
 
     async def save_session_title(self, user_id: str, session_id: str, title: str) -> SessionTitle:
-        """セッションタイトルを保存する"""
+        """セッションタイトルを保存する（セッションのサマリーがなければ作成する）"""
         self.logger.info(f"Saving session title for user {user_id}, session {session_id}")
         try:
-            now = datetime.utcnow()
-            session_title = SessionTitle(
-                user_id=user_id,
-                session_id=session_id,
-                title=title,
-                created_at=now,
-                updated_at=now
+            # 1回のupsertでタイトルを設定し、更新後のドキュメントを受け取る
+            doc = self.session_titles_collection.find_one_and_update(
+                queries.session_filter(user_id, session_id),
+                queries.title_upsert(title, datetime.utcnow()),
+                upsert=True,
+                projection=queries.SESSION_TITLE_PROJECTION,
+                return_document=ReturnDocument.AFTER
             )
-            
-            # 既存のタイトルがあるかチェック
-            existing = self.session_titles_collection.find_one({
-                "user_id": user_id,
-                "session_id": session_id
-            })
-            
-            if existing:
-                # 既存のタイトルを更新
-                self.session_titles_collection.update_one(
-                    {"user_id": user_id, "session_id": session_id},
-                    {"$set": {"title": title, "updated_at": now}}
-                )
-                session_title.updated_at = now
-            else:
-                # 新しいタイトルを挿入
-                self.session_titles_collection.insert_one(session_title.dict())
-            
+            session_title = queries.to_session_title(doc)
             self.logger.info(f"Saved session title for user {user_id}, session {session_id}")
             return session_title
         except Exception as e:
             self.logger.error(f"Error saving session title for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
             raise
 
-    async def get_session_titles(self, user_id: str) -> List[SessionTitle]:
+    async def get_session_titles(self, user_id: str, limit: Optional[int] = None, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> List[SessionTitle]:
         """ユーザーのセッションタイトル一覧を取得する"""
         self.logger.info(f"Getting session titles for user {user_id}")
         try:
+            # タイトルのないセッションのサマリーは除き、(user_id, updated_at, session_id)のインデックス順に返す
             cursor = self.session_titles_collection.find(
-                {"user_id": user_id}, 
-                {"_id": 0}
-            ).sort("updated_at", -1)  # 更新日時の降順でソート
-            
-            session_titles = []
-            for doc in cursor:
-                session_titles.append(SessionTitle(**doc))
-            
+                queries.session_titles_query(user_id, before, before_session_id),
+                queries.SESSION_TITLE_PROJECTION
+            ).sort(queries.SESSION_ORDER_SORT)
+            if limit is not None:
+                cursor = cursor.limit(limit)
+            session_titles = [queries.to_session_title(doc) for doc in cursor]
             self.logger.info(f"Found {len(session_titles)} session titles for user {user_id}")
             return session_titles
         except Exception as e:
@@ -162,47 +276,79 @@ class MongoChatRepo(IChatRepo):
             raise
 
     async def update_session_title(self, user_id: str, session_id: str, title: str) -> SessionTitle:
-        """セッションタイトルを更新する"""
+        """セッションタイトルを更新する（タイトルが存在しない場合は新規作成）"""
         self.logger.info(f"Updating session title for user {user_id}, session {session_id}")
-        try:
-            now = datetime.utcnow()
-            
-            # 既存のタイトルを更新
-            result = self.session_titles_collection.update_one(
-                {"user_id": user_id, "session_id": session_id},
-                {"$set": {"title": title, "updated_at": now}}
-            )
-            
-            if result.matched_count == 0:
-                # タイトルが存在しない場合は新規作成
-                return await self.save_session_title(user_id, session_id, title)
-            
-            # 更新されたタイトルを取得
-            updated_doc = self.session_titles_collection.find_one({
-                "user_id": user_id,
-                "session_id": session_id
-            })
-            
-            session_title = SessionTitle(**updated_doc)
-            self.logger.info(f"Updated session title for user {user_id}, session {session_id}")
-            return session_title
-        except Exception as e:
-            self.logger.error(f"Error updating session title for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
-            raise
+        return await self.save_session_title(user_id, session_id, title)
 
     async def delete_session_title(self, user_id: str, session_id: str) -> None:
-        """セッションタイトルを削除する"""
+        """セッションタイトルを削除する（メッセージ数やnoの採番はサマリーに残す）"""
         self.logger.info(f"Deleting session title for user {user_id}, session {session_id}")
         try:
-            result = self.session_titles_collection.delete_one({
-                "user_id": user_id,
-                "session_id": session_id
-            })
-            
-            if result.deleted_count == 0:
+            result = self.session_titles_collection.update_one(
+                queries.delete_title_filter(user_id, session_id),
+                queries.DELETE_TITLE_UPDATE
+            )
+            if result.modified_count == 0:
                 self.logger.warning(f"No session title found to delete for user_id={user_id}, session_id={session_id}")
             else:
                 self.logger.info(f"Deleted session title for user_id={user_id}, session_id={session_id}")
         except Exception as e:
             self.logger.error(f"Error deleting session title for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
-            raise 
\ No newline at end of file
+            raise
+
+    async def get_session_summaries(self, user_id: str, limit: Optional[int] = None, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> List[SessionSummary]:
+        """ユーザーのセッション一覧を、(user_id, updated_at, session_id)のインデックスを使う1回のクエリで取得する"""
+        self.logger.info(f"Getting session summaries for user {user_id}")
+        try:
+            cursor = self.session_titles_collection.find(
+                queries.session_summaries_query(user_id, before, before_session_id),
+                queries.SESSION_SUMMARY_PROJECTION
+            ).sort(queries.SESSION_ORDER_SORT)
+            if limit is not None:
+                cursor = cursor.limit(limit)
+            summaries = [queries.to_session_summary(doc) for doc in cursor]
+            self.logger.info(f"Found {len(summaries)} session summaries for user {user_id}")
+            return summaries
+        except Exception as e:
+            self.logger.error(f"Error getting session summaries for user_id={user_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def get_history_summary(self, user_id: str, session_id: str) -> Optional[HistorySummary]:
+        """セッションの古い会話の要約を取得する"""
+        try:
+            doc = self.history_summaries_collection.find_one(queries.session_filter(user_id, session_id), queries.HISTORY_SUMMARY_PROJECTION)
+            return queries.to_history_summary(doc)
+        except Exception as e:
+            self.logger.error(f"Error getting history summary for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def save_history_summary(self, user_id: str, session_id: str, summary: HistorySummary) -> None:
+        """セッションの古い会話の要約を保存する"""
+        self.logger.info(f"Saving history summary for user {user_id}, session {session_id}")
+        try:
+            self.history_summaries_collection.update_one(
+                queries.session_filter(user_id, session_id),
+                queries.history_summary_update(summary),
+                upsert=True
+            )
+        except Exception as e:
+            self.logger.error(f"Error saving history summary for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    def _invalidate_history_summary(self, user_id: str, session_id: str, no: int) -> None:
+        """削除されたメッセージ（no以降）を含む要約を破棄する"""
+        self.history_summaries_collection.delete_one(queries.history_summary_invalidation_filter(user_id, session_id, no))
+
+    async def health_check(self) -> bool:
+        """MongoDBにpingを送り、応答があるかを返す"""
+        try:
+            self.client.admin.command("ping")
+            return True
+        except Exception as e:
+            self.logger.error(f"MongoDB health check failed: {str(e)}")
+            return False
+
+    async def close(self) -> None:
+        """MongoDBクライアントの接続を閉じる"""
+        self.client.close()
+        self.logger.info("Closed MongoDB client")
@@ -0,0 +1,523 @@
+import os
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, List, Optional
+from logging import getLogger
+from .interface import IChatRepo
+from .models import ChatMessage, SessionTitle, SessionSummary, HistorySummary, SESSION_PREVIEW_LENGTH
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        user_id TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        no INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        PRIMARY KEY (user_id, session_id, no)
+    )
+    """,
+    # セッションごとのサマリー（タイトル・no採番用のseq・メッセージ数・最後のno・プレビュー）
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        user_id TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        title TEXT,
+        seq INTEGER NOT NULL DEFAULT 0,
+        message_count INTEGER NOT NULL DEFAULT 0,
+        last_no INTEGER NOT NULL DEFAULT 0,
+        preview TEXT NOT NULL DEFAULT '',
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (user_id, session_id)
+    )
+    """,
+    # セッション・タイトル一覧を(updated_at, session_id)の降順で読むインデックス
+    "DROP INDEX IF EXISTS sessions_user_updated",
+    "CREATE INDEX IF NOT EXISTS sessions_user_updated_session ON sessions (user_id, updated_at DESC, session_id DESC)",
+    """
+    CREATE TABLE IF NOT EXISTS history_summaries (
+        user_id TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        content TEXT NOT NULL,
+        up_to_no INTEGER NOT NULL,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (user_id, session_id)
+    )
+    """
+]
+
+def _format_datetime(value: datetime) -> str:
+    """日時を文字列の大小で比較できる形式に変換する"""
+    return value.isoformat(timespec="microseconds")
+
+def _before_cursor(params: List[Any], before: Optional[datetime], before_session_id: Optional[str]) -> str:
+    """一覧のカーソルより後ろ（(updated_at, session_id)の降順で後ろ）のセッションの条件を返し、パラメータをparamsに追加する"""
+    if before is None:
+        return ""
+    params.append(_format_datetime(before))
+    if before_session_id is None:
+        return " AND updated_at < ?"
+    params.extend([_format_datetime(before), before_session_id])
+    return " AND (updated_at < ? OR (updated_at = ? AND session_id < ?))"
+
+class SQLiteChatRepo(IChatRepo):
+    """
+    SQLiteにチャット履歴を保存するリポジトリ（単一ノード向け）
+
+    WALモードで読み込みと書き込みを並行させ、書き込みは1トランザクションにまとめる。
+    sqlite3の呼び出しはブロッキングのため、専用の1スレッドで実行してイベントループを止めない。
+    SQLは固定の文字列にパラメータを渡す形にし、sqlite3のステートメントキャッシュで再利用する。
+    """
+
+    def __init__(self, path: str = "data/chat.sqlite3", busy_timeout_ms: int = 5000):
+        """
+        Args:
+            path: データベースファイルのパス
+            busy_timeout_ms: 他のプロセスが書き込み中の場合に待つ時間（ミリ秒）
+        """
+        self.logger = getLogger("uvicorn.app")
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        # 接続は専用スレッドの中でだけ使う
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-chat")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """専用スレッドで接続を開き、スキーマを作成する（2回目以降は開いた接続を返す）"""
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # トランザクションは_writeで明示的に開始する
+            conn = sqlite3.connect(self.path, isolation_level=None, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        """専用スレッドでfuncを実行する"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _write(self, func: Callable[..., Any], *args: Any) -> Any:
+        """書き込みを1トランザクションで実行する（専用スレッドから呼ぶ）"""
+        conn = self._connection()
+        # 採番と保存の間に他のプロセスが書き込まないよう、開始時に書き込みロックを取る
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn, *args)
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def initialize(self) -> None:
+        """データベースファイルを開き、テーブルとインデックスを作成する"""
+        try:
+            await self._run(self._connection)
+            self.logger.info(f"Opened SQLite chat database: {self.path}")
+        except Exception as e:
+            self.logger.error(f"Error opening SQLite chat database {self.path}: {str(e)}", exc_info=True)
+            raise
+
+    async def health_check(self) -> bool:
+        """データベースに問い合わせられるかを返す"""
+        try:
+            await self._run(lambda: self._connection().execute("SELECT 1").fetchone())
+            return True
+        except Exception as e:
+            self.logger.error(f"SQLite health check failed: {str(e)}")
+            return False
+
+    async def close(self) -> None:
+        """接続を閉じ、専用スレッドを終了する"""
+        def close_connection():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+        await self._run(close_connection)
+        self._executor.shutdown(wait=True)
+
+    async def save_chat_message(self, user_id: str, session_id: str, message: ChatMessage) -> ChatMessage:
+        """チャットメッセージを保存し、no割り当て済みのChatMessageを返す"""
+        saved_messages = await self.save_chat_messages(user_id, session_id, [message])
+        return saved_messages[0]
+
+    async def save_chat_messages(self, user_id: str, session_id: str, messages: List[ChatMessage]) -> List[ChatMessage]:
+        """複数のチャットメッセージを連続したnoでまとめて保存し、no割り当て済みのChatMessageを順に返す"""
+        self.logger.info(f"Saving {len(messages)} chat messages for user {user_id}, session {session_id}")
+        if not messages:
+            return []
+
+        def save(conn: sqlite3.Connection) -> List[ChatMessage]:
+            now = _format_datetime(datetime.utcnow())
+            preview = messages[-1].content[:SESSION_PREVIEW_LENGTH]
+            if all(message.no > 0 for message in messages):
+                # 採番済みのメッセージ（write-behind）はそのnoで保存し、seqを追いつかせる
+                messages_with_no = list(messages)
+                max_no = max(message.no for message in messages_with_no)
+                conn.execute(
+                    "INSERT INTO sessions (user_id, session_id, seq, message_count, last_no, preview, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (user_id, session_id) DO UPDATE SET seq = max(seq, excluded.seq), "
+                    "message_count = message_count + excluded.message_count, last_no = max(last_no, excluded.last_no), "
+                    "preview = excluded.preview, updated_at = excluded.updated_at",
+                    (user_id, session_id, max_no, len(messages_with_no), max_no, preview, now, now)
+                )
+            else:
+                # noを連続して確保し、同じ文でメッセージ数・最後のno・プレビューも更新する
+                # （UPDATE SETの右辺のseqは更新前の値）
+                conn.execute(
+                    "INSERT INTO sessions (user_id, session_id, seq, message_count, last_no, preview, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (user_id, session_id) DO UPDATE SET seq = seq + excluded.seq, "
+                    "message_count = message_count + excluded.message_count, last_no = seq + excluded.seq, "
+                    "preview = excluded.preview, updated_at = excluded.updated_at",
+                    (user_id, session_id, len(messages), len(messages), len(messages), preview, now, now)
+                )
+                last_no = conn.execute(
+                    "SELECT seq FROM sessions WHERE user_id = ? AND session_id = ?",
+                    (user_id, session_id)
+                ).fetchone()[0]
+                first_no = last_no - len(messages) + 1
+                messages_with_no = [
+                    ChatMessage(no=first_no + i, role=message.role, content=message.content)
+                    for i, message in enumerate(messages)
+                ]
+            conn.executemany(
+                "INSERT INTO messages (user_id, session_id, no, role, content) VALUES (?, ?, ?, ?, ?)",
+                [(user_id, session_id, message.no, message.role, message.content) for message in messages_with_no]
+            )
+            return messages_with_no
+
+        try:
+            messages_with_no = await self._run(self._write, save)
+            self.logger.info(f"Saved chat messages no={messages_with_no[0].no}-{messages_with_no[-1].no} for user {user_id}, session {session_id}")
+            return messages_with_no
+        except Exception as e:
+            self.logger.error(f"Error saving chat messages for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def reserve_nos(self, user_id: str, session_id: str, count: int) -> int:
+        """メッセージを保存せずにセッションのnoをcount個連続で確保し、最後のnoを返す"""
+        def reserve(conn: sqlite3.Connection) -> int:
+            now = _format_datetime(datetime.utcnow())
+            conn.execute(
+                "INSERT INTO sessions (user_id, session_id, seq, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, session_id) DO UPDATE SET seq = seq + excluded.seq",
+                (user_id, session_id, count, now, now)
+            )
+            return conn.execute(
+                "SELECT seq FROM sessions WHERE user_id = ? AND session_id = ?",
+                (user_id, session_id)
+            ).fetchone()[0]
+
+        try:
+            last_no = await self._run(self._write, reserve)
+            self.logger.info(f"Reserved chat message no={last_no - count + 1}-{last_no} for user {user_id}, session {session_id}")
+            return last_no
+        except Exception as e:
+            self.logger.error(f"Error reserving chat message numbers for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def get_chat_messages(self, user_id: str, session_id: str, limit: Optional[int] = None, after_no: Optional[int] = None) -> List[ChatMessage]:
+        """セッションIDに紐づくチャットメッセージを取得する"""
+        self.logger.info(f"Getting chat messages for user {user_id}, session {session_id}")
+
+        def load() -> List[ChatMessage]:
+            # LIMIT -1 は上限なし
+            rows = self._connection().execute(
+                "SELECT no, role, content FROM messages WHERE user_id = ? AND session_id = ? AND no > ? ORDER BY no LIMIT ?",
+                (user_id, session_id, after_no if after_no is not None else 0, limit if limit is not None else -1)
+            )
+            return [ChatMessage(no=no, role=role, content=content) for no, role, content in rows]
+
+        try:
+            return await self._run(load)
+        except Exception as e:
+            self.logger.error(f"Error getting chat messages for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def clear_chat_messages(self, user_id: str, session_id: str) -> None:
+        """指定したsession_idの全メッセージを削除する"""
+        def clear(conn: sqlite3.Connection) -> int:
+            deleted_count = conn.execute("DELETE FROM messages WHERE user_id = ? AND session_id = ?", (user_id, session_id)).rowcount
+            # 全削除した場合はnoを1から振り直す（タイトルは残す）
+            conn.execute(
+                "UPDATE sessions SET seq = 0, message_count = 0, last_no = 0, preview = '' WHERE user_id = ? AND session_id = ?",
+                (user_id, session_id)
+            )
+            self._invalidate_history_summary(conn, user_id, session_id, 1)
+            return deleted_count
+
+        try:
+            deleted_count = await self._run(self._write, clear)
+            self.logger.info(f"Cleared {deleted_count} messages for user_id={user_id}, session_id={session_id}")
+        except Exception as e:
+            self.logger.error(f"Error clearing chat messages for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def delete_chat_message_by_no(self, user_id: str, session_id: str, no: int) -> None:
+        """指定されたnoのメッセージを削除する"""
+        def delete(conn: sqlite3.Connection) -> int:
+            deleted_count = conn.execute(
+                "DELETE FROM messages WHERE user_id = ? AND session_id = ? AND no = ?",
+                (user_id, session_id, no)
+            ).rowcount
+            if deleted_count:
+                self._refresh_last_message(conn, user_id, session_id, deleted_count)
+                self._invalidate_history_summary(conn, user_id, session_id, no)
+            return deleted_count
+
+        try:
+            deleted_count = await self._run(self._write, delete)
+            if deleted_count == 0:
+                self.logger.warning(f"No message found to delete for user_id={user_id}, session_id={session_id}, no={no}")
+            else:
+                self.logger.info(f"Deleted message no={no} for user_id={user_id}, session_id={session_id}")
+        except Exception as e:
+            self.logger.error(f"Error deleting chat message for user_id={user_id}, session_id={session_id}, no={no}: {str(e)}", exc_info=True)
+            raise
+
+    async def delete_sessions(self, user_id: str, session_ids: List[str]) -> int:
+        """複数のセッションのメッセージ・サマリー・会話の要約を1トランザクションで削除する"""
+        self.logger.info(f"Deleting {len(session_ids)} sessions for user {user_id}")
+        if not session_ids:
+            return 0
+
+        def delete(conn: sqlite3.Connection) -> int:
+            params = [(user_id, session_id) for session_id in session_ids]
+            deleted_count = conn.executemany("DELETE FROM messages WHERE user_id = ? AND session_id = ?", params).rowcount
+            conn.executemany("DELETE FROM sessions WHERE user_id = ? AND session_id = ?", params)
+            conn.executemany("DELETE FROM history_summaries WHERE user_id = ? AND session_id = ?", params)
+            return deleted_count
+
+        try:
+            deleted_count = await self._run(self._write, delete)
+            self.logger.info(f"Deleted {deleted_count} messages in {len(session_ids)} sessions for user_id={user_id}")
+            return deleted_count
+        except Exception as e:
+            self.logger.error(f"Error deleting sessions for user_id={user_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def get_session_ids(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None) -> List[str]:
+        """user_idに紐づくsession_idを取得する"""
+        self.logger.info(f"Getting session IDs for user {user_id}")
+
+        def load() -> List[str]:
+            # メッセージを走査せず、セッションのサマリーを主キー（user_id, session_id）の順に読む
+            rows = self._connection().execute(
+                "SELECT session_id FROM sessions WHERE user_id = ? AND message_count > 0 AND session_id > ? ORDER BY session_id LIMIT ?",
+                (user_id, after if after is not None else "", limit if limit is not None else -1)
+            )
+            return [session_id for (session_id,) in rows]
+
+        try:
+            session_ids = await self._run(load)
+            self.logger.info(f"Found {len(session_ids)} sessions for user {user_id}")
+            return session_ids
+        except Exception as e:
+            self.logger.error(f"Error getting session IDs for user_id={user_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def delete_messages_from_no(self, user_id: str, session_id: str, no: int) -> None:
+        """指定されたno以降のメッセージを削除する"""
+        def delete(conn: sqlite3.Connection) -> int:
+            deleted_count = conn.execute(
+                "DELETE FROM messages WHERE user_id = ? AND session_id = ? AND no >= ?",
+                (user_id, session_id, no)
+            ).rowcount
+            # 末尾を削除した場合（編集）は削除したnoから振り直す。途中のnoは再利用しない
+            self._refresh_last_message(conn, user_id, session_id, deleted_count, seq_max=no - 1)
+            self._invalidate_history_summary(conn, user_id, session_id, no)
+            return deleted_count
+
+        try:
+            deleted_count = await self._run(self._write, delete)
+            self.logger.info(f"Deleted {deleted_count} messages from no={no} for user_id={user_id}, session_id={session_id}")
+        except Exception as e:
+            self.logger.error(f"Error deleting messages from no={no} for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def save_session_title(self, user_id: str, session_id: str, title: str) -> SessionTitle:
+        """セッションタイトルを保存する（既存のタイトルがある場合は更新する）"""
+        self.logger.info(f"Saving session title for user {user_id}, session {session_id}")
+
+        def save(conn: sqlite3.Connection) -> SessionTitle:
+            now = _format_datetime(datetime.utcnow())
+            conn.execute(
+                "INSERT INTO sessions (user_id, session_id, title, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, session_id) DO UPDATE SET title = excluded.title, updated_at = excluded.updated_at",
+                (user_id, session_id, title, now, now)
+            )
+            return self._load_session_title(conn, user_id, session_id)
+
+        try:
+            session_title = await self._run(self._write, save)
+            self.logger.info(f"Saved session title for user {user_id}, session {session_id}")
+            return session_title
+        except Exception as e:
+            self.logger.error(f"Error saving session title for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def get_session_titles(self, user_id: str, limit: Optional[int] = None, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> List[SessionTitle]:
+        """ユーザーのセッションタイトル一覧を更新日時の降順（同じ更新日時はsession_idの降順）で取得する"""
+        self.logger.info(f"Getting session titles for user {user_id}")
+
+        def load() -> List[SessionTitle]:
+            query = "SELECT user_id, session_id, title, created_at, updated_at FROM sessions WHERE user_id = ? AND title IS NOT NULL"
+            params: List[Any] = [user_id]
+            query += _before_cursor(params, before, before_session_id)
+            query += " ORDER BY updated_at DESC, session_id DESC LIMIT ?"
+            params.append(limit if limit is not None else -1)
+            return [self._to_session_title(row) for row in self._connection().execute(query, params)]
+
+        try:
+            session_titles = await self._run(load)
+            self.logger.info(f"Found {len(session_titles)} session titles for user {user_id}")
+            return session_titles
+        except Exception as e:
+            self.logger.error(f"Error getting session titles for user_id={user_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def update_session_title(self, user_id: str, session_id: str, title: str) -> SessionTitle:
+        """セッションタイトルを更新する（タイトルが存在しない場合は新規作成する）"""
+        self.logger.info(f"Updating session title for user {user_id}, session {session_id}")
+        try:
+            return await self.save_session_title(user_id, session_id, title)
+        except Exception as e:
+            self.logger.error(f"Error updating session title for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def delete_session_title(self, user_id: str, session_id: str) -> None:
+        """セッションタイトルを削除する（メッセージ数やnoの採番はサマリーに残す）"""
+        self.logger.info(f"Deleting session title for user {user_id}, session {session_id}")
+
+        def delete(conn: sqlite3.Connection) -> int:
+            return conn.execute(
+                "UPDATE sessions SET title = NULL WHERE user_id = ? AND session_id = ? AND title IS NOT NULL",
+                (user_id, session_id)
+            ).rowcount
+
+        try:
+            if await self._run(self._write, delete):
+                self.logger.info(f"Deleted session title for user_id={user_id}, session_id={session_id}")
+            else:
+                self.logger.warning(f"No session title found to delete for user_id={user_id}, session_id={session_id}")
+        except Exception as e:
+            self.logger.error(f"Error deleting session title for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def get_session_summaries(self, user_id: str, limit: Optional[int] = None, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> List[SessionSummary]:
+        """ユーザーのセッション一覧を、(user_id, updated_at, session_id)のインデックスを使う1回のクエリで取得する"""
+        self.logger.info(f"Getting session summaries for user {user_id}")
+
+        def load() -> List[SessionSummary]:
+            query = (
+                "SELECT user_id, session_id, title, created_at, updated_at, message_count, last_no, preview FROM sessions "
+                "WHERE user_id = ? AND (message_count > 0 OR title IS NOT NULL)"
+            )
+            params: List[Any] = [user_id]
+            query += _before_cursor(params, before, before_session_id)
+            query += " ORDER BY updated_at DESC, session_id DESC LIMIT ?"
+            params.append(limit if limit is not None else -1)
+            return [
+                SessionSummary(
+                    user_id=row[0],
+                    session_id=row[1],
+                    title=row[2],
+                    created_at=datetime.fromisoformat(row[3]),
+                    updated_at=datetime.fromisoformat(row[4]),
+                    message_count=row[5],
+                    last_no=row[6],
+                    preview=row[7]
+                )
+                for row in self._connection().execute(query, params)
+            ]
+
+        try:
+            summaries = await self._run(load)
+            self.logger.info(f"Found {len(summaries)} session summaries for user {user_id}")
+            return summaries
+        except Exception as e:
+            self.logger.error(f"Error getting session summaries for user_id={user_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def get_history_summary(self, user_id: str, session_id: str) -> Optional[HistorySummary]:
+        """セッションの古い会話の要約を取得する"""
+        def load() -> Optional[HistorySummary]:
+            row = self._connection().execute(
+                "SELECT content, up_to_no, updated_at FROM history_summaries WHERE user_id = ? AND session_id = ?",
+                (user_id, session_id)
+            ).fetchone()
+            if row is None:
+                return None
+            return HistorySummary(content=row[0], up_to_no=row[1], updated_at=datetime.fromisoformat(row[2]))
+
+        try:
+            return await self._run(load)
+        except Exception as e:
+            self.logger.error(f"Error getting history summary for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def save_history_summary(self, user_id: str, session_id: str, summary: HistorySummary) -> None:
+        """セッションの古い会話の要約を保存する"""
+        self.logger.info(f"Saving history summary for user {user_id}, session {session_id}")
+
+        def save(conn: sqlite3.Connection) -> None:
+            conn.execute(
+                "INSERT OR REPLACE INTO history_summaries (user_id, session_id, content, up_to_no, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (user_id, session_id, summary.content, summary.up_to_no, _format_datetime(summary.updated_at))
+            )
+
+        try:
+            await self._run(self._write, save)
+        except Exception as e:
+            self.logger.error(f"Error saving history summary for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    def _invalidate_history_summary(self, conn: sqlite3.Connection, user_id: str, session_id: str, no: int) -> None:
+        """削除されたメッセージ（no以降）を含む要約を破棄する"""
+        conn.execute(
+            "DELETE FROM history_summaries WHERE user_id = ? AND session_id = ? AND up_to_no >= ?",
+            (user_id, session_id, no)
+        )
+
+    def _refresh_last_message(self, conn: sqlite3.Connection, user_id: str, session_id: str, deleted_count: int, seq_max: Optional[int] = None) -> None:
+        """メッセージを削除した後、セッションのサマリーのメッセージ数・最後のno・プレビューを更新する"""
+        latest = conn.execute(
+            "SELECT no, content FROM messages WHERE user_id = ? AND session_id = ? ORDER BY no DESC LIMIT 1",
+            (user_id, session_id)
+        ).fetchone()
+        last_no, content = latest if latest else (0, "")
+        conn.execute(
+            "UPDATE sessions SET message_count = message_count - ?, last_no = ?, preview = ?, seq = min(seq, coalesce(?, seq)) "
+            "WHERE user_id = ? AND session_id = ?",
+            (deleted_count, last_no, content[:SESSION_PREVIEW_LENGTH], seq_max, user_id, session_id)
+        )
+
+    def _load_session_title(self, conn: sqlite3.Connection, user_id: str, session_id: str) -> SessionTitle:
+        row = conn.execute(
+            "SELECT user_id, session_id, title, created_at, updated_at FROM sessions WHERE user_id = ? AND session_id = ?",
+            (user_id, session_id)
+        ).fetchone()
+        return self._to_session_title(row)
+
+    @staticmethod
+    def _to_session_title(row) -> SessionTitle:
+        user_id, session_id, title, created_at, updated_at = row
+        return SessionTitle(
+            user_id=user_id,
+            session_id=session_id,
+            title=title,
+            created_at=datetime.fromisoformat(created_at),
+            updated_at=datetime.fromisoformat(updated_at)
+        )
@@ -0,0 +1,310 @@
+import asyncio
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from logging import getLogger
+from .interface import IChatRepo
+from .models import ChatMessage, SessionTitle, SessionSummary, HistorySummary
+
+class WriteBehindChatRepo(IChatRepo):
+    """
+    チャットメッセージの保存をバックグラウンドでまとめて行うリポジトリ（write-behind）
+
+    save_chat_messagesはnoをプロセス内で採番して有界キューに積むだけで返り、
+    バックグラウンドタスクがキューの内容をセッションごとにまとめて内部のリポジトリへ書き込む。
+    書き込み前のメッセージは読み取り時にマージするため、保存直後の履歴取得でも必ず参照できる。
+    削除系の操作はキューを書き出してから実行する。
+    書き込めなかったメッセージは読み取り時のマージに残し、次回の書き出しで再試行する（それでも失敗した場合は失われたものとしてログに残す）。
+
+    noは内部のリポジトリから確保した続きをプロセス内で採番するため、1つのセッションへの書き込みは1プロセスが担う構成（スティッキーセッション）を前提とする。
+    """
+
+    def __init__(
+        self,
+        repository: IChatRepo,
+        max_queue_size: int = 1000,
+        batch_size: int = 100,
+        max_retries: int = 3,
+        retry_delay: float = 0.5,
+        drain_timeout: float = 10.0
+    ):
+        """
+        Args:
+            repository: 実際に永続化を行うリポジトリ
+            max_queue_size: キューに積める保存要求の上限（超えた場合は空くまで待つ）
+            batch_size: 1回の書き出しでまとめる保存要求の最大数
+            max_retries: 書き込みに失敗した場合の再試行回数
+            retry_delay: 再試行までの待ち時間（秒、再試行ごとに倍にする）
+            drain_timeout: 終了時にキューを書き出す際の待ち時間の上限（秒）
+        """
+        self.logger = getLogger("uvicorn.app")
+        self.repository = repository
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.drain_timeout = drain_timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        # (user_id, session_id) -> 書き込み前のメッセージ（no順）
+        self._pending: Dict[Tuple[str, str], List[ChatMessage]] = {}
+        # (user_id, session_id) -> 書き込みに失敗し、次回の書き出しで再試行するメッセージ
+        self._unsaved: Dict[Tuple[str, str], List[ChatMessage]] = {}
+        # (user_id, session_id) -> 最後に採番したno
+        self._last_nos: Dict[Tuple[str, str], int] = {}
+        self._worker: Optional[asyncio.Task] = None
+        self._flushed = 0
+        self._failed = 0
+
+    def _ensure_worker(self) -> None:
+        """書き出し用のバックグラウンドタスクが動いていなければ起動する"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        """キューから保存要求を取り出し、まとめて書き出す"""
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                await self._write_batch(batch)
+            except Exception as e:
+                self.logger.error(f"Error writing chat message batch: {str(e)}", exc_info=True)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write_batch(self, batch: List[Tuple[str, str, List[ChatMessage]]]) -> None:
+        """保存要求をセッションごとにまとめ、1セッション1回の書き込みで保存する"""
+        grouped: Dict[Tuple[str, str], List[ChatMessage]] = {}
+        for user_id, session_id, messages in batch:
+            grouped.setdefault((user_id, session_id), []).extend(messages)
+
+        for (user_id, session_id), messages in grouped.items():
+            key = (user_id, session_id)
+            # 前回書き込めなかったメッセージも合わせて書き込む
+            retried = self._unsaved.pop(key, [])
+            if not retried and not messages:
+                continue
+            if await self._save_with_retry(user_id, session_id, sorted(retried + messages, key=lambda message: message.no)):
+                self._flushed += len(retried) + len(messages)
+                done = retried + messages
+            else:
+                # 書き込めなかったメッセージは次回の書き出しで再試行する（noは採番済みのまま再利用しない）
+                if messages:
+                    self._unsaved[key] = messages
+                if retried:
+                    # 再試行でも書き込めなかったメッセージは失われたものとして記録する
+                    self._failed += len(retried)
+                    self.logger.error(f"Lost chat messages no={[message.no for message in retried]} for user_id={user_id}, session_id={session_id}")
+                done = retried
+            self._discard_pending(key, {message.no for message in done})
+
+    def _discard_pending(self, key: Tuple[str, str], nos: Set[int]) -> None:
+        """書き込み前のメッセージから指定したnoのメッセージを除く"""
+        pending = [message for message in self._pending.get(key, []) if message.no not in nos]
+        if pending:
+            self._pending[key] = pending
+        else:
+            self._pending.pop(key, None)
+
+    async def _save_with_retry(self, user_id: str, session_id: str, messages: List[ChatMessage]) -> bool:
+        """内部のリポジトリへ保存する。失敗した場合は待ち時間を倍にしながら再試行する"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.repository.save_chat_messages(user_id, session_id, messages)
+                return True
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    self.logger.error(f"Failed to write {len(messages)} chat messages for user_id={user_id}, session_id={session_id} after {attempt + 1} attempts: {str(e)}", exc_info=True)
+                    return False
+                self.logger.warning(f"Retrying chat message write for user_id={user_id}, session_id={session_id} (attempt {attempt + 1}): {str(e)}")
+                await asyncio.sleep(self.retry_delay * (2 ** attempt))
+        return False
+
+    async def _allocate_nos(self, user_id: str, session_id: str, count: int) -> int:
+        """セッションのnoをcount個連続で確保し、最後のnoを返す"""
+        key = (user_id, session_id)
+        if key not in self._last_nos:
+            # このプロセスで初めて書き込むセッションは内部のリポジトリの採番から確保する
+            # （保存済みの最後のnoから続けると、末尾のメッセージが削除されていた場合にそのnoを再利用してしまう）
+            last_no = await self.repository.reserve_nos(user_id, session_id, count)
+            # 確保を待つ間に同じセッションで採番が進んでいた場合は大きい方から続ける
+            self._last_nos[key] = max(self._last_nos.get(key, 0), last_no)
+            return last_no
+        self._last_nos[key] += count
+        return self._last_nos[key]
+
+    def _discard_unsaved(self, key: Tuple[str, str], deleted: Callable[[ChatMessage], bool]) -> None:
+        """削除したメッセージを書き込みの再試行の対象と書き込み前のメッセージから除く"""
+        unsaved = self._unsaved.pop(key, [])
+        messages = [message for message in unsaved if not deleted(message)]
+        if messages:
+            self._unsaved[key] = messages
+        self._discard_pending(key, {message.no for message in unsaved if deleted(message)})
+
+    def _forget(self, user_id: str, session_id: str) -> None:
+        """削除したセッションの採番と書き込めなかったメッセージを破棄する（次回の保存時に内部のリポジトリから確保し直す）"""
+        key = (user_id, session_id)
+        self._last_nos.pop(key, None)
+        self._discard_pending(key, {message.no for message in self._unsaved.pop(key, [])})
+
+    async def flush(self) -> None:
+        """キューに積まれている保存要求がすべて書き出されるまで待つ"""
+        if self._queue.empty() and not self._pending:
+            return
+        self._ensure_worker()
+        # 書き込めなかったメッセージを再試行する
+        for user_id, session_id in list(self._unsaved):
+            await self._queue.put((user_id, session_id, []))
+        await self._queue.join()
+
+    def stats(self) -> Dict[str, Any]:
+        """キューの状態と書き出し件数を返す"""
+        return {
+            "queued": self._queue.qsize(),
+            "pending_sessions": len(self._pending),
+            "pending_messages": sum(len(messages) for messages in self._pending.values()),
+            "unsaved_messages": sum(len(messages) for messages in self._unsaved.values()),
+            "flushed_messages": self._flushed,
+            "failed_messages": self._failed
+        }
+
+    async def initialize(self) -> None:
+        """内部のリポジトリを初期化し、書き出し用のバックグラウンドタスクを起動する"""
+        await self.repository.initialize()
+        self._ensure_worker()
+
+    async def health_check(self) -> bool:
+        """内部のリポジトリに接続できるかを返す"""
+        return await self.repository.health_check()
+
+    async def close(self) -> None:
+        """キューを書き出してからバックグラウンドタスクを止め、内部のリポジトリを閉じる"""
+        try:
+            await asyncio.wait_for(self.flush(), timeout=self.drain_timeout)
+            self.logger.info(f"Drained write-behind queue: {self.stats()}")
+        except asyncio.TimeoutError:
+            self.logger.error(f"Timed out draining write-behind queue: {self.stats()}")
+        for (user_id, session_id), messages in self._unsaved.items():
+            self.logger.error(f"Lost chat messages no={[message.no for message in messages]} for user_id={user_id}, session_id={session_id}")
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        await self.repository.close()
+
+    async def save_chat_message(self, user_id: str, session_id: str, message: ChatMessage) -> ChatMessage:
+        """チャットメッセージをキューに積み、no割り当て済みのChatMessageを返す"""
+        saved_messages = await self.save_chat_messages(user_id, session_id, [message])
+        return saved_messages[0]
+
+    async def save_chat_messages(self, user_id: str, session_id: str, messages: List[ChatMessage]) -> List[ChatMessage]:
+        """複数のチャットメッセージを連続したnoでキューに積み、no割り当て済みのChatMessageを順に返す"""
+        if not messages:
+            return []
+        try:
+            last_no = await self._allocate_nos(user_id, session_id, len(messages))
+            first_no = last_no - len(messages) + 1
+            messages_with_no = [
+                ChatMessage(no=first_no + i, role=message.role, content=message.content)
+                for i, message in enumerate(messages)
+            ]
+            self._ensure_worker()
+            # キューが一杯の場合は空くまで待つ（バックプレッシャー）
+            # 読み取り時のマージにはキューに積めたメッセージだけを登録する。待っている間にキャンセルされた場合
+            # （クライアントの切断・終了処理）に、書き出されないメッセージが履歴に表示され続けるのを防ぐ。
+            # putから戻って次にawaitするまでは書き出し用のタスクが動かないため、登録が書き出しより遅れることはない
+            await self._queue.put((user_id, session_id, messages_with_no))
+            self._pending.setdefault((user_id, session_id), []).extend(messages_with_no)
+            self.logger.info(f"Queued chat messages no={first_no}-{last_no} for user {user_id}, session {session_id}")
+            return messages_with_no
+        except Exception as e:
+            self.logger.error(f"Error queuing chat messages for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            raise
+
+    async def reserve_nos(self, user_id: str, session_id: str, count: int) -> int:
+        """セッションのnoをcount個連続で確保し、最後のnoを返す（書き込み前のメッセージと同じくプロセス内で採番する）"""
+        return await self._allocate_nos(user_id, session_id, count)
+
+    async def get_chat_messages(self, user_id: str, session_id: str, limit: Optional[int] = None, after_no: Optional[int] = None) -> List[ChatMessage]:
+        """保存済みのメッセージに書き込み前のメッセージをマージして返す"""
+        messages = list(await self.repository.get_chat_messages(user_id, session_id, limit=limit, after_no=after_no))
+        # 取得中に書き出されたメッセージと重複しないようnoで除外する
+        saved_nos = {message.no for message in messages}
+        messages.extend(
+            message for message in self._pending.get((user_id, session_id), [])
+            if message.no not in saved_nos and (after_no is None or message.no > after_no)
+        )
+        messages.sort(key=lambda message: message.no)
+        return messages[:limit] if limit is not None else messages
+
+    async def clear_chat_messages(self, user_id: str, session_id: str) -> None:
+        """キューを書き出してから全メッセージを削除する"""
+        await self.flush()
+        await self.repository.clear_chat_messages(user_id, session_id)
+        self._forget(user_id, session_id)
+
+    async def delete_chat_message_by_no(self, user_id: str, session_id: str, no: int) -> None:
+        """キューを書き出してから指定されたnoのメッセージを削除する"""
+        await self.flush()
+        await self.repository.delete_chat_message_by_no(user_id, session_id, no)
+        self._discard_unsaved((user_id, session_id), lambda message: message.no == no)
+
+    async def delete_sessions(self, user_id: str, session_ids: List[str]) -> int:
+        """キューを書き出してから複数のセッションを削除する"""
+        await self.flush()
+        deleted_count = await self.repository.delete_sessions(user_id, session_ids)
+        for session_id in session_ids:
+            self._forget(user_id, session_id)
+        return deleted_count
+
+    async def get_session_ids(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None) -> List[str]:
+        """保存済みのsession_idに書き込み前のセッションを加えて返す"""
+        session_ids = list(await self.repository.get_session_ids(user_id, limit=limit, after=after))
+        for pending_user_id, session_id in list(self._pending):
+            if pending_user_id == user_id and session_id not in session_ids and (after is None or session_id > after):
+                session_ids.append(session_id)
+        session_ids.sort()
+        return session_ids[:limit] if limit is not None else session_ids
+
+    async def delete_messages_from_no(self, user_id: str, session_id: str, no: int) -> None:
+        """キューを書き出してから指定されたno以降のメッセージを削除する"""
+        await self.flush()
+        await self.repository.delete_messages_from_no(user_id, session_id, no)
+        # 末尾を削除した場合は内部のリポジトリと同じく削除したnoから振り直す
+        key = (user_id, session_id)
+        self._discard_unsaved(key, lambda message: message.no >= no)
+        if key in self._last_nos:
+            self._last_nos[key] = min(self._last_nos[key], no - 1)
+
+    async def save_session_title(self, user_id: str, session_id: str, title: str) -> SessionTitle:
+        return await self.repository.save_session_title(user_id, session_id, title)
+
+    async def get_session_titles(self, user_id: str, limit: Optional[int] = None, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> List[SessionTitle]:
+        return await self.repository.get_session_titles(user_id, limit=limit, before=before, before_session_id=before_session_id)
+
+    async def update_session_title(self, user_id: str, session_id: str, title: str) -> SessionTitle:
+        return await self.repository.update_session_title(user_id, session_id, title)
+
+    async def delete_session_title(self, user_id: str, session_id: str) -> None:
+        await self.repository.delete_session_title(user_id, session_id)
+
+    async def get_session_summaries(self, user_id: str, limit: Optional[int] = None, before: Optional[datetime] = None, before_session_id: Optional[str] = None) -> List[SessionSummary]:
+        """
+        書き込み前のメッセージのあるセッションがあればキューを書き出してから、保存済みのセッション一覧を返す
+
+        書き込み前のメッセージを読み取り時にマージすると、そのセッションは更新日時が変わって一覧の先頭に移るが、
+        保存済みのサマリー（タイトル・作成日時）がない状態では正しく並べられず、後ろのページにも古い位置で残る。
+        そのためget_chat_messagesのようなマージはせず、内部のリポジトリの一覧に反映させてから読む。
+        """
+        if any(pending_user_id == user_id for pending_user_id, _ in list(self._pending)):
+            await self.flush()
+        return await self.repository.get_session_summaries(user_id, limit=limit, before=before, before_session_id=before_session_id)
+
+    async def get_history_summary(self, user_id: str, session_id: str) -> Optional[HistorySummary]:
+        return await self.repository.get_history_summary(user_id, session_id)
+
+    async def save_history_summary(self, user_id: str, session_id: str, summary: HistorySummary) -> None:
+        await self.repository.save_history_summary(user_id, session_id, summary)
@@ -1,11 +1,14 @@
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import List
+from contextlib import asynccontextmanager
 import os
 from routers import chat
 from dotenv import load_dotenv
 from containers import Container
+from chat import ChatManager
 from logging import getLogger
 
 # 環境変数の読み込み
@@ -23,13 +26,41 @@ except Exception as e:
     logger.error(f"Error initializing container: {str(e)}", exc_info=True)
     raise
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    アプリケーションのライフサイクル管理
+
+    起動時にChatManager（プロンプト・チェーン・リトリーバー）を一度だけ構築してウォームアップし、
+    全リクエストで共有する。終了時にリソースを解放する。
+    """
+    try:
+        chat_manager = ChatManager(container)
+        await chat_manager.warm_up()
+        app.state.chat_manager = chat_manager
+        logger.info("ChatManager initialized successfully")
+    except Exception as e:
+        logger.error(f"Error initializing ChatManager: {str(e)}", exc_info=True)
+        raise
+
+    try:
+        yield
+    finally:
+        try:
+            await chat_manager.close()
+            container.shutdown_resources()
+            logger.info("ChatManager shut down successfully")
+        except Exception as e:
+            logger.error(f"Error shutting down ChatManager: {str(e)}", exc_info=True)
+
 app = FastAPI(
     title="LocalRAG API",
     description="A local RAG (Retrieval-Augmented Generation) API using LangChain and Ollama",
     version="1.0.0",
     docs_url="/docs",
     redoc_url="/redoc",
-    debug=True
+    debug=True,
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -66,11 +97,23 @@ async def root():
 @app.get("/health")
 async def health_check():
     try:
+        # チャット履歴のリポジトリに接続できない場合はunhealthyとする
+        repository_healthy = await app.state.chat_manager.chat_repository.health_check()
+        if not repository_healthy:
+            return JSONResponse(status_code=503, content={"status": "unhealthy", "chat_repository": "unavailable"})
         return {"status": "healthy"}
     except Exception as e:
         logger.error(f"Error in health_check endpoint: {str(e)}", exc_info=True)
         raise
 
+@app.get("/metrics")
+async def metrics():
+    try:
+        return app.state.chat_manager.get_stats()
+    except Exception as e:
+        logger.error(f"Error in metrics endpoint: {str(e)}", exc_info=True)
+        raise
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
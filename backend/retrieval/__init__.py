@@ -0,0 +1,9 @@
+from .hyde import HydeQueryExpander, HYDE_MODES
+from .fusion import HydeFusionRetriever, reciprocal_rank_fusion
+from .answer_cache import SemanticAnswerCache
+from .chroma_async import AsyncChromaRetriever
+from .local_index import LocalVectorIndex
+from .local_retriever import LocalIndexRetriever
+from .options import RetrievalOptions, RetrievalFilter
+
+__all__ = ['HydeQueryExpander', 'HYDE_MODES', 'HydeFusionRetriever', 'reciprocal_rank_fusion', 'SemanticAnswerCache', 'AsyncChromaRetriever', 'LocalVectorIndex', 'LocalIndexRetriever', 'RetrievalOptions', 'RetrievalFilter']
@@ -0,0 +1,118 @@
+import time
+import asyncio
+import threading
+from logging import getLogger
+from typing import Any, Callable, Dict, Optional, Tuple
+import numpy as np
+from cachetools import TTLCache
+from langchain_core.embeddings import Embeddings
+from .hyde import normalize_query
+
+class SemanticAnswerCache:
+    """
+    意味的に近い質問に対して過去の回答を返すキャッシュ
+
+    質問文の埋め込みとキャッシュ済みの質問の埋め込みのコサイン類似度が閾値以上の場合に、
+    キャッシュ済みの回答を返す。エントリはLRU + TTLで破棄し、
+    ベクトルDBのコレクションのバージョンが変わった（再投入された）場合は全て破棄する。
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        version_provider: Callable[[], str],
+        threshold: float = 0.95,
+        max_entries: int = 1000,
+        ttl: int = 3600,
+        version_check_interval: float = 60.0
+    ):
+        """
+        Args:
+            embeddings: 質問文の埋め込みに使うモデル
+            version_provider: コレクションのバージョン（再投入で変わる値）を返す関数
+            threshold: キャッシュヒットとみなすコサイン類似度
+            max_entries: キャッシュする質問の最大件数
+            ttl: エントリの有効期間（秒）
+            version_check_interval: コレクションのバージョンを確認する間隔（秒）
+        """
+        self.logger = getLogger("uvicorn.app")
+        self.embeddings = embeddings
+        self.version_provider = version_provider
+        self.threshold = threshold
+        self.version_check_interval = version_check_interval
+        # 正規化した質問文 -> (正規化済みの埋め込み, 回答)
+        self._entries: TTLCache = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._version_checked_at = 0.0
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+    async def _check_version(self) -> None:
+        """コレクションのバージョンが変わっていればキャッシュを破棄する"""
+        now = time.monotonic()
+        if self._version is not None and now - self._version_checked_at < self.version_check_interval:
+            return
+        self._version_checked_at = now
+        try:
+            version = await asyncio.to_thread(self.version_provider)
+        except Exception as e:
+            # バージョンが確認できない場合は古い回答を返さないよう破棄する
+            self.logger.warning(f"Failed to check collection version, clearing answer cache: {str(e)}")
+            version = None
+        if version is None or version != self._version:
+            if self._version is not None:
+                self.logger.info(f"Collection version changed ({self._version} -> {version}), clearing answer cache")
+                self.clear()
+            self._version = version
+
+    async def lookup(self, question: str) -> Tuple[Optional[str], np.ndarray]:
+        """
+        意味的に近い質問の回答を探す
+
+        Returns:
+            Tuple[Optional[str], np.ndarray]: ヒットした回答（なければNone）と、store()に渡す質問文の埋め込み
+        """
+        await self._check_version()
+        vector = np.asarray(await self.embeddings.aembed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector = vector / norm
+
+        with self._lock:
+            entries = list(self._entries.items())
+            if entries:
+                matrix = np.stack([embedding for _, (embedding, _) in entries])
+                similarities = matrix @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    key, (_, answer) = entries[best]
+                    # 参照してLRUの順序を更新する（有効期限は延長しない）
+                    self._entries[key]
+                    self._stats["hits"] += 1
+                    self.logger.info(f"Answer cache hit (similarity={similarities[best]:.4f})")
+                    return answer, vector
+            self._stats["misses"] += 1
+        return None, vector
+
+    def store(self, question: str, embedding: np.ndarray, answer: str) -> None:
+        """質問と回答をキャッシュする"""
+        if self._version is None:
+            # バージョンが不明な間はキャッシュしない
+            return
+        with self._lock:
+            self._entries[normalize_query(question)] = (embedding, answer)
+            self._stats["stores"] += 1
+
+    def clear(self) -> None:
+        """全エントリを破棄する"""
+        with self._lock:
+            self._entries.clear()
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット数・ミス数を返す"""
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries), version=self._version)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
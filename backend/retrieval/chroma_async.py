@@ -0,0 +1,140 @@
+import asyncio
+import threading
+from logging import getLogger
+from typing import Any, Dict, List, Optional
+import chromadb
+import httpx
+from chromadb.config import Settings
+from pydantic import ConfigDict, Field, PrivateAttr
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from .options import RetrievalOptions, select_candidates, similarity_from_distance
+
+logger = getLogger("uvicorn.app")
+
+# 再試行する例外（接続エラー・タイムアウト）
+RETRYABLE_ERRORS = (asyncio.TimeoutError, httpx.TransportError, ConnectionError)
+
+class AsyncChromaRetriever(BaseRetriever):
+    """
+    chromadb.AsyncHttpClientでベクトル検索するリトリーバー
+
+    クライアントとコレクションは最初の検索（またはconnect）で1度だけ取得し、以降の検索では
+    同じHTTPコネクションプール（keep-alive）を再利用する。検索はイベントループをブロックしない。
+    1回の問い合わせごとにtimeout秒のタイムアウトを設け、接続エラー・タイムアウトは
+    指数バックオフでmax_retries回まで再試行する。
+    メタデータの絞り込みはwhere句としてサーバー側で適用し、スコアの閾値とMMRは取得した候補に適用する。
+    同期呼び出し（invoke）はsync_retrieverに委譲する（件数と絞り込みはsearch_kwargsとして渡す）。
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    host: str
+    """ChromaDBのホスト"""
+    port: int
+    """ChromaDBのポート"""
+    collection_name: str
+    """検索するコレクション名"""
+    embeddings: Embeddings
+    """クエリの埋め込みに使うモデル（ドキュメント投入時と同じもの）"""
+    options: RetrievalOptions = Field(default_factory=RetrievalOptions)
+    """検索オプションの既定値（呼び出し時にoptionsを渡した場合はそちらを使う）"""
+    timeout: float = 10.0
+    """問い合わせ1回あたりのタイムアウト（秒）"""
+    max_retries: int = 2
+    """接続エラー・タイムアウト時の再試行回数"""
+    retry_backoff: float = 0.2
+    """再試行までの待ち時間の初期値（秒、再試行ごとに2倍にする）"""
+    settings: Optional[Settings] = None
+    """クライアントの設定（keep-aliveの秒数・最大接続数など）"""
+    sync_retriever: Optional[BaseRetriever] = None
+    """同期呼び出しで使うリトリーバー"""
+
+    _collection: Any = PrivateAttr(default=None)
+    _space: str = PrivateAttr(default="l2")
+    _connect_lock: Optional[asyncio.Lock] = PrivateAttr(default=None)
+    _stats: Dict[str, int] = PrivateAttr(default_factory=lambda: {"requests": 0, "retries": 0, "timeouts": 0, "errors": 0})
+    _stats_lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def _count(self, name: str) -> None:
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """検索・再試行・タイムアウトの回数を返す"""
+        with self._stats_lock:
+            return dict(self._stats, connected=self._collection is not None)
+
+    async def connect(self) -> None:
+        """クライアントを作成してコレクションを取得する（取得済みの場合は何もしない）"""
+        if self._collection is not None:
+            return
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._collection is None:
+                client = await asyncio.wait_for(
+                    chromadb.AsyncHttpClient(host=self.host, port=self.port, settings=self.settings or Settings(anonymized_telemetry=False)),
+                    timeout=self.timeout
+                )
+                collection = await asyncio.wait_for(client.get_collection(self.collection_name), timeout=self.timeout)
+                # 距離をコサイン類似度に変換するため、コレクションの距離関数を保持する
+                self._space = (collection.metadata or {}).get("hnsw:space", "l2")
+                self._collection = collection
+                logger.info(f"Connected async Chroma client to {self.host}:{self.port}, collection={self.collection_name}")
+
+    async def _query(self, embedding: List[float], options: RetrievalOptions) -> Dict[str, Any]:
+        """コレクションに問い合わせる（接続エラー・タイムアウトは再試行する）"""
+        attempt = 0
+        while True:
+            try:
+                await self.connect()
+                return await asyncio.wait_for(
+                    self._collection.query(
+                        query_embeddings=[embedding],
+                        n_results=options.candidates,
+                        where=options.where(),
+                        include=["documents", "metadatas", "distances"] + (["embeddings"] if options.search_type == "mmr" else [])
+                    ),
+                    timeout=self.timeout
+                )
+            except RETRYABLE_ERRORS as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self._count("timeouts")
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self._count("retries")
+                delay = self.retry_backoff * (2 ** (attempt - 1))
+                logger.warning(f"Chroma query failed ({type(e).__name__}), retrying in {delay:.2f}s (attempt {attempt})")
+                await asyncio.sleep(delay)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun, options: Optional[RetrievalOptions] = None) -> List[Document]:
+        self._count("requests")
+        options = options or self.options
+        try:
+            embedding = await self.embeddings.aembed_query(query)
+            result = await self._query(embedding, options)
+        except Exception as e:
+            self._count("errors")
+            logger.error(f"Error in async Chroma retrieval: {str(e)}", exc_info=True)
+            raise
+        scores = [similarity_from_distance(distance, self._space) for distance in result["distances"][0]]
+        embeddings = result["embeddings"][0] if options.search_type == "mmr" else None
+        return [
+            Document(id=result["ids"][0][i], page_content=result["documents"][0][i] or "", metadata=result["metadatas"][0][i] or {})
+            for i in select_candidates(embedding, scores, embeddings, options)
+        ]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun, options: Optional[RetrievalOptions] = None) -> List[Document]:
+        if self.sync_retriever is None:
+            raise NotImplementedError("AsyncChromaRetriever supports only async invocation without sync_retriever")
+        # 検索方法（MMR・スコアの閾値）はsync_retriever作成時のものを使い、件数と絞り込みだけを上書きする
+        kwargs: Dict[str, Any] = {}
+        if options is not None:
+            kwargs["k"] = options.k
+            if options.where() is not None:
+                kwargs["filter"] = options.where()
+        return self.sync_retriever.invoke(query, config={"callbacks": run_manager.get_child()}, **kwargs)
@@ -0,0 +1,216 @@
+import os
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from array import array
+from logging import getLogger
+from typing import Any, Dict, List, Optional
+from cachetools import LRUCache
+from langchain_core.embeddings import Embeddings
+
+class SQLiteEmbeddingStore:
+    """
+    埋め込みベクトルをSQLiteに永続化するストア
+
+    キーはモデル名とテキストのハッシュ、値はfloat32のバイト列として保存する。
+    max_rowsを指定した場合は保存のたびに古く保存されたものから削除し、ファイルが際限なく大きくならないようにする。
+    """
+
+    def __init__(self, path: str, max_rows: int = 0):
+        """
+        Args:
+            path: SQLiteファイルのパス
+            max_rows: 保存する最大件数（0以下の場合は無制限）
+        """
+        self.max_rows = max_rows
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """キーに対応するベクトルを取得する（存在しないキーは含まない）"""
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            # SQLiteのパラメータ数上限を超えないよう分割して問い合わせる
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk)
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        """ベクトルを保存する"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items.items()]
+            )
+            if self.max_rows > 0:
+                # rowidは保存順に増えるため、最新のmax_rows件より前に保存されたものを削除する
+                # （置き換えたキーは新しいrowidになる。削除済みのrowidの分だけ残る件数はmax_rowsより少なくなる）
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid <= (SELECT MAX(rowid) FROM embeddings) - ?",
+                    (self.max_rows,)
+                )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+class CachedEmbeddings(Embeddings):
+    """
+    埋め込みモデルの前段に置くキャッシュ
+
+    プロセス内のLRUキャッシュと、任意でディスク上のストアを参照し、
+    ヒットしなかったテキストのみをラップした埋め込みモデルに問い合わせる。
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, max_entries: int = 10000, store: Optional[SQLiteEmbeddingStore] = None):
+        """
+        Args:
+            embeddings: ラップする埋め込みモデル
+            model_name: キャッシュキーに含めるモデル名（モデル変更時に別キーとなる）
+            max_entries: プロセス内キャッシュの最大件数
+            store: ディスク上のストア（Noneの場合はプロセス内キャッシュのみ）
+        """
+        self.logger = getLogger("uvicorn.app")
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.store = store
+        self._memory = LRUCache(maxsize=max_entries)
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "store_hits": 0, "misses": 0}
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup_memory(self, texts: List[str]):
+        """プロセス内キャッシュのベクトルと、ストアを参照する必要があるキーを返す"""
+        keys = [self._key(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    found[key] = self._memory[key]
+                    self._stats["memory_hits"] += 1
+        remaining = [key for key in dict.fromkeys(keys) if key not in found]
+        return keys, found, remaining
+
+    def _cache_stored(self, stored: Dict[str, List[float]]) -> Dict[str, List[float]]:
+        """ストアから読んだベクトルをプロセス内キャッシュに載せる"""
+        with self._lock:
+            for key, vector in stored.items():
+                self._memory[key] = vector
+            self._stats["store_hits"] += len(stored)
+        return stored
+
+    def _lookup(self, texts: List[str]):
+        """キャッシュ済みのベクトルと、埋め込みが必要なテキストのキーを返す"""
+        keys, found, remaining = self._lookup_memory(texts)
+        if remaining and self.store is not None:
+            found.update(self._cache_stored(self.store.get_many(remaining)))
+        return keys, found
+
+    async def _alookup(self, texts: List[str]):
+        """_lookupの非同期版（ストアの読み込みはスレッドで行い、イベントループを止めない）"""
+        keys, found, remaining = self._lookup_memory(texts)
+        if remaining and self.store is not None:
+            found.update(self._cache_stored(await asyncio.to_thread(self.store.get_many, remaining)))
+        return keys, found
+
+    def _missing(self, texts: List[str], keys: List[str], found: Dict[str, List[float]]) -> Dict[str, str]:
+        """埋め込みが必要なテキスト（キー -> テキスト）を返す"""
+        return {key: text for key, text in zip(keys, texts) if key not in found}
+
+    def _remember_memory(self, vectors: Dict[str, List[float]]) -> None:
+        with self._lock:
+            for key, vector in vectors.items():
+                self._memory[key] = vector
+            self._stats["misses"] += len(vectors)
+
+    def _remember(self, vectors: Dict[str, List[float]]) -> None:
+        self._remember_memory(vectors)
+        if self.store is not None and vectors:
+            self.store.put_many(vectors)
+
+    async def _aremember(self, vectors: Dict[str, List[float]]) -> None:
+        """_rememberの非同期版（ストアへの書き込みはスレッドで行い、イベントループを止めない）"""
+        self._remember_memory(vectors)
+        if self.store is not None and vectors:
+            await asyncio.to_thread(self.store.put_many, vectors)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found = self._lookup(texts)
+        missing = self._missing(texts, keys, found)
+        if missing:
+            vectors = dict(zip(missing.keys(), self.embeddings.embed_documents(list(missing.values()))))
+            self._remember(vectors)
+            found.update(vectors)
+        return [found[key] for key in keys]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found = await self._alookup(texts)
+        missing = self._missing(texts, keys, found)
+        if missing:
+            vectors = dict(zip(missing.keys(), await self.embeddings.aembed_documents(list(missing.values()))))
+            await self._aremember(vectors)
+            found.update(vectors)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        keys, found = self._lookup([text])
+        if keys[0] not in found:
+            vector = self.embeddings.embed_query(text)
+            self._remember({keys[0]: vector})
+            return vector
+        return found[keys[0]]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        keys, found = await self._alookup([text])
+        if keys[0] not in found:
+            vector = await self.embeddings.aembed_query(text)
+            await self._aremember({keys[0]: vector})
+            return vector
+        return found[keys[0]]
+
+    def stats(self) -> Dict[str, Any]:
+        """キャッシュのヒット数・ミス数を返す"""
+        with self._lock:
+            stats = dict(self._stats, memory_size=len(self._memory))
+        lookups = stats["memory_hits"] + stats["store_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["store_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def close(self) -> None:
+        if self.store is not None:
+            self.store.close()
+
+def create_cached_embeddings(
+    embeddings: Embeddings,
+    model_name: str,
+    max_entries: int = 10000,
+    store_path: Optional[str] = None,
+    store_max_rows: int = 0
+) -> CachedEmbeddings:
+    """
+    埋め込みモデルをキャッシュでラップする
+
+    Args:
+        embeddings: ラップする埋め込みモデル
+        model_name: キャッシュキーに含めるモデル名
+        max_entries: プロセス内キャッシュの最大件数
+        store_path: SQLiteストアのパス（空の場合はディスクに保存しない）
+        store_max_rows: SQLiteストアに保存する最大件数（0以下の場合は無制限）
+    """
+    store = SQLiteEmbeddingStore(store_path, max_rows=store_max_rows) if store_path else None
+    return CachedEmbeddings(embeddings, model_name, max_entries=max_entries, store=store)
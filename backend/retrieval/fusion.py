@@ -0,0 +1,145 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from logging import getLogger
+from typing import Any, Dict, List, Optional, Set
+from pydantic import ConfigDict, PrivateAttr
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from .hyde import HydeQueryExpander
+from .options import RetrievalOptions
+
+logger = getLogger("uvicorn.app")
+
+def _document_key(doc: Document) -> str:
+    """同一ドキュメントを判定するキー（IDがなければ本文）"""
+    return doc.id or doc.page_content
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int = 60) -> List[Document]:
+    """
+    複数の検索結果をReciprocal Rank Fusionで統合する
+
+    Args:
+        rankings: 検索結果のリスト（それぞれ関連度の高い順）
+        k: 順位の平滑化定数
+
+    Returns:
+        統合スコアの高い順に並べたドキュメント
+    """
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = _document_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+class HydeFusionRetriever(BaseRetriever):
+    """
+    質問文による検索とHyDE（仮想回答）による検索を並行実行し、RRFで統合するリトリーバー
+
+    質問文の検索はすぐに開始し、HyDEの検索（仮想回答の生成を含む）が
+    hyde_timeout 秒以内に終わらない場合は質問文の検索結果のみを返す。
+    呼び出し時にoptions（RetrievalOptions）を渡した場合は両方の検索に渡し、統合後の件数にはoptions.kを使う。
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    retriever: BaseRetriever
+    """ベクトル検索に使うリトリーバー"""
+    expander: HydeQueryExpander
+    """仮想回答を生成するHyDEステージ"""
+    hyde_timeout: Optional[float] = None
+    """HyDE検索を待つ時間（秒）。Noneの場合は常に待つ"""
+    rrf_k: int = 60
+    """RRFの平滑化定数"""
+    k: int = 4
+    """返却するドキュメント数"""
+
+    _stats: Dict[str, int] = PrivateAttr(default_factory=lambda: {"requests": 0, "fused": 0, "hyde_skipped": 0, "hyde_timeouts": 0, "hyde_errors": 0})
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _pending: Set[asyncio.Task] = PrivateAttr(default_factory=set)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """統合・タイムアウトの発生回数を返す"""
+        with self._lock:
+            return dict(self._stats, hyde_timeout=self.hyde_timeout)
+
+    def _fuse(self, raw_docs: List[Document], hyde_docs: List[Document], k: int) -> List[Document]:
+        self._count("fused")
+        return reciprocal_rank_fusion([hyde_docs, raw_docs], k=self.rrf_k)[:k]
+
+    @staticmethod
+    def _search_kwargs(options: Optional[RetrievalOptions]) -> Dict[str, Any]:
+        """内側のリトリーバーに渡す引数（optionsを指定しない場合は内側の既定値を使う）"""
+        return {"options": options} if options is not None else {}
+
+    async def _ahyde_search(self, query: str, run_manager: AsyncCallbackManagerForRetrieverRun, options: Optional[RetrievalOptions]) -> List[Document]:
+        hypothetical = await self.expander.aexpand(query)
+        return await self.retriever.ainvoke(hypothetical, config={"callbacks": run_manager.get_child("hyde")}, **self._search_kwargs(options))
+
+    def _hyde_search(self, query: str, run_manager: CallbackManagerForRetrieverRun, options: Optional[RetrievalOptions]) -> List[Document]:
+        hypothetical = self.expander.expand(query)
+        return self.retriever.invoke(hypothetical, config={"callbacks": run_manager.get_child("hyde")}, **self._search_kwargs(options))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun, options: Optional[RetrievalOptions] = None) -> List[Document]:
+        self._count("requests")
+        k = options.k if options is not None else self.k
+        if not self.expander.should_expand(query):
+            self._count("hyde_skipped")
+            return (await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child("raw")}, **self._search_kwargs(options)))[:k]
+
+        start = time.perf_counter()
+        hyde_task = asyncio.create_task(self._ahyde_search(query, run_manager, options))
+        # タイムアウト後もHyDEの結果をキャッシュに残すため、タスクの参照を保持しておく
+        self._pending.add(hyde_task)
+        hyde_task.add_done_callback(self._pending.discard)
+        raw_docs = await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child("raw")}, **self._search_kwargs(options))
+
+        try:
+            timeout = None if self.hyde_timeout is None else max(self.hyde_timeout - (time.perf_counter() - start), 0.0)
+            hyde_docs = await asyncio.wait_for(asyncio.shield(hyde_task), timeout=timeout)
+        except asyncio.TimeoutError:
+            self._count("hyde_timeouts")
+            logger.info(f"HyDE retrieval exceeded {self.hyde_timeout}s, returning raw query results")
+            return raw_docs[:k]
+        except Exception as e:
+            self._count("hyde_errors")
+            logger.warning(f"HyDE retrieval failed, returning raw query results: {str(e)}")
+            return raw_docs[:k]
+        return self._fuse(raw_docs, hyde_docs, k)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun, options: Optional[RetrievalOptions] = None) -> List[Document]:
+        self._count("requests")
+        k = options.k if options is not None else self.k
+        if not self.expander.should_expand(query):
+            self._count("hyde_skipped")
+            return self.retriever.invoke(query, config={"callbacks": run_manager.get_child("raw")}, **self._search_kwargs(options))[:k]
+
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            hyde_future = executor.submit(self._hyde_search, query, run_manager, options)
+            raw_docs = self.retriever.invoke(query, config={"callbacks": run_manager.get_child("raw")}, **self._search_kwargs(options))
+            try:
+                timeout = None if self.hyde_timeout is None else max(self.hyde_timeout - (time.perf_counter() - start), 0.0)
+                hyde_docs = hyde_future.result(timeout=timeout)
+            except FutureTimeoutError:
+                self._count("hyde_timeouts")
+                logger.info(f"HyDE retrieval exceeded {self.hyde_timeout}s, returning raw query results")
+                return raw_docs[:k]
+            except Exception as e:
+                self._count("hyde_errors")
+                logger.warning(f"HyDE retrieval failed, returning raw query results: {str(e)}")
+                return raw_docs[:k]
+            return self._fuse(raw_docs, hyde_docs, k)
+        finally:
+            # タイムアウトした場合もHyDE側の完了は待たずに戻る
+            executor.shutdown(wait=False)
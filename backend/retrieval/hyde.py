@@ -0,0 +1,129 @@
+import re
+import time
+import threading
+import unicodedata
+from logging import getLogger
+from typing import Any, Dict
+from cachetools import TTLCache
+from langchain_core.runnables import Runnable, RunnableLambda
+
+# HyDEステージの動作モード
+# - on: 常に仮想回答を生成して検索クエリとする
+# - off: 仮想回答を生成せず、質問文をそのまま検索クエリとする
+# - adaptive: 短い質問やキーワードの羅列は質問文をそのまま使い、それ以外は仮想回答を生成する
+HYDE_MODES = ("on", "off", "adaptive")
+
+# 文として扱う句読点・疑問符
+_SENTENCE_MARKS = re.compile(r"[。．、，？！?!.,]")
+
+def normalize_query(query: str) -> str:
+    """キャッシュキー用に質問文を正規化する（全角半角・大文字小文字・空白・末尾の記号を揃える）"""
+    normalized = unicodedata.normalize("NFKC", query).lower()
+    normalized = re.sub(r"\s+", " ", normalized).strip()
+    return normalized.rstrip("。．？！?!. ")
+
+class HydeQueryExpander:
+    """
+    HyDE（Hypothetical Document Embeddings）による検索クエリ拡張ステージ
+
+    質問文から仮想回答を生成して検索クエリとする。生成結果は正規化した質問文をキーに
+    LRU/TTLキャッシュへ保存し、同じ質問ではLLM呼び出しを省略する。
+    """
+
+    def __init__(
+        self,
+        hypothetical_chain: Runnable,
+        mode: str = "on",
+        cache_size: int = 1024,
+        cache_ttl: int = 3600,
+        adaptive_min_chars: int = 12
+    ):
+        """
+        Args:
+            hypothetical_chain: {"input": 質問文} を受け取り仮想回答（str）を返すチェーン
+            mode: 動作モード ("on", "off", "adaptive")
+            cache_size: キャッシュする仮想回答の最大件数（0でキャッシュ無効）
+            cache_ttl: キャッシュの有効期間（秒）
+            adaptive_min_chars: adaptiveモードで仮想回答を生成する最小文字数
+        """
+        if mode not in HYDE_MODES:
+            raise ValueError(f"Unknown HyDE mode: {mode}")
+        self.logger = getLogger("uvicorn.app")
+        self.hypothetical_chain = hypothetical_chain
+        self.mode = mode
+        self.adaptive_min_chars = adaptive_min_chars
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl) if cache_size > 0 else None
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "skipped": 0, "cache_hits": 0, "cache_misses": 0, "llm_seconds": 0.0}
+
+    def should_expand(self, query: str) -> bool:
+        """質問文に対して仮想回答を生成するかどうかを判定する"""
+        if self.mode == "off":
+            return False
+        if self.mode == "on":
+            return True
+        normalized = normalize_query(query)
+        if len(normalized) < self.adaptive_min_chars:
+            return False
+        # 句読点を含まない空白区切りの短い語の並びはキーワード検索とみなす
+        tokens = normalized.split(" ")
+        if len(tokens) > 1 and not _SENTENCE_MARKS.search(normalized) and all(len(t) <= 15 for t in tokens):
+            return False
+        return True
+
+    def _lookup(self, query: str):
+        """キャッシュを参照する。仮想回答を生成しない場合は質問文をそのまま返す"""
+        with self._lock:
+            self._stats["requests"] += 1
+            if not self.should_expand(query):
+                self._stats["skipped"] += 1
+                return query, None
+            key = normalize_query(query)
+            if self._cache is not None and key in self._cache:
+                self._stats["cache_hits"] += 1
+                return self._cache[key], None
+            self._stats["cache_misses"] += 1
+            return None, key
+
+    def _store(self, key: str, hypothetical: str, elapsed: float) -> None:
+        with self._lock:
+            self._stats["llm_seconds"] += elapsed
+            if self._cache is not None:
+                self._cache[key] = hypothetical
+
+    def expand(self, query: str) -> str:
+        """検索に使うクエリを返す"""
+        cached, key = self._lookup(query)
+        if cached is not None:
+            return cached
+        start = time.perf_counter()
+        hypothetical = self.hypothetical_chain.invoke({"input": query})
+        self._store(key, hypothetical, time.perf_counter() - start)
+        return hypothetical
+
+    async def aexpand(self, query: str) -> str:
+        """検索に使うクエリを返す（非同期版）"""
+        cached, key = self._lookup(query)
+        if cached is not None:
+            return cached
+        start = time.perf_counter()
+        hypothetical = await self.hypothetical_chain.ainvoke({"input": query})
+        self._store(key, hypothetical, time.perf_counter() - start)
+        return hypothetical
+
+    def as_runnable(self) -> Runnable:
+        """質問文（str）を受け取り検索クエリ（str）を返すRunnableとして公開する"""
+        return RunnableLambda(self.expand, afunc=self.aexpand, name="HydeQueryExpander")
+
+    def stats(self) -> Dict[str, Any]:
+        """キャッシュヒット率と省略できたLLM呼び出しの推定時間を返す"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cache_size"] = len(self._cache) if self._cache is not None else 0
+        lookups = stats["cache_hits"] + stats["cache_misses"]
+        stats["mode"] = self.mode
+        stats["hit_rate"] = stats["cache_hits"] / lookups if lookups else 0.0
+        avg_llm_seconds = stats["llm_seconds"] / stats["cache_misses"] if stats["cache_misses"] else 0.0
+        # キャッシュヒットとスキップで省略できたLLM呼び出し時間の推定値
+        stats["saved_seconds"] = (stats["cache_hits"] + stats["skipped"]) * avg_llm_seconds
+        return stats
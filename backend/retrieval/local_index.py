@@ -0,0 +1,253 @@
+"""
+Chromaサーバーを使わないプロセス内のベクトルインデックス
+
+コレクションの埋め込みを正規化したfloat32（またはint8に量子化した）NumPy行列として保持し、
+クエリとの内積（コサイン類似度）をブロックごとにベクトル演算してtop-kを求める。
+行列はメモリマップで開くこともでき、その場合はOSのページキャッシュに載った分だけメモリを使う。
+
+スナップショットは次のファイルからなるディレクトリ:
+    meta.json       コレクション名・件数・次元数・量子化の有無・作成日時
+    vectors.npy     (件数, 次元数) の float32 または int8 の行列（行ごとに正規化済み）
+    scales.npy      int8の場合の行ごとのスケール（float32）
+    records.jsonl   1行1件の {"id", "document", "metadata"}
+    offsets.npy     records.jsonl の各行の開始位置（int64、検索結果の行だけを読むため）
+
+既存のChromaコレクションからスナップショットを作る（backendディレクトリで実行）:
+    python -m retrieval.local_index --host localhost --port 8001 --collection gcas_azure_guide_openai --output data/local_index
+"""
+import argparse
+import json
+import os
+import threading
+from datetime import datetime
+from logging import getLogger
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+logger = getLogger("uvicorn.app")
+
+# 1回の行列演算で扱う行数（int8のfloat32への変換やメモリマップの読み込みをこの単位に抑える）
+BLOCK_ROWS = 65536
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """行ごとにL2正規化したfloat32の行列を返す（ゼロベクトルはそのまま）"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """行ごとの対称スケールでint8に量子化し、(int8の行列, スケール) を返す"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+class SnapshotWriter:
+    """
+    スナップショットをブロック単位で書き出す
+
+    件数を先に指定し、ベクトルはメモリマップしたvectors.npyへ直接書き込むため、
+    コレクション全体をメモリに載せずに作成できる。
+    """
+
+    def __init__(self, path: str, count: int, dimension: int, collection_name: str = "", quantize: bool = False):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.count = count
+        self.dimension = dimension
+        self.collection_name = collection_name
+        self.quantize = quantize
+        self._vectors = np.lib.format.open_memmap(
+            os.path.join(path, "vectors.npy"), mode="w+", dtype=np.int8 if quantize else np.float32, shape=(count, dimension)
+        )
+        self._scales = np.ones(count, dtype=np.float32)
+        self._offsets = np.zeros(count, dtype=np.int64)
+        self._records = open(os.path.join(path, "records.jsonl"), "wb")
+        self._written = 0
+
+    def add(self, ids: List[str], embeddings: Iterable[Iterable[float]], documents: List[Optional[str]], metadatas: List[Optional[Dict[str, Any]]]) -> None:
+        """ブロック分のレコードを追加する"""
+        vectors = _normalize(np.asarray(list(embeddings), dtype=np.float32))
+        start, stop = self._written, self._written + len(ids)
+        if stop > self.count:
+            raise ValueError(f"Snapshot was created for {self.count} records, got {stop}")
+        if self.quantize:
+            self._vectors[start:stop], self._scales[start:stop] = quantize_int8(vectors)
+        else:
+            self._vectors[start:stop] = vectors
+        for i, (record_id, document, metadata) in enumerate(zip(ids, documents, metadatas)):
+            self._offsets[start + i] = self._records.tell()
+            line = json.dumps({"id": record_id, "document": document or "", "metadata": metadata or {}}, ensure_ascii=False)
+            self._records.write(line.encode("utf-8") + b"\n")
+        self._written = stop
+
+    def close(self) -> Dict[str, Any]:
+        """残りのファイルを書き出し、meta.jsonの内容を返す"""
+        if self._written != self.count:
+            raise ValueError(f"Snapshot expects {self.count} records, wrote {self._written}")
+        self._records.close()
+        self._vectors.flush()
+        del self._vectors
+        np.save(os.path.join(self.path, "offsets.npy"), self._offsets)
+        if self.quantize:
+            np.save(os.path.join(self.path, "scales.npy"), self._scales)
+        meta = {
+            "collection_name": self.collection_name,
+            "count": self.count,
+            "dimension": self.dimension,
+            "quantization": "int8" if self.quantize else "float32",
+            "created_at": datetime.utcnow().isoformat()
+        }
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        return meta
+
+class LocalVectorIndex:
+    """スナップショットを読み込み、コサイン類似度のtop-k検索を行うインデックス"""
+
+    def __init__(self, path: str, mmap: bool = False):
+        """
+        Args:
+            path: スナップショットのディレクトリ
+            mmap: ベクトルの行列をメモリマップで開く（Falseの場合はすべてメモリに読み込む）
+        """
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta: Dict[str, Any] = json.load(f)
+        self.vectors: np.ndarray = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None)
+        self.scales: Optional[np.ndarray] = None
+        if self.vectors.dtype == np.int8:
+            self.scales = np.load(os.path.join(path, "scales.npy"))
+        self.offsets: np.ndarray = np.load(os.path.join(path, "offsets.npy"))
+        # 検索結果の行を読むためのファイル（読み込みはスレッド間で排他する）
+        self._records = open(os.path.join(path, "records.jsonl"), "rb")
+        self._records_lock = threading.Lock()
+        self._columns: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def version(self) -> str:
+        """スナップショットのバージョン（作り直すと変わる）"""
+        return f"{self.meta.get('created_at')}:{len(self)}"
+
+    def search(self, embedding: Iterable[float], k: int = 4, mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        クエリの埋め込みに近い順に (行番号, コサイン類似度) をk件まで返す
+
+        Args:
+            embedding: クエリの埋め込み
+            k: 返却する件数
+            mask: 検索対象の行をTrueとした配列（Noneの場合はすべての行）
+        """
+        if len(self) == 0 or k <= 0:
+            return []
+        query = _normalize(np.asarray(embedding, dtype=np.float32)[None, :])[0]
+        k = min(k, len(self))
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(self), BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, len(self))
+            if mask is not None and not mask[start:stop].any():
+                continue
+            block = self.vectors[start:stop]
+            scores = block.astype(np.float32, copy=False) @ query
+            if self.scales is not None:
+                scores *= self.scales[start:stop]
+            if mask is not None:
+                scores[~mask[start:stop]] = -np.inf
+            # ブロック内の上位k件だけを候補に残す
+            if len(scores) > k:
+                top = np.argpartition(scores, -k)[-k:]
+            else:
+                top = np.arange(len(scores))
+            best_rows = np.concatenate([best_rows, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_scores) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        order = np.argsort(-best_scores)
+        return [(int(best_rows[i]), float(best_scores[i])) for i in order if np.isfinite(best_scores[i])]
+
+    def embeddings(self, rows: List[int]) -> np.ndarray:
+        """行番号の埋め込み（正規化済み、int8の場合はスケールを戻した近似値）を返す"""
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows][:, None]
+        return vectors
+
+    def metadata_column(self, name: str) -> np.ndarray:
+        """
+        全行のメタデータのフィールドを配列で返す（絞り込み用。初回にrecords.jsonlを走査してキャッシュする）
+
+        値がすべて数値（または欠損）の場合は欠損をNaNとしたfloat64、それ以外は欠損をNoneとしたobjectの配列を返す。
+        """
+        with self._records_lock:
+            column = self._columns.get(name)
+            if column is not None:
+                return column
+            values = []
+            with open(os.path.join(self.path, "records.jsonl"), "rb") as f:
+                for line in f:
+                    values.append(json.loads(line)["metadata"].get(name))
+            present = [v for v in values if v is not None]
+            if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+                column = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            else:
+                column = np.empty(len(values), dtype=object)
+                column[:] = values
+            self._columns[name] = column
+            return column
+
+    def record(self, row: int) -> Dict[str, Any]:
+        """行番号のレコード（id, document, metadata）を返す"""
+        with self._records_lock:
+            self._records.seek(int(self.offsets[row]))
+            return json.loads(self._records.readline())
+
+    def close(self) -> None:
+        self._records.close()
+
+def export_collection(collection, output: str, quantize: bool = False, batch_size: int = 1000) -> Dict[str, Any]:
+    """
+    Chromaのコレクションをスナップショットに書き出し、meta.jsonの内容を返す
+
+    Args:
+        collection: chromadbのコレクション
+        output: 出力先のディレクトリ
+        quantize: ベクトルをint8に量子化する
+        batch_size: 1回のgetで読み込む件数
+    """
+    count = collection.count()
+    writer = None
+    for offset in range(0, count, batch_size):
+        batch = collection.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+        if writer is None:
+            writer = SnapshotWriter(output, count, len(batch["embeddings"][0]), collection_name=collection.name, quantize=quantize)
+        writer.add(batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"])
+        logger.info(f"Exported {min(offset + batch_size, count)}/{count} records from {collection.name}")
+    if writer is None:
+        raise ValueError(f"Collection {collection.name} is empty")
+    return writer.close()
+
+def main() -> None:
+    import chromadb
+    from chromadb.config import Settings
+
+    parser = argparse.ArgumentParser(description="Snapshot a Chroma collection into a local NumPy vector index")
+    parser.add_argument("--host", default=os.getenv("CHROMA_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("CHROMA_PORT", "8001")))
+    parser.add_argument("--collection", default=os.getenv("CHROMA_COLLECTION_NAME", "gcas_azure_guide_openai"))
+    parser.add_argument("--output", default=os.getenv("LOCAL_INDEX_PATH", "data/local_index"))
+    parser.add_argument("--quantize", action="store_true", help="Store vectors as int8 with per-row scales")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    client = chromadb.HttpClient(host=args.host, port=args.port, settings=Settings(anonymized_telemetry=False))
+    meta = export_collection(client.get_collection(args.collection), args.output, quantize=args.quantize, batch_size=args.batch_size)
+    print(json.dumps(meta, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional
+from pydantic import ConfigDict, Field, PrivateAttr
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from .local_index import LocalVectorIndex
+from .options import RetrievalOptions, select_candidates
+
+class LocalIndexRetriever(BaseRetriever):
+    """
+    LocalVectorIndexで検索するリトリーバー
+
+    クエリを埋め込み、プロセス内でtop-kを求める。非同期呼び出しでは行列演算をスレッドで実行し、
+    イベントループをブロックしない（NumPyの行列演算はGILを解放する）。
+    メタデータの絞り込みはマスクとして検索時に適用し、条件を満たす行だけからtop-kを求める。
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: LocalVectorIndex
+    """検索するインデックス"""
+    embeddings: Embeddings
+    """クエリの埋め込みに使うモデル（スナップショットを作成したコレクションと同じもの）"""
+    options: RetrievalOptions = Field(default_factory=RetrievalOptions)
+    """検索オプションの既定値（呼び出し時にoptionsを渡した場合はそちらを使う）"""
+
+    _stats: Dict[str, int] = PrivateAttr(default_factory=lambda: {"requests": 0, "filtered": 0})
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def stats(self) -> Dict[str, Any]:
+        """検索回数とインデックスの件数・量子化の有無を返す"""
+        with self._lock:
+            return dict(self._stats, count=len(self.index), quantization=self.index.meta.get("quantization"))
+
+    def _search(self, embedding: List[float], options: RetrievalOptions) -> List[Document]:
+        mask = options.filter.to_mask(self.index.metadata_column) if options.filter is not None else None
+        with self._lock:
+            self._stats["requests"] += 1
+            if mask is not None:
+                self._stats["filtered"] += 1
+        results = self.index.search(embedding, options.candidates, mask=mask)
+        rows = [row for row, _ in results]
+        vectors = self.index.embeddings(rows) if options.search_type == "mmr" and rows else None
+        documents = []
+        for i in select_candidates(embedding, [score for _, score in results], vectors, options):
+            record = self.index.record(rows[i])
+            documents.append(Document(id=record["id"], page_content=record["document"], metadata=record["metadata"]))
+        return documents
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun, options: Optional[RetrievalOptions] = None) -> List[Document]:
+        embedding = await self.embeddings.aembed_query(query)
+        return await asyncio.to_thread(self._search, embedding, options or self.options)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun, options: Optional[RetrievalOptions] = None) -> List[Document]:
+        return self._search(self.embeddings.embed_query(query), options or self.options)
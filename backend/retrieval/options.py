@@ -0,0 +1,154 @@
+"""
+ベクトル検索のオプション（件数・スコアの閾値・MMR・メタデータによる絞り込み）
+
+設定ファイルの既定値とリクエストごとの指定をRetrievalOptionsで表し、ChromaDBとローカルインデックスの
+どちらのバックエンドでも同じ意味で適用する。
+- スコアはコサイン類似度（1に近いほど類似）で、score_threshold未満の候補を除く
+- メタデータの絞り込みは検索時にバックエンド側で行い（Chromaはwhere、ローカルインデックスはマスク）、
+  候補を減らしてからtop-kを求める
+- MMRは fetch_k 件の候補から多様性を考慮して k 件を選ぶ
+"""
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Literal, Optional, Sequence
+import numpy as np
+from pydantic import BaseModel, Field
+from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+def to_timestamp(value: datetime) -> int:
+    """日時をUNIX時間（秒）に変換する（タイムゾーンがない場合はUTCとみなす）"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+def similarity_from_distance(distance: float, space: str = "l2") -> float:
+    """
+    Chromaの距離をコサイン類似度に変換する（埋め込みは正規化済みとみなす）
+
+    Args:
+        distance: Chromaが返す距離
+        space: コレクションの距離関数（hnsw:space。l2は二乗距離）
+    """
+    if space == "l2":
+        return 1.0 - distance / 2.0
+    return 1.0 - distance
+
+class RetrievalFilter(BaseModel):
+    """
+    メタデータによる検索対象の絞り込み
+
+    create_documentsがチャンクに書き込むフィールド（url, title, last_modified_ts）を条件にする。
+    指定した条件はすべて満たす必要がある（AND）。
+    """
+    urls: Optional[List[str]] = None
+    """ページのURL（いずれかに一致）"""
+    titles: Optional[List[str]] = None
+    """ページのタイトル（いずれかに一致）"""
+    modified_after: Optional[datetime] = None
+    """この日時以降に更新されたページ"""
+    modified_before: Optional[datetime] = None
+    """この日時より前に更新されたページ"""
+
+    def to_where(self) -> Optional[Dict[str, Any]]:
+        """Chromaのwhere句を返す（条件がない場合はNone）"""
+        conditions: List[Dict[str, Any]] = []
+        if self.urls:
+            conditions.append({"url": {"$in": self.urls}})
+        if self.titles:
+            conditions.append({"title": {"$in": self.titles}})
+        if self.modified_after is not None:
+            conditions.append({"last_modified_ts": {"$gte": to_timestamp(self.modified_after)}})
+        if self.modified_before is not None:
+            conditions.append({"last_modified_ts": {"$lt": to_timestamp(self.modified_before)}})
+        if not conditions:
+            return None
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    def to_mask(self, column: Callable[[str], np.ndarray]) -> Optional[np.ndarray]:
+        """
+        条件を満たす行をTrueとしたマスクを返す（条件がない場合はNone）
+
+        Args:
+            column: メタデータのフィールド名から全行の値の配列を返す関数
+        """
+        mask: Optional[np.ndarray] = None
+        def narrow(condition: np.ndarray) -> None:
+            nonlocal mask
+            mask = condition if mask is None else mask & condition
+        if self.urls:
+            narrow(np.isin(column("url"), self.urls))
+        if self.titles:
+            narrow(np.isin(column("title"), self.titles))
+        if self.modified_after is not None:
+            narrow(column("last_modified_ts") >= to_timestamp(self.modified_after))
+        if self.modified_before is not None:
+            narrow(column("last_modified_ts") < to_timestamp(self.modified_before))
+        return mask
+
+class RetrievalOptions(BaseModel):
+    """ベクトル検索のオプション"""
+    k: int = Field(default=4, ge=1, le=50)
+    """返却するドキュメント数"""
+    score_threshold: Optional[float] = Field(default=None, ge=-1.0, le=1.0)
+    """この値未満のコサイン類似度の候補を除く（Noneの場合は除かない）"""
+    search_type: Literal["similarity", "mmr"] = "similarity"
+    """similarity: 類似度の高い順 / mmr: 多様性を考慮して選ぶ"""
+    fetch_k: int = Field(default=20, ge=1, le=200)
+    """MMRで選ぶ前に取得する候補数"""
+    lambda_mult: float = Field(default=0.5, ge=0.0, le=1.0)
+    """MMRの類似度と多様性の重み（1で類似度のみ、0で多様性のみ）"""
+    filter: Optional[RetrievalFilter] = None
+    """メタデータによる絞り込み"""
+
+    @property
+    def candidates(self) -> int:
+        """バックエンドに問い合わせる候補数"""
+        return max(self.fetch_k, self.k) if self.search_type == "mmr" else self.k
+
+    def where(self) -> Optional[Dict[str, Any]]:
+        """Chromaのwhere句を返す（絞り込みがない場合はNone）"""
+        return self.filter.to_where() if self.filter is not None else None
+
+    def merge(self, overrides: Optional["RetrievalOptions"]) -> "RetrievalOptions":
+        """overridesで明示的に指定された項目だけを上書きしたオプションを返す"""
+        if overrides is None:
+            return self
+        return RetrievalOptions.model_validate({**self.model_dump(), **overrides.model_dump(exclude_unset=True)})
+
+    def search_kwargs(self) -> Dict[str, Any]:
+        """LangChainのVectorStoreRetrieverに渡すsearch_kwargsを返す（score_thresholdはLangChainの関連度スコアとして解釈される）"""
+        kwargs: Dict[str, Any] = {"k": self.k}
+        where = self.where()
+        if where is not None:
+            kwargs["filter"] = where
+        if self.search_type == "mmr":
+            kwargs.update(fetch_k=self.candidates, lambda_mult=self.lambda_mult)
+        elif self.score_threshold is not None:
+            kwargs["score_threshold"] = self.score_threshold
+        return kwargs
+
+    def langchain_search_type(self) -> str:
+        """LangChainのVectorStoreRetrieverのsearch_typeを返す"""
+        if self.search_type == "mmr":
+            return "mmr"
+        return "similarity_score_threshold" if self.score_threshold is not None else "similarity"
+
+def select_candidates(query_embedding: Sequence[float], scores: Sequence[float], embeddings: Optional[Sequence[Sequence[float]]], options: RetrievalOptions) -> List[int]:
+    """
+    類似度の高い順に並んだ候補にスコアの閾値とMMRを適用し、選んだ候補の位置をk件まで返す
+
+    Args:
+        query_embedding: クエリの埋め込み
+        scores: 候補のコサイン類似度
+        embeddings: 候補の埋め込み（MMRの場合のみ必要）
+        options: 検索オプション
+    """
+    selected = [i for i, score in enumerate(scores) if options.score_threshold is None or score >= options.score_threshold]
+    if options.search_type == "mmr" and selected:
+        order = maximal_marginal_relevance(
+            np.asarray(query_embedding, dtype=np.float32),
+            [np.asarray(embeddings[i], dtype=np.float32) for i in selected],
+            lambda_mult=options.lambda_mult,
+            k=options.k
+        )
+        selected = [selected[i] for i in order]
+    return selected[:options.k]
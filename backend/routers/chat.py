@@ -1,10 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from chat import ChatManager
-from containers import Container
+import json
 import uuid
-from typing import List
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
 from db.chat.models import ChatMessage, SessionTitle
+from retrieval import RetrievalOptions
+from utils.session_deletion import SessionDeletionJob
 from logging import getLogger
 
 router = APIRouter()
@@ -12,31 +16,43 @@ router = APIRouter()
 # ロガーの初期化
 logger = getLogger("uvicorn.app")
 
-def get_chat_manager(container: Container = Depends(lambda: Container())) -> ChatManager:
-    return ChatManager(container)
+def get_chat_manager(request: Request) -> ChatManager:
+    """起動時に構築された共有ChatManagerを返す"""
+    return request.app.state.chat_manager
 
 class Message(BaseModel):
     content: str
     user_id: str
     session_id: str | None = None
+    # 検索オプション（指定した項目だけ設定ファイルの既定値を上書きする）
+    retrieval: Optional[RetrievalOptions] = None
 
 class ChatResponse(ChatMessage):
     session_id: str
     request_no: int
 
+# ページサイズの上限
+MAX_PAGE_SIZE = 500
+
 class ChatHistoryResponse(BaseModel):
     messages: List[ChatMessage]
     session_id: str
+    # 次のページを取得する際のafter_no（最後のページの場合はNone）
+    next_after_no: Optional[int] = None
 
 class SessionListResponse(BaseModel):
     session_ids: List[str]
     user_id: str
+    # 次のページを取得する際のafter（最後のページの場合はNone）
+    next_after: Optional[str] = None
 
 class EditMessageRequest(BaseModel):
     content: str
     user_id: str
     session_id: str
     no: int
+    # 検索オプション（指定した項目だけ設定ファイルの既定値を上書きする）
+    retrieval: Optional[RetrievalOptions] = None
 
 class EditMessageResponse(BaseModel):
     content: str
@@ -52,6 +68,42 @@ class SessionTitleResponse(BaseModel):
 class SessionTitlesListResponse(BaseModel):
     user_id: str
     sessions: List[SessionTitleResponse]
+    # 次のページを取得する際のbefore・before_session_id（最後のページの場合はNone）
+    next_before: Optional[str] = None
+    next_before_session_id: Optional[str] = None
+
+class SessionSummaryResponse(BaseModel):
+    session_id: str
+    title: Optional[str] = None
+    created_at: str
+    updated_at: str
+    message_count: int
+    last_no: int
+    preview: str
+
+class SessionSummariesListResponse(BaseModel):
+    user_id: str
+    sessions: List[SessionSummaryResponse]
+    # 次のページを取得する際のbefore・before_session_id（最後のページの場合はNone）
+    next_before: Optional[str] = None
+    next_before_session_id: Optional[str] = None
+
+class SessionDeleteRequest(BaseModel):
+    user_id: str
+    # 削除するセッションID（all_sessionsをTrueにした場合は指定しない）
+    session_ids: Optional[List[str]] = None
+    # ユーザーの全セッションを削除する
+    all_sessions: bool = False
+
+def _fetch_limit(limit: Optional[int]) -> Optional[int]:
+    """次のページの有無を判定するため、limitより1件多く取得する"""
+    return limit + 1 if limit is not None else None
+
+def _to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """タイムゾーン付きの日時を保存形式（UTCのnaive datetime）に揃える"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
 
 @router.post("/chat", response_model=ChatResponse)
 async def chat(
@@ -67,7 +119,8 @@ async def chat(
         last_msgs = await chat_manager.get_response(
             message=message.content,
             user_id=message.user_id,
-            session_id=session_id
+            session_id=session_id,
+            retrieval=message.retrieval
         )
         return ChatResponse(
             session_id=session_id,
@@ -83,19 +136,76 @@ async def chat(
             detail=str(e)
         )
 
+def _format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Server-Sent Events形式のメッセージに変換する"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream(
+    message: Message,
+    chat_manager: ChatManager = Depends(get_chat_manager)
+):
+    """
+    Send a message to the chat and stream the response as Server-Sent Events.
+    If session_id is not provided, a new one will be generated.
+
+    Events:
+    - token: {"content": str} 生成されたトークン
+    - done: ChatResponse 保存済みのアシスタントメッセージ（request_no, no を含む）
+    - error: {"detail": str} エラー発生時
+    """
+    session_id = message.session_id or str(uuid.uuid4())
+
+    async def event_stream():
+        try:
+            async for event in chat_manager.stream_response(
+                message=message.content,
+                user_id=message.user_id,
+                session_id=session_id,
+                retrieval=message.retrieval
+            ):
+                if event["type"] == "token":
+                    yield _format_sse("token", {"content": event["content"]})
+                elif event["type"] == "done":
+                    last_msgs = event["messages"]
+                    response = ChatResponse(
+                        session_id=session_id,
+                        request_no=last_msgs[0].no,
+                        no=last_msgs[-1].no,
+                        role=last_msgs[-1].role,
+                        content=last_msgs[-1].content,
+                    )
+                    yield _format_sse("done", response.model_dump())
+        except Exception as e:
+            logger.error(f"Error in chat_stream endpoint for user_id={message.user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            yield _format_sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/chat/sessions/{user_id}", response_model=SessionListResponse)
 async def get_user_sessions(
     user_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
     chat_manager: ChatManager = Depends(get_chat_manager)
 ):
     """
-    Get all session IDs for the specified user.
+    Get session IDs for the specified user in ascending order.
+    With limit, returns one page; pass next_after as after to get the next page.
     """
     try:
-        session_ids = await chat_manager.chat_repository.get_session_ids(user_id)
+        session_ids = await chat_manager.chat_repository.get_session_ids(user_id, limit=_fetch_limit(limit), after=after)
+        has_more = limit is not None and len(session_ids) > limit
+        if has_more:
+            session_ids = session_ids[:limit]
         return SessionListResponse(
             session_ids=session_ids,
-            user_id=user_id
+            user_id=user_id,
+            next_after=session_ids[-1] if has_more else None
         )
     except Exception as e:
         logger.error(f"Error in get_user_sessions endpoint for user_id={user_id}: {str(e)}", exc_info=True)
@@ -127,16 +237,23 @@ async def clear_chat(
 async def get_chat_history(
     user_id: str,
     session_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after_no: Optional[int] = Query(None, ge=0),
     chat_manager: ChatManager = Depends(get_chat_manager)
 ):
     """
-    Get the chat history for the specified session.
+    Get the chat history for the specified session in ascending order of no.
+    With limit, returns one page; pass next_after_no as after_no to get the next page.
     """
     try:
-        messages = await chat_manager.chat_repository.get_chat_messages(user_id, session_id)
+        messages = await chat_manager.chat_repository.get_chat_messages(user_id, session_id, limit=_fetch_limit(limit), after_no=after_no)
+        has_more = limit is not None and len(messages) > limit
+        if has_more:
+            messages = messages[:limit]
         return ChatHistoryResponse(
             messages=messages,
-            session_id=session_id
+            session_id=session_id,
+            next_after_no=messages[-1].no if has_more else None
         )
     except Exception as e:
         logger.error(f"Error in get_chat_history endpoint for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
@@ -184,6 +301,45 @@ async def delete_all_chat_messages(
             detail=str(e)
         )
 
+@router.post("/chat/sessions/delete", response_model=SessionDeletionJob, status_code=status.HTTP_202_ACCEPTED)
+async def delete_sessions(
+    request: SessionDeleteRequest,
+    chat_manager: ChatManager = Depends(get_chat_manager)
+):
+    """
+    複数のセッション（またはユーザーの全セッション）のメッセージ・タイトル・要約を削除するジョブを開始する
+    削除はバックグラウンドで行うため、進捗は返却したjob_idで GET /chat/jobs/{job_id} から取得する
+    """
+    if request.all_sessions == (request.session_ids is not None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Specify either session_ids or all_sessions=true"
+        )
+    try:
+        return chat_manager.deletion_jobs.start(request.user_id, None if request.all_sessions else request.session_ids)
+    except Exception as e:
+        logger.error(f"Error in delete_sessions endpoint for user_id={request.user_id}: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+@router.get("/chat/jobs/{job_id}", response_model=SessionDeletionJob)
+async def get_deletion_job(
+    job_id: str,
+    chat_manager: ChatManager = Depends(get_chat_manager)
+):
+    """
+    セッション削除ジョブの状態と進捗（削除済みのセッション数・メッセージ数）を取得する
+    """
+    job = chat_manager.deletion_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job {job_id} not found"
+        )
+    return job
+
 @router.post("/chat/edit", response_model=EditMessageResponse)
 async def edit_message(
     request: EditMessageRequest,
@@ -201,7 +357,8 @@ async def edit_message(
             message=request.content,
             user_id=request.user_id,
             session_id=request.session_id,
-            no=request.no
+            no=request.no,
+            retrieval=request.retrieval
         )
         return EditMessageResponse(
             content=ai_response.content,
@@ -218,13 +375,26 @@ async def edit_message(
 @router.get("/chat/sessions/titles/{user_id}", response_model=SessionTitlesListResponse)
 async def get_user_session_titles(
     user_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[datetime] = None,
+    before_session_id: Optional[str] = None,
     chat_manager: ChatManager = Depends(get_chat_manager)
 ):
     """
-    ユーザーのセッションタイトル一覧を取得する
+    ユーザーのセッションタイトル一覧を更新日時の降順（同じ更新日時はsession_idの降順）で取得する
+    limitを指定した場合は1ページ分を返す。次のページはnext_before・next_before_session_idを
+    before・before_session_idに指定して取得する（更新日時が同じセッションもページの境界で読み飛ばさない）
     """
     try:
-        session_titles = await chat_manager.chat_repository.get_session_titles(user_id)
+        session_titles = await chat_manager.chat_repository.get_session_titles(
+            user_id,
+            limit=_fetch_limit(limit),
+            before=_to_naive_utc(before),
+            before_session_id=before_session_id
+        )
+        has_more = limit is not None and len(session_titles) > limit
+        if has_more:
+            session_titles = session_titles[:limit]
         
         # SessionTitleをSessionTitleResponseに変換
         session_responses = []
@@ -238,7 +408,9 @@ async def get_user_session_titles(
         
         return SessionTitlesListResponse(
             user_id=user_id,
-            sessions=session_responses
+            sessions=session_responses,
+            next_before=session_titles[-1].updated_at.isoformat() if has_more else None,
+            next_before_session_id=session_titles[-1].session_id if has_more else None
         )
     except Exception as e:
         logger.error(f"Error in get_user_session_titles endpoint for user_id={user_id}: {str(e)}", exc_info=True)
@@ -247,6 +419,55 @@ async def get_user_session_titles(
             detail=str(e)
         )
 
+@router.get("/chat/sessions/summaries/{user_id}", response_model=SessionSummariesListResponse)
+async def get_user_session_summaries(
+    user_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[datetime] = None,
+    before_session_id: Optional[str] = None,
+    chat_manager: ChatManager = Depends(get_chat_manager)
+):
+    """
+    サイドバーに表示するセッション一覧（タイトル・メッセージ数・最後のメッセージのプレビュー）を
+    更新日時の降順（同じ更新日時はsession_idの降順）で取得する
+    セッションごとのサマリーを1回のクエリで読むため、セッションIDとタイトルを別々に取得する必要がない。
+    limitを指定した場合は1ページ分を返す。次のページはnext_before・next_before_session_idを
+    before・before_session_idに指定して取得する
+    """
+    try:
+        summaries = await chat_manager.chat_repository.get_session_summaries(
+            user_id,
+            limit=_fetch_limit(limit),
+            before=_to_naive_utc(before),
+            before_session_id=before_session_id
+        )
+        has_more = limit is not None and len(summaries) > limit
+        if has_more:
+            summaries = summaries[:limit]
+        return SessionSummariesListResponse(
+            user_id=user_id,
+            sessions=[
+                SessionSummaryResponse(
+                    session_id=summary.session_id,
+                    title=summary.title,
+                    created_at=summary.created_at.isoformat(),
+                    updated_at=summary.updated_at.isoformat(),
+                    message_count=summary.message_count,
+                    last_no=summary.last_no,
+                    preview=summary.preview
+                )
+                for summary in summaries
+            ],
+            next_before=summaries[-1].updated_at.isoformat() if has_more else None,
+            next_before_session_id=summaries[-1].session_id if has_more else None
+        )
+    except Exception as e:
+        logger.error(f"Error in get_user_session_summaries endpoint for user_id={user_id}: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
 @router.delete("/chat/sessions/titles/{user_id}/{session_id}")
 async def delete_session_title(
     user_id: str,
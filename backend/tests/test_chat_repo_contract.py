@@ -0,0 +1,227 @@
+"""
+チャット履歴リポジトリ（IChatRepo）の契約テスト
+
+すべてのバックエンドとデコレーター（write-behind・キャッシュ）に同じ契約チェックを実行する。
+MongoDBのバックエンドはmongodに接続できる場合のみ実行する（MONGODB_HOST / MONGODB_PORT、既定値はlocalhost:27017）。
+
+使い方（backendディレクトリで実行）:
+    python -m pytest tests/test_chat_repo_contract.py
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, List
+import pytest
+from db.chat.cached import CachedChatRepo
+from db.chat.inmemory import InMemoryChatRepo
+from db.chat.interface import IChatRepo
+from db.chat.models import ChatMessage, HistorySummary, SESSION_PREVIEW_LENGTH
+from db.chat.sqlite import SQLiteChatRepo
+from db.chat.write_behind import WriteBehindChatRepo
+
+MONGODB_HOST = os.getenv("MONGODB_HOST", "localhost")
+MONGODB_PORT = int(os.getenv("MONGODB_PORT", "27017"))
+MONGODB_TEST_DB = "chatdb_contract_test"
+
+def _turn(i: int) -> List[ChatMessage]:
+    return [
+        ChatMessage(no=0, role="user", content=f"GCASのAzure環境について質問です ({i})"),
+        ChatMessage(no=0, role="assistant", content="ユーザーの追加はGCASポータルから申請し、承認後に反映されます。" * 4)
+    ]
+
+def _expect(condition: bool, message: str) -> None:
+    if not condition:
+        raise AssertionError(message)
+
+async def _check_numbering(repo: IChatRepo, user_id: str) -> None:
+    saved = await repo.save_chat_messages(user_id, "numbering", _turn(1))
+    _expect([m.no for m in saved] == [1, 2], f"first turn should be numbered 1, 2: {[m.no for m in saved]}")
+    saved = await repo.save_chat_messages(user_id, "numbering", _turn(2))
+    _expect([m.no for m in saved] == [3, 4], f"second turn should be numbered 3, 4: {[m.no for m in saved]}")
+    single = await repo.save_chat_message(user_id, "numbering", ChatMessage(no=0, role="user", content="single"))
+    _expect(single.no == 5, f"single save should continue from 5: {single.no}")
+    messages = await repo.get_chat_messages(user_id, "numbering")
+    _expect([m.no for m in messages] == [1, 2, 3, 4, 5], f"messages should be returned in order: {[m.no for m in messages]}")
+    _expect([m.role for m in messages[:2]] == ["user", "assistant"], "roles should be preserved")
+
+async def _check_pagination(repo: IChatRepo, user_id: str) -> None:
+    for i in range(5):
+        await repo.save_chat_messages(user_id, "pagination", _turn(i))
+    page = await repo.get_chat_messages(user_id, "pagination", limit=3)
+    _expect([m.no for m in page] == [1, 2, 3], f"first page: {[m.no for m in page]}")
+    page = await repo.get_chat_messages(user_id, "pagination", limit=3, after_no=page[-1].no)
+    _expect([m.no for m in page] == [4, 5, 6], f"second page: {[m.no for m in page]}")
+    page = await repo.get_chat_messages(user_id, "pagination", after_no=8)
+    _expect([m.no for m in page] == [9, 10], f"last page: {[m.no for m in page]}")
+
+async def _check_delete(repo: IChatRepo, user_id: str) -> None:
+    for i in range(3):
+        await repo.save_chat_messages(user_id, "delete", _turn(i))
+    await repo.delete_chat_message_by_no(user_id, "delete", 3)
+    messages = await repo.get_chat_messages(user_id, "delete")
+    _expect([m.no for m in messages] == [1, 2, 4, 5, 6], f"delete by no should remove only no=3: {[m.no for m in messages]}")
+    saved = await repo.save_chat_messages(user_id, "delete", _turn(3))
+    _expect([m.no for m in saved] == [7, 8], f"deleted numbers in the middle should not be reused: {[m.no for m in saved]}")
+    await repo.delete_messages_from_no(user_id, "delete", 5)
+    messages = await repo.get_chat_messages(user_id, "delete")
+    _expect([m.no for m in messages] == [1, 2, 4], f"delete from no should truncate the tail: {[m.no for m in messages]}")
+    saved = await repo.save_chat_messages(user_id, "delete", _turn(4))
+    _expect([m.no for m in saved] == [5, 6], f"numbering should resume from the deleted no: {[m.no for m in saved]}")
+    await repo.clear_chat_messages(user_id, "delete")
+    _expect(await repo.get_chat_messages(user_id, "delete") == [], "clear should remove all messages")
+    saved = await repo.save_chat_messages(user_id, "delete", _turn(5))
+    _expect([m.no for m in saved] == [1, 2], f"numbering should restart after clear: {[m.no for m in saved]}")
+
+async def _check_preassigned(repo: IChatRepo, user_id: str) -> None:
+    await repo.save_chat_messages(user_id, "preassigned", [
+        ChatMessage(no=1, role="user", content="q"),
+        ChatMessage(no=2, role="assistant", content="a")
+    ])
+    saved = await repo.save_chat_messages(user_id, "preassigned", _turn(1))
+    _expect([m.no for m in saved] == [3, 4], f"numbering should continue after preassigned numbers: {[m.no for m in saved]}")
+
+async def _check_reserved(repo: IChatRepo, user_id: str) -> None:
+    await repo.save_chat_messages(user_id, "reserved", _turn(0))
+    await repo.delete_chat_message_by_no(user_id, "reserved", 2)
+    last_no = await repo.reserve_nos(user_id, "reserved", 2)
+    _expect(last_no == 4, f"reserved numbers should not reuse the deleted tail number: {last_no}")
+    saved = await repo.save_chat_messages(user_id, "reserved", _turn(1))
+    _expect([m.no for m in saved] == [5, 6], f"numbering should continue after reserved numbers: {[m.no for m in saved]}")
+
+async def _check_sessions(repo: IChatRepo, user_id: str) -> None:
+    for session_id in ["session-c", "session-a", "session-b"]:
+        await repo.save_chat_messages(user_id, session_id, _turn(0))
+    session_ids = await repo.get_session_ids(user_id)
+    _expect({"session-a", "session-b", "session-c"} <= set(session_ids), f"all sessions should be listed: {session_ids}")
+    page = await repo.get_session_ids(user_id, limit=2, after="session-a")
+    _expect(page == ["session-b", "session-c"], f"session ids should be paged in ascending order: {page}")
+
+async def _check_titles(repo: IChatRepo, user_id: str) -> None:
+    first = await repo.save_session_title(user_id, "title-1", "最初のタイトル")
+    await asyncio.sleep(0.01)
+    await repo.save_session_title(user_id, "title-2", "2番目のタイトル")
+    await asyncio.sleep(0.01)
+    updated = await repo.update_session_title(user_id, "title-1", "更新したタイトル")
+    _expect(updated.title == "更新したタイトル", "update should change the title")
+    _expect(abs((updated.created_at - first.created_at).total_seconds()) < 0.001, "update should keep created_at")
+    titles = await repo.get_session_titles(user_id)
+    _expect([t.session_id for t in titles] == ["title-1", "title-2"], f"titles should be ordered by updated_at desc: {[t.session_id for t in titles]}")
+    page = await repo.get_session_titles(user_id, limit=1, before=titles[0].updated_at)
+    _expect([t.session_id for t in page] == ["title-2"], f"before cursor should return older titles: {[t.session_id for t in page]}")
+    page = await repo.get_session_titles(user_id, limit=1, before=titles[0].updated_at, before_session_id=titles[0].session_id)
+    _expect([t.session_id for t in page] == ["title-2"], f"compound cursor should return older titles: {[t.session_id for t in page]}")
+    # 更新日時が同じセッションはsession_idの降順で続く（カーソルの位置のセッション自体は返さない）
+    tied = await repo.get_session_titles(user_id, before=titles[1].updated_at, before_session_id="title-3")
+    _expect([t.session_id for t in tied] == ["title-2"], f"compound cursor should keep titles tied on updated_at: {[t.session_id for t in tied]}")
+    tied = await repo.get_session_titles(user_id, before=titles[1].updated_at, before_session_id="title-2")
+    _expect(tied == [], f"compound cursor should exclude the cursor position: {[t.session_id for t in tied]}")
+    await repo.delete_session_title(user_id, "title-2")
+    titles = await repo.get_session_titles(user_id)
+    _expect([t.session_id for t in titles] == ["title-1"], f"delete should remove the title: {[t.session_id for t in titles]}")
+
+async def _check_session_summaries(repo: IChatRepo, user_id: str) -> None:
+    await repo.save_chat_messages(user_id, "summary-1", _turn(0))
+    await asyncio.sleep(0.01)
+    await repo.save_session_title(user_id, "summary-2", "メッセージのないセッション")
+    await asyncio.sleep(0.01)
+    turn = _turn(1)
+    await repo.save_chat_messages(user_id, "summary-1", turn)
+    summaries = await repo.get_session_summaries(user_id)
+    _expect([s.session_id for s in summaries] == ["summary-1", "summary-2"], f"summaries should be ordered by last activity: {[s.session_id for s in summaries]}")
+    latest = summaries[0]
+    _expect(latest.message_count == 4 and latest.last_no == 4, f"summary should count saved messages: {latest.message_count}, {latest.last_no}")
+    _expect(latest.preview == turn[-1].content[:SESSION_PREVIEW_LENGTH], "summary should preview the last message")
+    _expect(latest.title is None and summaries[1].title == "メッセージのないセッション", "summary should carry the session title")
+    page = await repo.get_session_summaries(user_id, limit=1, before=latest.updated_at)
+    _expect([s.session_id for s in page] == ["summary-2"], f"before cursor should return older sessions: {[s.session_id for s in page]}")
+    tied = await repo.get_session_summaries(user_id, before=summaries[1].updated_at, before_session_id="summary-3")
+    _expect([s.session_id for s in tied] == ["summary-2"], f"compound cursor should keep sessions tied on updated_at: {[s.session_id for s in tied]}")
+    await repo.delete_messages_from_no(user_id, "summary-1", 3)
+    latest = (await repo.get_session_summaries(user_id, limit=1))[0]
+    _expect(latest.message_count == 2 and latest.last_no == 2, f"summary should follow deletes: {latest.message_count}, {latest.last_no}")
+
+async def _check_delete_sessions(repo: IChatRepo, user_id: str) -> None:
+    for session_id in ["bulk-1", "bulk-2", "bulk-3"]:
+        await repo.save_chat_messages(user_id, session_id, _turn(0))
+        await repo.save_session_title(user_id, session_id, session_id)
+    deleted = await repo.delete_sessions(user_id, ["bulk-1", "bulk-2", "missing"])
+    _expect(deleted == 4, f"bulk delete should report deleted messages: {deleted}")
+    _expect(await repo.get_chat_messages(user_id, "bulk-1") == [], "bulk delete should remove messages")
+    summaries = await repo.get_session_summaries(user_id)
+    _expect([s.session_id for s in summaries] == ["bulk-3"], f"bulk delete should remove titles and summaries: {[s.session_id for s in summaries]}")
+    saved = await repo.save_chat_messages(user_id, "bulk-1", _turn(1))
+    _expect([m.no for m in saved] == [1, 2], f"numbering should restart in a deleted session: {[m.no for m in saved]}")
+
+async def _check_history_summary(repo: IChatRepo, user_id: str) -> None:
+    for i in range(3):
+        await repo.save_chat_messages(user_id, "summary", _turn(i))
+    await repo.save_history_summary(user_id, "summary", HistorySummary(content="要約", up_to_no=4, updated_at=datetime.utcnow()))
+    summary = await repo.get_history_summary(user_id, "summary")
+    _expect(summary is not None and summary.up_to_no == 4, "summary should be saved")
+    await repo.delete_messages_from_no(user_id, "summary", 5)
+    _expect(await repo.get_history_summary(user_id, "summary") is not None, "summary of remaining messages should be kept")
+    await repo.delete_messages_from_no(user_id, "summary", 3)
+    _expect(await repo.get_history_summary(user_id, "summary") is None, "summary covering deleted messages should be invalidated")
+
+CONTRACT_CHECKS: Dict[str, Callable[[IChatRepo, str], Awaitable[None]]] = {
+    "numbering": _check_numbering,
+    "pagination": _check_pagination,
+    "delete": _check_delete,
+    "preassigned_numbers": _check_preassigned,
+    "reserved_numbers": _check_reserved,
+    "sessions": _check_sessions,
+    "titles": _check_titles,
+    "session_summaries": _check_session_summaries,
+    "delete_sessions": _check_delete_sessions,
+    "history_summary": _check_history_summary,
+}
+
+@lru_cache(maxsize=None)
+def _mongo_reachable() -> bool:
+    """mongodに接続できるかを返す"""
+    try:
+        from pymongo import MongoClient
+        client = MongoClient(MONGODB_HOST, MONGODB_PORT, serverSelectionTimeoutMS=500)
+        try:
+            client.admin.command("ping")
+            return True
+        finally:
+            client.close()
+    except Exception:
+        return False
+
+def _mongodb(tmp_path) -> IChatRepo:
+    from db.chat.mongodb import MongoChatRepo
+    return MongoChatRepo(MONGODB_HOST, MONGODB_PORT, db_name=MONGODB_TEST_DB)
+
+def _mongodb_async(tmp_path) -> IChatRepo:
+    from db.chat.mongodb_async import AsyncMongoChatRepo
+    return AsyncMongoChatRepo(MONGODB_HOST, MONGODB_PORT, db_name=MONGODB_TEST_DB)
+
+# バックエンド名 -> リポジトリを作成する関数（引数はpytestのtmp_path）
+BACKENDS: Dict[str, Callable[..., IChatRepo]] = {
+    "inmemory": lambda tmp_path: InMemoryChatRepo(),
+    "sqlite": lambda tmp_path: SQLiteChatRepo(path=str(tmp_path / "chat.sqlite3")),
+    "write_behind": lambda tmp_path: WriteBehindChatRepo(SQLiteChatRepo(path=str(tmp_path / "chat.sqlite3"))),
+    "cached": lambda tmp_path: CachedChatRepo(SQLiteChatRepo(path=str(tmp_path / "chat.sqlite3"))),
+    "mongodb": _mongodb,
+    "mongodb_async": _mongodb_async,
+}
+
+async def _run_check(create: Callable[..., IChatRepo], tmp_path, check) -> None:
+    repo = create(tmp_path)
+    try:
+        await repo.initialize()
+        # チェックごとに別のユーザーにして、共有のデータベースでも互いに影響しないようにする
+        await check(repo, f"contract-{uuid.uuid4()}")
+    finally:
+        await repo.close()
+
+@pytest.mark.parametrize("check_name", list(CONTRACT_CHECKS))
+@pytest.mark.parametrize("backend", list(BACKENDS))
+def test_chat_repo_contract(backend: str, check_name: str, tmp_path) -> None:
+    if backend.startswith("mongodb") and not _mongo_reachable():
+        pytest.skip(f"mongod is not reachable at {MONGODB_HOST}:{MONGODB_PORT}")
+    asyncio.run(_run_check(BACKENDS[backend], tmp_path, CONTRACT_CHECKS[check_name]))
@@ -0,0 +1,131 @@
+"""
+/api/chat の同時実行のテスト（LLMの呼び出しがイベントループを止めないことの確認）
+
+LLMを固定の待ち時間で応答するスタブに、埋め込みを決定的なフェイクに、ベクトル検索を一時ディレクトリの
+ローカルインデックスに、チャット履歴をインメモリに差し替えたChatManagerに対して、N件のリクエストを同時に送る。
+チェーンを ainvoke / astream で実行していれば全体の所要時間はLLMの待ち時間1回分程度になる。
+同期呼び出し（invoke）に戻すとスタブのtime.sleepでイベントループが止まり、N回分近くに伸びる。
+
+使い方（backendディレクトリで実行。外部サービスは不要）:
+    python -m pytest tests/test_concurrent_chat.py
+"""
+import asyncio
+import importlib
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+import httpx
+import pytest
+from dependency_injector import providers
+from fastapi import FastAPI
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from db.chat.inmemory import InMemoryChatRepo
+from retrieval.embedding_cache import create_cached_embeddings
+from retrieval.local_index import SnapshotWriter
+
+DIMENSION = 16
+REQUESTS = 20
+LLM_LATENCY = 0.5
+# 所要時間の上限（LLMの待ち時間の倍数）。直列に実行された場合はREQUESTS倍近くになる
+MAX_LATENCY_RATIO = 2.0
+
+class StubChatModel(BaseChatModel):
+    """
+    固定の待ち時間の後に固定の回答を返すチャットモデル
+
+    同期呼び出しはtime.sleepでスレッドを、非同期呼び出しはasyncio.sleepでコルーチンだけを待たせる。
+    """
+    latency: float = 0.5
+    answer: str = "スタブの回答です。"
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _result(self) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return self._result()
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._result()
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for token in self.answer:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for token in self.answer:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+def _write_index(path: str, embeddings) -> None:
+    """検索対象の小さなローカルインデックスを書き出す"""
+    documents = [f"GCASのAzure環境に関するガイド {i}" for i in range(32)]
+    writer = SnapshotWriter(path, len(documents), DIMENSION, collection_name="concurrent_chat")
+    writer.add(
+        [f"doc-{i}" for i in range(len(documents))],
+        embeddings.embed_documents(documents),
+        documents,
+        [{"url": f"https://example.com/{i}", "title": f"ガイド {i}"} for i in range(len(documents))]
+    )
+    writer.close()
+
+@pytest.fixture
+def chat_app(monkeypatch, tmp_path):
+    """外部サービスをスタブに差し替えたChatManagerを持つアプリを返す"""
+    # LLMの呼び出しを回答の1回だけにする（HyDE・LLMによるタイトル生成・回答キャッシュを使わない）
+    index_path = str(tmp_path / "local_index")
+    monkeypatch.setenv("VECTOR_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_INDEX_PATH", index_path)
+    monkeypatch.setenv("HYDE_MODE", "off")
+    monkeypatch.setenv("TITLE_MODE", "fallback")
+    monkeypatch.setenv("ANSWER_CACHE_ENABLED", "false")
+    # コンテナーはインポート時にChromaDBの接続先を読むため、環境変数を設定してから読み込む
+    monkeypatch.setenv("CHROMA_PORT", "8000")
+    ChatManager = importlib.import_module("chat").ChatManager
+    Container = importlib.import_module("containers").Container
+    chat_router = importlib.import_module("routers.chat")
+
+    embeddings = create_cached_embeddings(DeterministicFakeEmbedding(size=DIMENSION), model_name="stub")
+    _write_index(index_path, embeddings)
+    container = Container()
+    container.llm.override(providers.Object(StubChatModel(latency=LLM_LATENCY)))
+    container.embeddings.override(providers.Object(embeddings))
+    container.chat_repository.override(providers.Object(InMemoryChatRepo()))
+    app = FastAPI()
+    app.include_router(chat_router.router, prefix="/api")
+    app.state.chat_manager = ChatManager(container)
+    return app
+
+async def _post_concurrently(app: FastAPI, path: str) -> float:
+    """REQUESTS件のリクエストを同時に送り、すべて成功するまでの所要時間（秒）を返す"""
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://concurrent-chat", timeout=None) as client:
+            # インデックスの読み込みなど初回のみの処理を計測から除く
+            warmup = await client.post(path, json={"content": "ウォームアップ", "user_id": "test-user", "session_id": "test-warmup"})
+            assert warmup.status_code == 200
+            start = time.perf_counter()
+            responses = await asyncio.gather(*(
+                client.post(path, json={"content": f"Azureのユーザー追加の手順は？ ({i})", "user_id": "test-user", "session_id": f"test-{i}"})
+                for i in range(REQUESTS)
+            ))
+            elapsed = time.perf_counter() - start
+    finally:
+        await app.state.chat_manager.close()
+    assert [response.status_code for response in responses] == [200] * REQUESTS
+    return elapsed
+
+@pytest.mark.parametrize("path", ["/api/chat", "/api/chat/stream"])
+def test_concurrent_requests_overlap_llm_latency(chat_app, path: str) -> None:
+    elapsed = asyncio.run(_post_concurrently(chat_app, path))
+    assert elapsed <= LLM_LATENCY * MAX_LATENCY_RATIO, (
+        f"{REQUESTS} concurrent requests took {elapsed:.2f}s "
+        f"(LLM latency {LLM_LATENCY}s, serialized estimate {REQUESTS * LLM_LATENCY:.1f}s)"
+    )
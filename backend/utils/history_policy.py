@@ -0,0 +1,181 @@
+from datetime import datetime
+from logging import getLogger
+from typing import Callable, List, Optional, Set, Tuple
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from db.chat.interface import IChatRepo
+from db.chat.models import ChatMessage, HistorySummary
+
+def create_summary_chain(llm):
+    """
+    LLMを使った会話要約チェーンを作成する
+
+    Args:
+        llm: 使用するLLMインスタンス
+
+    Returns:
+        {"summary": これまでの要約, "conversation": 追加の会話} を受け取り要約を返すチェーン
+    """
+    prompt = ChatPromptTemplate.from_template("""
+以下は、ユーザーとアシスタントの会話のこれまでの要約と、その後に続く会話です。
+後の質問に回答するために必要な事実・前提・結論を残し、400文字以内の日本語で要約し直してください。
+
+これまでの要約:
+{summary}
+
+続きの会話:
+{conversation}
+
+要約:
+""")
+    return prompt | llm | StrOutputParser()
+
+def _create_token_counter(encoding_name: str) -> Callable[[str], int]:
+    """tiktokenのトークン数計測関数を返す（利用できない場合は文字数で近似する）"""
+    logger = getLogger("uvicorn.app")
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding(encoding_name)
+        return lambda text: len(encoding.encode(text))
+    except Exception as e:
+        logger.warning(f"tiktoken encoding '{encoding_name}' is not available, falling back to character count: {str(e)}")
+        return len
+
+class HistoryPolicy:
+    """
+    プロンプトに含める会話履歴を決めるポリシー
+
+    直近max_turns往復のうち、max_tokens以内に収まる新しいメッセージのみを残す。
+    summary_chainを指定した場合、残らなかった古いメッセージは要約してセッションごとに保存し、
+    要約をシステムメッセージとして履歴の先頭に付ける。
+    要約しない場合も、残らなかったメッセージの最後のnoを内容が空の要約として保存する。
+    要約のup_to_no以前のメッセージは以降の履歴に含まれないため、load()はそれより後のメッセージのみを読み込む。
+    要約の更新（LLM呼び出し・保存）は残らなかったメッセージがsummary_batch_turns往復分たまってからまとめて行う。
+    それまでの間、load()はまだ要約に取り込んでいないメッセージ（最大summary_batch_turns往復分）も読み込む。
+    """
+
+    def __init__(
+        self,
+        chat_repository: IChatRepo,
+        max_turns: int = 10,
+        max_tokens: int = 3000,
+        summary_chain=None,
+        encoding_name: str = "o200k_base",
+        summary_batch_turns: int = 5
+    ):
+        """
+        Args:
+            chat_repository: 要約の保存先リポジトリ
+            max_turns: 残す往復数の上限
+            max_tokens: 残すメッセージの合計トークン数の上限（要約を含む）
+            summary_chain: 古いメッセージの要約チェーン（Noneの場合は要約しない）
+            encoding_name: トークン数の計測に使うtiktokenのエンコーディング
+            summary_batch_turns: 要約に取り込む古いメッセージがこの往復数たまるまで要約を更新しない（1で毎ターン更新する）
+        """
+        self.logger = getLogger("uvicorn.app")
+        self.chat_repository = chat_repository
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summary_chain = summary_chain
+        self.summary_batch_messages = max(summary_batch_turns, 1) * 2
+        self.count_tokens = _create_token_counter(encoding_name)
+        # 要約を更新中のセッション（同じセッションの要約を重複して生成しない）
+        self._updating: Set[Tuple[str, str]] = set()
+
+    def _select_recent(self, messages: List[ChatMessage], budget: int) -> Tuple[List[ChatMessage], List[ChatMessage]]:
+        """予算内に収まる新しいメッセージと、それより古いメッセージに分ける"""
+        kept: List[ChatMessage] = []
+        used = 0
+        for message in reversed(messages[-self.max_turns * 2:]):
+            tokens = self.count_tokens(message.content)
+            if used + tokens > budget:
+                break
+            kept.append(message)
+            used += tokens
+        kept.reverse()
+        # 対応するユーザーのメッセージが残らなかったアシスタントのメッセージから始めない
+        if kept and kept[0].role == "assistant":
+            kept.pop(0)
+        return kept, messages[:len(messages) - len(kept)]
+
+    async def load(self, user_id: str, session_id: str) -> Tuple[List[ChatMessage], Optional[HistorySummary]]:
+        """
+        会話履歴の組み立てに必要なメッセージと要約を読み込む
+
+        要約がある場合は、要約済み（履歴から外れた）up_to_no以前のメッセージを読まない。
+
+        Returns:
+            Tuple[List[ChatMessage], Optional[HistorySummary]]: 要約より後のメッセージ（noの昇順）と要約
+        """
+        summary = await self.chat_repository.get_history_summary(user_id, session_id)
+        after_no = summary.up_to_no if summary is not None else None
+        messages = await self.chat_repository.get_chat_messages(user_id, session_id, after_no=after_no)
+        return messages, summary
+
+    def build(self, messages: List[ChatMessage], summary: Optional[HistorySummary] = None) -> Tuple[List[BaseMessage], List[ChatMessage]]:
+        """
+        プロンプトに含める会話履歴を組み立てる
+
+        Args:
+            messages: 要約より後のメッセージ（noの昇順。load()の戻り値）
+            summary: セッションの要約（load()の戻り値）
+
+        Returns:
+            Tuple[List[BaseMessage], List[ChatMessage]]: 会話履歴と、要約に取り込む古いメッセージ
+                （summary_batch_turns往復分たまった場合のみ。空でなければupdate_summary()で要約を更新する）
+        """
+        has_summary = summary is not None and bool(summary.content)
+        budget = self.max_tokens - self.count_tokens(summary.content) if has_summary else self.max_tokens
+        kept, older = self._select_recent(messages, budget)
+
+        history: List[BaseMessage] = []
+        if has_summary:
+            history.append(SystemMessage(content=f"これまでの会話の要約:\n{summary.content}"))
+        for msg in kept:
+            if msg.role == "user":
+                history.append(HumanMessage(content=msg.content))
+            elif msg.role == "assistant":
+                history.append(AIMessage(content=msg.content))
+
+        up_to_no = summary.up_to_no if summary is not None else 0
+        pending = [msg for msg in older if msg.no > up_to_no]
+        if len(pending) < self.summary_batch_messages:
+            # たまるまでは要約を更新せず、次のターンもload()で読み込む
+            pending = []
+        self.logger.info(f"History policy kept {len(kept)} of {len(messages)} loaded messages (summary={'yes' if has_summary else 'no'}, pending={len(pending)})")
+        return history, pending
+
+    async def update_summary(self, user_id: str, session_id: str, pending: List[ChatMessage]) -> Optional[HistorySummary]:
+        """
+        要約に含まれていない古いメッセージを要約に取り込み、保存する
+
+        summary_chainがない場合は要約の内容を変えずにup_to_noだけを進める（以降のload()でそれらのメッセージを読まない）。
+        """
+        if not pending or (user_id, session_id) in self._updating:
+            return None
+        self._updating.add((user_id, session_id))
+        try:
+            summary = await self.chat_repository.get_history_summary(user_id, session_id)
+            up_to_no = summary.up_to_no if summary is not None else 0
+            pending = [msg for msg in pending if msg.no > up_to_no]
+            if not pending:
+                return summary
+            if self.summary_chain is None:
+                new_summary = HistorySummary(content=summary.content if summary is not None else "", up_to_no=pending[-1].no, updated_at=datetime.utcnow())
+                await self.chat_repository.save_history_summary(user_id, session_id, new_summary)
+                return new_summary
+            conversation = "\n".join(f"{msg.role}: {msg.content}" for msg in pending)
+            content = await self.summary_chain.ainvoke({
+                "summary": summary.content if summary is not None else "（なし）",
+                "conversation": conversation
+            })
+            new_summary = HistorySummary(content=content.strip(), up_to_no=pending[-1].no, updated_at=datetime.utcnow())
+            await self.chat_repository.save_history_summary(user_id, session_id, new_summary)
+            self.logger.info(f"Updated history summary for user_id={user_id}, session_id={session_id} up to no={new_summary.up_to_no}")
+            return new_summary
+        except Exception as e:
+            self.logger.error(f"Error updating history summary for user_id={user_id}, session_id={session_id}: {str(e)}", exc_info=True)
+            return None
+        finally:
+            self._updating.discard((user_id, session_id))
@@ -0,0 +1,121 @@
+import asyncio
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from logging import getLogger
+from typing import Dict, List, Optional, Set
+from pydantic import BaseModel
+from db.chat.interface import IChatRepo
+
+class SessionDeletionJob(BaseModel):
+    job_id: str
+    user_id: str
+    # pending / running / completed / failed / cancelled
+    status: str = "pending"
+    # 削除対象のセッション数（ユーザーの全セッションを削除する場合は対象を列挙した後に設定する）
+    total_sessions: Optional[int] = None
+    deleted_sessions: int = 0
+    deleted_messages: int = 0
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+class SessionDeletionJobs:
+    """
+    セッションの一括削除をバックグラウンドで実行するジョブ管理
+
+    削除対象のセッションをbatch_size件ずつリポジトリのdelete_sessionsで削除し、進捗をジョブに記録する。
+    リクエストは削除の完了を待たずにジョブを返し、進捗はget_jobで参照する。
+    ジョブはプロセス内に保持するため、完了したジョブはmax_jobs件を超えると古いものから破棄する。
+    """
+
+    def __init__(self, chat_repository: IChatRepo, batch_size: int = 100, max_jobs: int = 1000):
+        """
+        Args:
+            chat_repository: 削除を行うリポジトリ
+            batch_size: 1回のdelete_sessionsで削除するセッション数
+            max_jobs: 保持するジョブ数の上限
+        """
+        self.logger = getLogger("uvicorn.app")
+        self.chat_repository = chat_repository
+        self.batch_size = batch_size
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, SessionDeletionJob]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def start(self, user_id: str, session_ids: Optional[List[str]] = None) -> SessionDeletionJob:
+        """
+        削除ジョブを開始し、開始時点のジョブを返す
+
+        Args:
+            user_id: ユーザーID
+            session_ids: 削除するセッションID（Noneの場合はユーザーの全セッション）
+        """
+        job = SessionDeletionJob(
+            job_id=str(uuid.uuid4()),
+            user_id=user_id,
+            total_sessions=len(set(session_ids)) if session_ids is not None else None,
+            created_at=datetime.utcnow()
+        )
+        self._jobs[job.job_id] = job
+        self._prune()
+        task = asyncio.create_task(self._run(job, list(dict.fromkeys(session_ids)) if session_ids is not None else None))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.logger.info(f"Started session deletion job {job.job_id} for user_id={user_id} ({job.total_sessions if job.total_sessions is not None else 'all'} sessions)")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[SessionDeletionJob]:
+        """ジョブを返す（存在しない場合はNone）"""
+        return self._jobs.get(job_id)
+
+    def _prune(self) -> None:
+        """上限を超えた場合、終了したジョブを古いものから破棄する"""
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                return
+            if self._jobs[job_id].status not in ("pending", "running"):
+                del self._jobs[job_id]
+
+    async def _run(self, job: SessionDeletionJob, session_ids: Optional[List[str]]) -> None:
+        """削除対象をbatch_size件ずつ削除し、進捗をジョブに記録する"""
+        job.status = "running"
+        try:
+            if session_ids is None:
+                # タイトルだけのセッションも含めて、ユーザーの全セッションを列挙する
+                summaries = await self.chat_repository.get_session_summaries(job.user_id)
+                session_ids = [summary.session_id for summary in summaries]
+                job.total_sessions = len(session_ids)
+            for i in range(0, len(session_ids), self.batch_size):
+                batch = session_ids[i:i + self.batch_size]
+                job.deleted_messages += await self.chat_repository.delete_sessions(job.user_id, batch)
+                job.deleted_sessions += len(batch)
+            job.status = "completed"
+            self.logger.info(f"Session deletion job {job.job_id} completed: {job.deleted_sessions} sessions, {job.deleted_messages} messages")
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            self.logger.warning(f"Session deletion job {job.job_id} cancelled after {job.deleted_sessions} sessions")
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            self.logger.error(f"Error in session deletion job {job.job_id} for user_id={job.user_id}: {str(e)}", exc_info=True)
+        finally:
+            job.finished_at = datetime.utcnow()
+
+    def stats(self) -> Dict[str, int]:
+        """状態ごとのジョブ数を返す"""
+        counts: Dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """実行中のジョブの完了をtimeout秒まで待ち、終わらないジョブは中断する"""
+        if not self._tasks:
+            return
+        self.logger.info(f"Waiting for {len(self._tasks)} session deletion jobs")
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
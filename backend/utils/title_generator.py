@@ -24,7 +24,7 @@ def create_title_generation_chain(llm):
     
     return prompt | llm | StrOutputParser()
 
-def generate_title_from_message_with_llm(message: str, title_chain) -> str:
+async def generate_title_from_message_with_llm(message: str, title_chain) -> str:
     """
     LLMを使ってメッセージから15文字以内のタイトルを生成する
     
@@ -39,8 +39,8 @@ def generate_title_from_message_with_llm(message: str, title_chain) -> str:
         return "新しい会話"
     
     try:
-        # LLMでタイトルを生成
-        title = title_chain.invoke({"message": message})
+        # LLMでタイトルを生成（イベントループをブロックしないよう非同期で呼び出す）
+        title = await title_chain.ainvoke({"message": message})
         
         # 生成されたタイトルをクリーンアップ
         cleaned_title = re.sub(r'\s+', ' ', title.strip())
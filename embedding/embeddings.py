@@ -124,6 +124,8 @@ def create_documents(web_pages: List[WebPageContent]):
                 'title': web_page.metadata.title or "No title",
                 'description': web_page.metadata.description or "No description",
                 'last_modified': web_page.metadata.last_modified.isoformat() if web_page.metadata.last_modified else "",
+                # Chromaのwhere句の範囲指定（$gte/$lt）は数値のみ対応のため、UNIX時間（秒）も保持する
+                'last_modified_ts': int(web_page.metadata.last_modified.timestamp()) if web_page.metadata.last_modified else 0,
                 'headers': str(web_page.metadata.headers) if web_page.metadata.headers else "{}"
             })
             documents.append(doc)
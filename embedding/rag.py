@@ -9,6 +9,9 @@ from langsmith import traceable
 from langchain_openai import AzureOpenAIEmbeddings
 from settings import get_embedding, get_chroma_client, get_collection
 
+# backendの検索コンポーネントを共有する（requirements.txtでbackendのretrievalパッケージをインストールする）
+from retrieval import HydeQueryExpander, HydeFusionRetriever
+
 
 llm = AzureChatOpenAI(
     openai_api_version="2024-12-01-preview",
@@ -39,16 +42,21 @@ def main():
     hypothetical_prompt = ChatPromptTemplate.from_template('''\
 次の質問に回答する1文を作成してください｡
 
-質問: {question}
+質問: {input}
 ''')
     hypothetical_chain = hypothetical_prompt | llm | StrOutputParser()
     
-    retriever = db.as_retriever()
+    # 質問文とHyDEの検索を並行実行し、RRFで統合する
+    retriever = HydeFusionRetriever(
+        retriever=db.as_retriever(),
+        expander=HydeQueryExpander(hypothetical_chain),
+        hyde_timeout=float(os.getenv("HYDE_TIMEOUT", "3.0"))
+    )
     
     chain = (
         {
             "question": RunnablePassthrough(),
-            "context": hypothetical_chain | retriever
+            "context": retriever
         }
         | prompt
         | llm
@@ -1,10 +1,14 @@
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from langchain_openai import AzureOpenAIEmbeddings
 import chromadb
 from chromadb.config import Settings as ChromaSettings
 
+# backendの埋め込みキャッシュを共有する（requirements.txtでbackendのretrievalパッケージをインストールする）
+from retrieval.embedding_cache import create_cached_embeddings
+
 load_dotenv()
 
 class Settings(BaseSettings):
@@ -38,15 +42,28 @@ class Settings(BaseSettings):
                 os.environ[key] = getattr(self, key)
 
 
+@lru_cache(maxsize=None)
 def get_embedding():
     """
     AzureOpenAIEmbeddingsの共通インスタンスを返す
+
+    同じテキストの埋め込みを再計算しないよう、キャッシュでラップして返す。
+    キャッシュはEMBEDDING_CACHE_PATHのSQLiteに永続化される（空文字の場合はプロセス内のみ）。
+    SQLiteにはEMBEDDING_CACHE_MAX_ROWS件まで保存し、超えた分は古く保存されたものから削除する（0の場合は無制限）。
     """
-    return AzureOpenAIEmbeddings(
+    model = os.getenv("AZURE_OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+    embeddings = AzureOpenAIEmbeddings(
         api_key=os.getenv("AZURE_OPENAI_API_KEY"),
         api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21"),
         azure_endpoint=os.getenv("AZURE_EMBEDDING_ENDPOINT"),
-        model=os.getenv("AZURE_OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+        model=model
+    )
+    return create_cached_embeddings(
+        embeddings,
+        model_name=model,
+        max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+        store_path=os.getenv("EMBEDDING_CACHE_PATH", "tmp/embedding_cache.sqlite"),
+        store_max_rows=int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "100000"))
     )
 
 
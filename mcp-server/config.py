@@ -9,4 +9,16 @@ class Config:
     mcp_server_port: str | None = os.getenv("MCP_SERVER_PORT")
     fastmcp_port: str | None = os.getenv("FASTMCP_PORT")
     log_level: str = os.getenv("LOG_LEVEL", "INFO").upper()
-    fastmcp_host: str = os.getenv("FASTMCP_HOST", "0.0.0.0")
\ No newline at end of file
+    fastmcp_host: str = os.getenv("FASTMCP_HOST", "0.0.0.0")
+    embedding_cache_size: int = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+    embedding_cache_path: str = os.getenv("EMBEDDING_CACHE_PATH", "")
+    embedding_cache_max_rows: int = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "100000"))
+    # ベクトル検索のバックエンド（chroma / local）とローカルインデックスのスナップショット
+    vector_backend: str = os.getenv("VECTOR_BACKEND", "chroma")
+    local_index_path: str = os.getenv("LOCAL_INDEX_PATH", "data/local_index")
+    local_index_mmap: bool = os.getenv("LOCAL_INDEX_MMAP", "false").lower() == "true"
+    # searchツールの検索オプションの既定値（ツールの引数で上書きできる）
+    search_k: int = int(os.getenv("SEARCH_K", "5"))
+    search_score_threshold: float | None = float(os.environ["SEARCH_SCORE_THRESHOLD"]) if os.getenv("SEARCH_SCORE_THRESHOLD") else None
+    search_type: str = os.getenv("SEARCH_TYPE", "similarity")
+    search_fetch_k: int = int(os.getenv("SEARCH_FETCH_K", "20"))
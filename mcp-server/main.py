@@ -1,5 +1,6 @@
 import logging
 import os
+from typing import List, Optional
 
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
@@ -8,6 +9,9 @@ from langchain_openai import AzureOpenAIEmbeddings
 from chromadb.config import Settings
 
 from config import Config
+from retrieval.embedding_cache import create_cached_embeddings
+from retrieval.local_index import LocalVectorIndex
+from retrieval.options import RetrievalFilter, RetrievalOptions, select_candidates, similarity_from_distance
 
 # Load configuration
 cfg = Config()
@@ -36,29 +40,60 @@ logger = logging.getLogger(server.name)
 
 # Load environment variables from .env file
 load_dotenv()
-chroma_settings = Settings(
-    anonymized_telemetry=False
-)
-client = chromadb.HttpClient(
-    host=os.getenv("CHROMA_HOST", "localhost"),
-    port=os.getenv("CHROMA_PORT", "8001"),
-    settings=chroma_settings
+collection = None
+local_index = None
+if cfg.vector_backend == "local":
+    # Chromaサーバーを使わず、コレクションのスナップショットをプロセス内で検索する
+    local_index = LocalVectorIndex(cfg.local_index_path, mmap=cfg.local_index_mmap)
+    print(f"Local index count: {len(local_index)}")
+else:
+    chroma_settings = Settings(
+        anonymized_telemetry=False
+    )
+    client = chromadb.HttpClient(
+        host=os.getenv("CHROMA_HOST", "localhost"),
+        port=os.getenv("CHROMA_PORT", "8001"),
+        settings=chroma_settings
+    )
+    collection_name = os.getenv("CHROMA_COLLECTION_NAME", "gcas_azure_guide_openai")
+    collection = client.get_or_create_collection(collection_name, metadata={
+        "url": "https://guide.gcas.cloud.go.jp/azure/"
+    })
+    print(f"Collection count: {collection.count()}")
+
+# searchツールの検索オプションの既定値
+default_search_options = RetrievalOptions(
+    k=cfg.search_k,
+    score_threshold=cfg.search_score_threshold,
+    search_type=cfg.search_type,
+    fetch_k=cfg.search_fetch_k
 )
-collection_name = os.getenv("CHROMA_COLLECTION_NAME", "gcas_azure_guide_openai")
-collection = client.get_or_create_collection(collection_name, metadata={
-    "url": "https://guide.gcas.cloud.go.jp/azure/"
-})
-print(f"Collection count: {collection.count()}")
-
-embeddings = AzureOpenAIEmbeddings(
-    api_key = os.getenv("AZURE_OPENAI_API_KEY"),  
-    api_version = os.getenv("AZURE_EMBEDDING_API_VERSION"),
-    azure_endpoint =os.getenv("AZURE_EMBEDDING_ENDPOINT"),
-    model=os.getenv("AZURE_EMBEDDING_MODEL")
+
+# 同じクエリの埋め込みを再計算しないよう、キャッシュでラップする
+embeddings = create_cached_embeddings(
+    AzureOpenAIEmbeddings(
+        api_key = os.getenv("AZURE_OPENAI_API_KEY"),  
+        api_version = os.getenv("AZURE_EMBEDDING_API_VERSION"),
+        azure_endpoint =os.getenv("AZURE_EMBEDDING_ENDPOINT"),
+        model=os.getenv("AZURE_EMBEDDING_MODEL")
+    ),
+    model_name=os.getenv("AZURE_EMBEDDING_MODEL", ""),
+    max_entries=cfg.embedding_cache_size,
+    store_path=cfg.embedding_cache_path,
+    store_max_rows=cfg.embedding_cache_max_rows
 )
 
 @server.tool()
-def search(query: str) -> str:
+def search(
+    query: str,
+    k: Optional[int] = None,
+    score_threshold: Optional[float] = None,
+    search_type: Optional[str] = None,
+    urls: Optional[List[str]] = None,
+    titles: Optional[List[str]] = None,
+    modified_after: Optional[str] = None,
+    modified_before: Optional[str] = None
+) -> str:
     """
     ベクトルデータベース（ChromaDB）から、与えられたクエリに最も関連するドキュメントを検索します。
 
@@ -78,21 +113,52 @@ def search(query: str) -> str:
 
     Args:
         query (str): 検索したい内容（日本語・英語どちらも可）
+        k (int, optional): 返却するドキュメント数
+        score_threshold (float, optional): この値未満のコサイン類似度のドキュメントを除く
+        search_type (str, optional): "similarity"（類似度の高い順） または "mmr"（多様性を考慮して選ぶ）
+        urls (List[str], optional): 検索対象をこれらのURLのページに限定する
+        titles (List[str], optional): 検索対象をこれらのタイトルのページに限定する
+        modified_after (str, optional): この日時（ISO 8601）以降に更新されたページに限定する
+        modified_before (str, optional): この日時（ISO 8601）より前に更新されたページに限定する
     Returns:
         str: 検索結果のドキュメント本文やメタデータ
     """
+    overrides = {
+        name: value for name, value in
+        {"k": k, "score_threshold": score_threshold, "search_type": search_type}.items()
+        if value is not None
+    }
+    search_filter = RetrievalFilter(urls=urls, titles=titles, modified_after=modified_after, modified_before=modified_before)
+    if search_filter.to_where() is not None:
+        overrides["filter"] = search_filter
+    options = RetrievalOptions.model_validate({**default_search_options.model_dump(), **overrides})
     query_embedding = embeddings.embed_query(query)
-    
-    results = collection.query(
-        query_embeddings=query_embedding,
-        n_results=5,
-        include=["documents", "metadatas", "distances"]
-    )
-    if not results["documents"][0]:
+
+    if local_index is not None:
+        mask = options.filter.to_mask(local_index.metadata_column) if options.filter is not None else None
+        results = local_index.search(query_embedding, options.candidates, mask=mask)
+        rows = [row for row, _ in results]
+        candidates = [local_index.record(row)["document"] for row in rows]
+        scores = [score for _, score in results]
+        candidate_embeddings = local_index.embeddings(rows) if options.search_type == "mmr" and rows else None
+    else:
+        # メタデータの絞り込みはChroma側で行い、候補を減らしてから検索する
+        results = collection.query(
+            query_embeddings=[query_embedding],
+            n_results=options.candidates,
+            where=options.where(),
+            include=["documents", "metadatas", "distances"] + (["embeddings"] if options.search_type == "mmr" else [])
+        )
+        space = (collection.metadata or {}).get("hnsw:space", "l2")
+        candidates = results["documents"][0]
+        scores = [similarity_from_distance(distance, space) for distance in results["distances"][0]]
+        candidate_embeddings = results["embeddings"][0] if options.search_type == "mmr" else None
+
+    documents = [candidates[i] for i in select_candidates(query_embedding, scores, candidate_embeddings, options)]
+    if not documents:
         logger.error(f"No results found for query: {query}")
         return
-    
-    return results['documents'][0]
+    return documents
 
 # Define a 'greeting' resource.
 # This resource takes a 'name' from the URI (e.g., greeting://World)